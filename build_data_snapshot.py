@@ -0,0 +1,21 @@
+import sys
+import time
+
+from dataset_engine import load_json_store, save_snapshot
+
+
+def build_data_snapshot(data_dir='data'):
+    """Compile the static *_data_static.json files into the binary snapshot"""
+    start = time.perf_counter()
+    store = load_json_store(data_dir)
+    binary_path = save_snapshot(store, data_dir)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    total_categories = sum(len(dataset) for dataset in store.datasets.values())
+    print(f"Snapshot salvo em {binary_path}: {len(store.municipalities)} municípios, "
+          f"{total_categories} categorias ({elapsed:.0f} ms)")
+    return binary_path
+
+
+if __name__ == "__main__":
+    build_data_snapshot(sys.argv[1] if len(sys.argv) > 1 else 'data')
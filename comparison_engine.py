@@ -0,0 +1,119 @@
+import numpy as np
+
+from dataset_engine import SOURCES_BY_NAME
+
+# Máximo de séries comparadas numa chamada
+COMPARE_MAX_SERIES = 20
+
+
+def _average_ranks(values):
+    """Ranks 1..n of each value, ties sharing their average rank (as in Spearman)"""
+    order = np.argsort(values, kind='stable')
+    ordered = values[order]
+    # Início de cada grupo de valores iguais
+    starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+    ends = np.r_[starts[1:], len(values)]
+    group_rank = (starts + ends + 1) / 2.0
+    ranks = np.empty(len(values))
+    ranks[order] = np.repeat(group_rank, ends - starts)
+    return ranks
+
+
+def _correlation(matrix):
+    """Correlation matrix of the rows of `matrix`, None where undefined (constant series)"""
+    if matrix.shape[1] < 2:
+        return [[None] * len(matrix) for _ in matrix]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr = np.corrcoef(matrix)
+    corr = np.atleast_2d(corr)
+    return [[None if np.isnan(value) else round(float(value), 6) for value in row] for row in corr]
+
+
+class Comparison:
+    """Several (source, category) series aligned on the municipalities where all have values"""
+
+    def __init__(self, store, series, state=None):
+        self.series = series
+        municipalities = store.municipalities
+        mask = np.ones(len(municipalities), dtype=bool)
+        columns = []
+        for source, category in series:
+            dataset = store[source]
+            column = dataset.column(category)
+            mask &= ~np.isnan(column)
+            mask &= municipalities.valid_mask(SOURCES_BY_NAME[source]['filter'])
+            columns.append(column)
+        if state:
+            mask &= municipalities.state_mask(state)
+
+        self.rows = np.flatnonzero(mask)
+        # Matriz séries × municípios comuns
+        self.matrix = np.vstack([column[self.rows] for column in columns]) if columns else np.empty((0, 0))
+        totals = self.matrix.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Participação de cada série no total do município e razão contra a 1ª série
+            self.shares = np.where(totals > 0, self.matrix / totals, 0.0)
+            self.ratios = self.matrix / np.maximum(self.matrix[:1], 1)
+        self.integral = [bool(store[source].integral[store[source].category_index[category]])
+                         for source, category in series]
+        self.units = [store[source].unit(category) or SOURCES_BY_NAME[source]['unit']
+                      for source, category in series]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _values(self, i, columns):
+        values = self.matrix[i, columns]
+        return values.astype(np.int64).tolist() if self.integral[i] else values.tolist()
+
+    def summary(self):
+        """Per-series totals and Pearson/Spearman correlation matrices"""
+        totals = self.matrix.sum(axis=1)
+        grand_total = totals.sum()
+        ranks = np.vstack([_average_ranks(row) for row in self.matrix]) if len(self) else self.matrix
+        return {
+            'series': [
+                {
+                    'source': source,
+                    'category': category,
+                    'unit': unit,
+                    'total': float(total),
+                    'mean': float(total / len(self)) if len(self) else None,
+                    'share': float(total / grand_total) if grand_total > 0 else None
+                }
+                for (source, category), unit, total in zip(self.series, self.units, totals.tolist())
+            ],
+            'common_municipalities': len(self),
+            'correlation': {
+                'pearson': _correlation(self.matrix),
+                'spearman': _correlation(ranks)
+            }
+        }
+
+    def page(self, municipalities, offset, limit):
+        """Row-oriented slice: [{municipality_code, ..., values, shares, ratios}]"""
+        columns = np.arange(offset, min(offset + limit, len(self)))
+        rows = self.rows[columns].tolist()
+        values = [self._values(i, columns) for i in range(len(self.series))]
+        shares = np.round(self.shares[:, columns], 6).T.tolist()
+        ratios = self.ratios[:, columns].T.tolist()
+        return [
+            {
+                'municipality_code': str(municipalities.codes[row]),
+                'municipality_name': municipalities.names[row],
+                'state_code': str(municipalities.states[row]),
+                'values': [series_values[j] for series_values in values],
+                'shares': shares[j],
+                'ratios': ratios[j]
+            }
+            for j, row in enumerate(rows)
+        ]
+
+    def columnar(self, municipalities):
+        """Parallel arrays: codes/states plus one values/shares vector per series"""
+        return {
+            'codes': municipalities.codes[self.rows].tolist(),
+            'states': municipalities.states[self.rows].tolist(),
+            'values': [self._values(i, slice(None)) for i in range(len(self.series))],
+            'shares': np.round(self.shares, 6).tolist()
+        }
@@ -0,0 +1,710 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+
+# Versão do layout binário do snapshot; incrementar ao mudar o formato
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_INDEX = 'datasets.snapshot.json'
+
+# Políticas de validação de municípios usadas pelos endpoints
+FILTER_BASIC = 'basic'      # código IBGE de município (7 dígitos, 1-5) com nome
+FILTER_REGIONS = 'regions'  # + exclui nomes que indicam regiões/agregações
+FILTER_STRICT = 'strict'    # + exclui nomes genéricos que são claramente regiões
+
+# Registro declarativo das fontes estáticas: arquivo, campo de valor, unidade padrão e política
+# de filtro. routes.py monta a partir dele as rotas genéricas de categorias, camada e exportação
+# (`routes: False` para fontes com rotas próprias, como culturas). Chaves opcionais: urls
+# (sobrescreve as URLs padrão), title (mensagens), export_prefix, value_key (nome do valor no
+# JSON da camada), sort_categories, export_summary (planilhas de resumo na exportação),
+# export_unit (rótulo fixo da coluna Unidade na exportação, no lugar da unidade do dado).
+SOURCE_REGISTRY = [
+    {'name': 'crop', 'file': 'crop_data_static.json', 'value_field': 'harvested_area',
+     'unit': 'hectares', 'filter': FILTER_STRICT, 'label': 'crop data', 'routes': False},
+    {'name': 'fertilizer', 'file': 'fertilizer_data_static_corrigido.json', 'value_field': 'value',
+     'unit': 'un', 'filter': FILTER_REGIONS, 'label': 'fertilizer data',
+     'title': 'fertilizantes', 'export_prefix': '', 'value_key': 'harvested_area',
+     'sort_categories': True, 'export_summary': True, 'export_unit': 'estabelecimentos',
+     'urls': {'categories': '/api/fertilizer-categories',
+              'data': '/api/fertilizer-data/<category>',
+              'export': '/api/export/fertilizer-analysis/<category>'}},
+    {'name': 'agrotoxico', 'file': 'agrotoxico_data_static.json', 'value_field': 'value',
+     'unit': 'un', 'filter': FILTER_BASIC, 'label': 'agrotoxico data', 'title': 'agrotóxico'},
+    {'name': 'consultoria', 'file': 'consultoria_tecnica_data_static.json', 'value_field': 'value',
+     'unit': 'un', 'filter': FILTER_BASIC, 'label': 'consultoria tecnica data', 'title': 'consultoria'},
+    {'name': 'corretivos', 'file': 'corretivos_data_static.json', 'value_field': 'value',
+     'unit': 'un', 'filter': FILTER_BASIC, 'label': 'corretivos data', 'title': 'corretivo',
+     'export_prefix': 'corretivo_'},
+    {'name': 'despesa', 'file': 'despesa_data_static.json', 'value_field': 'value',
+     'unit': 'R$', 'filter': FILTER_BASIC, 'label': 'despesa data', 'title': 'despesa'},
+    {'name': 'escolaridade', 'file': 'escolaridade_data_static.json', 'value_field': 'value',
+     'unit': 'un', 'filter': FILTER_BASIC, 'label': 'escolaridade data', 'title': 'escolaridade'},
+    {'name': 'receita', 'file': 'receita_data_static.json', 'value_field': 'value',
+     'unit': 'R$', 'filter': FILTER_BASIC, 'label': 'receita data', 'title': 'receita'},
+]
+SOURCES_BY_NAME = {source['name']: source for source in SOURCE_REGISTRY}
+
+# Fontes carregadas na inicialização: (nome, arquivo, campo de valor, rótulo para log)
+DATA_SOURCES = [
+    (source['name'], source['file'], source['value_field'], source['label'])
+    for source in SOURCE_REGISTRY
+]
+
+# Nomes que indicam regiões/agregações
+REGION_KEYWORDS = [
+    'região', 'mesorregião', 'microrregião', 'nordeste', 'norte', 'sul',
+    'centro', 'oeste', 'leste', 'sudeste', 'noroeste', 'sudoeste',
+    'alto ', 'baixo ', 'médio ', '-grossense', 'parecis', 'araguaia',
+    'pantanal', 'cerrado', 'amazônia', 'caatinga', 'mata atlântica'
+]
+
+# Nomes muito genéricos ou que são claramente regiões
+REGION_NAME_BLACKLIST = {
+    'alto teles pires', 'sudeste mato-grossense', 'parecis', 'barreiras',
+    'dourados', 'norte mato-grossense', 'portal da amazônia'
+}
+
+
+def is_municipality_code(code):
+    """Códigos de município IBGE têm 7 dígitos e começam com 1-5 (0 = agregação)"""
+    code = str(code)
+    return len(code) == 7 and code.isdigit() and code[0] in '12345'
+
+
+def normalize_code(code):
+    """Chave de município como texto: dígitos ficam como estão, números gravados como float
+    ('1100015.0') viram inteiros; None se a chave não for numérica"""
+    code = str(code).strip()
+    if code.isdigit():
+        return code
+    try:
+        number = float(code)
+    except ValueError:
+        return None
+    if not number.is_integer() or number < 0:
+        return None
+    return str(int(number))
+
+
+def classify_municipality(code, name):
+    """Retorna a política mais restrita que o município satisfaz, ou None"""
+    if not is_municipality_code(code) or not name:
+        return None
+    name = name.lower()
+    if any(keyword in name for keyword in REGION_KEYWORDS):
+        return FILTER_BASIC
+    if name in REGION_NAME_BLACKLIST:
+        return FILTER_REGIONS
+    return FILTER_STRICT
+
+
+class MunicipalityDimension:
+    """Shared municipality table (code, name, state) indexed by row"""
+
+    LEVELS = {FILTER_BASIC: 1, FILTER_REGIONS: 2, FILTER_STRICT: 3}
+
+    def __init__(self, codes, names, states, levels=None):
+        # Largura do texto pela maior chave: nenhum código é truncado
+        self.codes = np.asarray(codes, dtype=str)
+        self.names = list(names)
+        self.states = np.asarray(states, dtype='U2')
+        self.index = {code: row for row, code in enumerate(self.codes.tolist())}
+        self.state_codes = frozenset(self.states.tolist())
+
+        # Classificação feita uma única vez na carga: uma máscara por política
+        if levels is None:
+            levels = np.array([self.LEVELS.get(classify_municipality(code, name), 0)
+                               for code, name in zip(self.codes.tolist(), self.names)], dtype=np.int8)
+        self.levels = levels
+        self.masks = {policy: levels >= minimum for policy, minimum in self.LEVELS.items()}
+        self._valid_codes = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, code):
+        return str(code) in self.index
+
+    def row_of(self, code):
+        """Retorna a linha do município ou None"""
+        return self.index.get(str(code))
+
+    def rows_of(self, codes):
+        """Linhas de uma lista de códigos (na ordem dada) e os códigos desconhecidos"""
+        rows, missing = [], []
+        for code in codes:
+            row = self.index.get(str(code))
+            if row is None:
+                missing.append(str(code))
+            else:
+                rows.append(row)
+        return np.array(rows, dtype=np.intp), missing
+
+    def mask_of(self, rows):
+        """Máscara booleana (bitset) da dimensão com as linhas informadas"""
+        mask = np.zeros(len(self.codes), dtype=bool)
+        mask[rows] = True
+        return mask
+
+    def valid_mask(self, policy=FILTER_STRICT):
+        """Máscara booleana dos municípios válidos segundo a política"""
+        return self.masks[policy]
+
+    def valid_codes(self, policy=FILTER_STRICT):
+        """Conjunto de códigos válidos, para testes de pertinência O(1)"""
+        if policy not in self._valid_codes:
+            self._valid_codes[policy] = frozenset(self.codes[self.masks[policy]].tolist())
+        return self._valid_codes[policy]
+
+    def state_mask(self, state_code):
+        return self.states == state_code
+
+
+class Dataset:
+    """One static source stored as a (categories x municipalities) value matrix"""
+
+    def __init__(self, name, value_field, municipalities, categories, values, units, integral):
+        self.name = name
+        self.value_field = value_field
+        self.municipalities = municipalities
+        self.categories = list(categories)
+        self.category_index = {category: i for i, category in enumerate(self.categories)}
+        # NaN marca município sem registro na categoria
+        self.values = values
+        self.units = list(units)
+        self.integral = list(integral)
+
+    def __len__(self):
+        return len(self.categories)
+
+    def __contains__(self, category):
+        return category in self.category_index
+
+    def column(self, category):
+        """Vetor de valores da categoria alinhado à dimensão de municípios"""
+        return self.values[self.category_index[category]]
+
+    def unit(self, category):
+        return self.units[self.category_index[category]]
+
+    def rows(self, category, policy=None, state=None):
+        """Linhas (municípios) com registro na categoria, opcionalmente filtradas"""
+        mask = ~np.isnan(self.column(category))
+        if policy is not None:
+            mask &= self.municipalities.valid_mask(policy)
+        if state:
+            mask &= self.municipalities.state_mask(state)
+        return np.flatnonzero(mask)
+
+    def present_rows(self):
+        """Linhas com registro em pelo menos uma categoria"""
+        if not self.categories:
+            return np.empty(0, dtype=np.intp)
+        return np.flatnonzero((~np.isnan(self.values)).any(axis=0))
+
+    def values_at(self, category, rows):
+        """Valores da categoria nas linhas informadas, como tipos nativos do Python"""
+        i = self.category_index[category]
+        selected = self.values[i, rows]
+        if self.integral[i]:
+            return selected.astype(np.int64).tolist()
+        return selected.tolist()
+
+    def records(self, category, rows=None, value_key=None, default_unit=None):
+        """Materializa a categoria no formato legado {código: registro}"""
+        if rows is None:
+            rows = self.rows(category)
+        value_key = value_key or self.value_field
+        unit = self.unit(category) or default_unit
+        dimension = self.municipalities
+        codes = dimension.codes[rows].tolist()
+        states = dimension.states[rows].tolist()
+        values = self.values_at(category, rows)
+
+        data = {}
+        for row, code, state, value in zip(rows.tolist(), codes, states, values):
+            entry = {
+                'municipality_name': dimension.names[row],
+                'state_code': state,
+                value_key: value
+            }
+            if unit is not None:
+                entry['unit'] = unit
+            data[code] = entry
+        return data
+
+    def columnar(self, category, rows=None):
+        """Arrays paralelos {codes, values} para o formato de transferência colunar"""
+        if rows is None:
+            rows = self.rows(category)
+        return {
+            'codes': self.municipalities.codes[rows].tolist(),
+            'values': self.values_at(category, rows)
+        }
+
+    def dense_float32(self, category, rows=None):
+        """Vetor Float32 alinhado à ordem da dimensão (NaN fora de `rows`)"""
+        column = self.column(category)
+        if rows is None:
+            return column.astype('<f4')
+        dense = np.full(len(self.municipalities), np.nan, dtype='<f4')
+        dense[rows] = column[rows]
+        return dense
+
+    def row_values(self, row_vector):
+        """{categoria: valor} de um município a partir da sua linha município-major (sem NaN)"""
+        result = {}
+        for i in np.flatnonzero(~np.isnan(row_vector)).tolist():
+            value = row_vector[i]
+            result[self.categories[i]] = int(value) if self.integral[i] else float(value)
+        return result
+
+    def items(self, category, value_key=None, default_unit=None):
+        """Itera (código, registro) como o antigo dict.items()"""
+        return self.records(category, value_key=value_key, default_unit=default_unit).items()
+
+
+class DatasetStore:
+    """All sources sharing a single municipality dimension"""
+
+    def __init__(self, municipalities, datasets, fingerprints=None, origin='json'):
+        self.municipalities = municipalities
+        self.datasets = datasets
+        # Identificação dos arquivos de origem: {fonte: {size, mtime_ns, sha1}}
+        self.fingerprints = fingerprints or {}
+        self.origin = origin
+        # Atribuída pelo DatasetRegistry a cada troca
+        self.version = 0
+        self.loaded_at = time.time()
+        # Índices derivados (nomes, rankings, estatísticas...) construídos sob demanda
+        self._derived = {}
+        self._derived_lock = threading.RLock()
+
+    def __getitem__(self, name):
+        return self.datasets[name]
+
+    def __contains__(self, name):
+        return name in self.datasets
+
+    def municipality_major(self):
+        """Índice invertido: por fonte, matriz (municípios x categorias) contígua por município"""
+        return self.derived('municipality_major', lambda s: {
+            name: np.ascontiguousarray(dataset.values.T) for name, dataset in s.datasets.items()
+        })
+
+    def profile(self, code, sources=None):
+        """Todos os valores de um município, por fonte: {fonte: {categoria: valor}}; None se desconhecido"""
+        row = self.municipalities.row_of(code)
+        if row is None:
+            return None
+        major = self.municipality_major()
+        return {
+            name: dataset.row_values(major[name][row])
+            for name, dataset in self.datasets.items()
+            if sources is None or name in sources
+        }
+
+    def derived(self, key, build):
+        """Structure computed from this store once (build(store)), dropped with it on reload"""
+        value = self._derived.get(key)
+        if value is None:
+            with self._derived_lock:
+                value = self._derived.get(key)
+                if value is None:
+                    value = build(self)
+                    self._derived[key] = value
+        return value
+
+
+def _fingerprint(path, content=None):
+    """Tamanho, mtime e sha1 de um arquivo de origem (None se não existir)"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if content is None:
+        with open(path, 'rb') as f:
+            content = f.read()
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha1': hashlib.sha1(content).hexdigest()
+    }
+
+
+def _read_source(path, label):
+    try:
+        with open(path, 'rb') as f:
+            content = f.read()
+        raw = json.loads(content.decode('utf-8'))
+        print(f"Loaded {label} with {len(raw)} categories")
+        return raw, _fingerprint(path, content)
+    except Exception as e:
+        print(f"Error loading {label}: {e}")
+        return {}, _fingerprint(path)
+
+
+def _to_number(value):
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(str(value).replace(',', '.'))
+    except (TypeError, ValueError):
+        return 0
+
+
+def build_store(raw_sources, sources=DATA_SOURCES, fingerprints=None, previous=None):
+    """Converte os dicts aninhados {categoria: {código: registro}} em matrizes colunares
+
+    Fontes ausentes de raw_sources são reaproveitadas de `previous` (recarga parcial).
+    """
+    reused = set()
+    if previous is not None:
+        reused = {name for name, _, _, _ in sources if name not in raw_sources and name in previous}
+
+    # Primeira passada: dimensão única de municípios para todas as fontes
+    names = {}
+    states = {}
+    skipped = {}
+
+    def add_municipality(code, municipality_name, state_code):
+        if not names.get(code) and municipality_name:
+            names[code] = municipality_name
+        if not states.get(code) and state_code:
+            states[code] = state_code
+        names.setdefault(code, '')
+
+    for name, _, _, _ in sources:
+        if name in reused:
+            dimension = previous.municipalities
+            for row in previous[name].present_rows().tolist():
+                add_municipality(str(dimension.codes[row]), dimension.names[row], str(dimension.states[row]))
+            continue
+        for category_data in raw_sources.get(name, {}).values():
+            for code, entry in category_data.items():
+                normalized = normalize_code(code)
+                if normalized is None:
+                    skipped.setdefault(name, set()).add(str(code))
+                    continue
+                add_municipality(normalized, entry.get('municipality_name'), entry.get('state_code'))
+
+    for name, codes in skipped.items():
+        print(f"{name}: {len(codes)} chaves de município inválidas ignoradas (ex.: {sorted(codes)[:3]})")
+
+    codes = sorted(names)
+    municipalities = MunicipalityDimension(
+        codes,
+        [names[code] for code in codes],
+        [states.get(code, 'XX') for code in codes]
+    )
+
+    # Segunda passada: uma matriz de valores por fonte
+    datasets = {}
+    for name, _, value_field, _ in sources:
+        if name in reused:
+            # Reindexar a matriz existente para a nova dimensão de municípios
+            old = previous[name]
+            old_rows = old.present_rows()
+            new_rows = [municipalities.index[code] for code in previous.municipalities.codes[old_rows].tolist()]
+            values = np.full((len(old.categories), len(municipalities)), np.nan)
+            values[:, new_rows] = old.values[:, old_rows]
+            datasets[name] = Dataset(name, value_field, municipalities, old.categories, values, old.units, old.integral)
+            continue
+
+        raw = raw_sources.get(name, {})
+        categories = list(raw.keys())
+        values = np.full((len(categories), len(municipalities)), np.nan)
+        units = []
+        integral = []
+        for i, category in enumerate(categories):
+            unit = None
+            all_int = True
+            for code, entry in raw[category].items():
+                row = municipalities.index.get(normalize_code(code))
+                if row is None:
+                    continue
+                value = _to_number(entry.get(value_field, 0))
+                if not isinstance(value, int):
+                    all_int = False
+                values[i, row] = value
+                if unit is None:
+                    unit = entry.get('unit')
+            units.append(unit)
+            integral.append(all_int)
+        datasets[name] = Dataset(name, value_field, municipalities, categories, values, units, integral)
+
+    if previous is not None:
+        fingerprints = dict(fingerprints or {})
+        for name in reused:
+            fingerprints[name] = previous.fingerprints.get(name)
+    return DatasetStore(municipalities, datasets, fingerprints)
+
+
+def load_json_store(data_dir='data', sources=DATA_SOURCES):
+    """Carrega os arquivos *_data_static.json e monta o armazenamento colunar"""
+    raw_sources = {}
+    fingerprints = {}
+    for name, filename, _, label in sources:
+        raw_sources[name], fingerprints[name] = _read_source(os.path.join(data_dir, filename), label)
+    return build_store(raw_sources, sources, fingerprints)
+
+
+def load_store(data_dir='data', sources=DATA_SOURCES):
+    """Mapeia o snapshot binário se estiver atualizado; senão usa os JSON"""
+    store = load_snapshot(data_dir, sources)
+    if store is not None:
+        return store
+    return load_json_store(data_dir, sources)
+
+
+# Snapshot binário: um arquivo com todas as matrizes (mapeado com np.memmap,
+# compartilhado entre workers pelo page cache) + um índice JSON pequeno.
+
+def _align(offset, alignment=64):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def save_snapshot(store, data_dir='data', sources=DATA_SOURCES):
+    """Grava o snapshot binário e o índice; retorna o caminho do binário"""
+    municipalities = store.municipalities
+    arrays = [
+        ('codes', municipalities.codes),
+        ('states', municipalities.states),
+        ('levels', np.asarray(municipalities.levels, dtype=np.int8))
+    ]
+    for name, _, _, _ in sources:
+        arrays.append((f'values:{name}', np.ascontiguousarray(store[name].values, dtype=np.float64)))
+
+    # Versão do snapshot derivada do conteúdo das fontes
+    digest = hashlib.sha1(str(SNAPSHOT_FORMAT).encode())
+    for name, _, _, _ in sources:
+        digest.update(name.encode())
+        digest.update(((store.fingerprints.get(name) or {}).get('sha1') or '-').encode())
+    version = digest.hexdigest()[:16]
+    binary_name = f'datasets-{version}.snapshot'
+
+    layout = {}
+    offset = 0
+    for key, array in arrays:
+        offset = _align(offset)
+        layout[key] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        offset += array.nbytes
+
+    index = {
+        'format': SNAPSHOT_FORMAT,
+        'version': version,
+        'binary': binary_name,
+        'size': offset,
+        'arrays': layout,
+        'names': municipalities.names,
+        'sources': {}
+    }
+    for name, _, value_field, _ in sources:
+        dataset = store[name]
+        index['sources'][name] = {
+            'value_field': value_field,
+            'categories': dataset.categories,
+            'units': dataset.units,
+            'integral': dataset.integral,
+            'fingerprint': store.fingerprints.get(name)
+        }
+
+    # Escrita atômica: binário com nome versionado, depois troca do índice
+    binary_path = os.path.join(data_dir, binary_name)
+    temp_path = f'{binary_path}.{uuid.uuid4().hex}.tmp'
+    with open(temp_path, 'wb') as f:
+        for key, array in arrays:
+            f.seek(layout[key]['offset'])
+            f.write(array.tobytes())
+        f.truncate(offset)
+    os.replace(temp_path, binary_path)
+
+    index_path = os.path.join(data_dir, SNAPSHOT_INDEX)
+    temp_path = f'{index_path}.{uuid.uuid4().hex}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(temp_path, index_path)
+
+    # Remover binários de versões anteriores (workers que já mapearam continuam válidos)
+    for filename in os.listdir(data_dir):
+        if filename.startswith('datasets-') and filename.endswith('.snapshot') and filename != binary_name:
+            try:
+                os.remove(os.path.join(data_dir, filename))
+            except OSError:
+                pass
+
+    return binary_path
+
+
+def _source_is_current(path, fingerprint):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return fingerprint is None
+    if fingerprint is None:
+        return False
+    if stat.st_size == fingerprint['size'] and stat.st_mtime_ns == fingerprint['mtime_ns']:
+        return True
+    # mtime muda em checkout/deploy; confirmar pelo conteúdo
+    current = _fingerprint(path)
+    if current is None or current['sha1'] != fingerprint['sha1']:
+        return False
+    # Mesmo conteúdo: guardar o stat atual para as próximas checagens não relerem o arquivo
+    fingerprint['size'], fingerprint['mtime_ns'] = current['size'], current['mtime_ns']
+    return True
+
+
+def load_snapshot(data_dir='data', sources=DATA_SOURCES):
+    """Carrega o snapshot se existir e corresponder às fontes JSON; senão None"""
+    index_path = os.path.join(data_dir, SNAPSHOT_INDEX)
+    if not os.path.exists(index_path):
+        return None
+
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+
+        if index.get('format') != SNAPSHOT_FORMAT:
+            print(f"Snapshot ignorado: formato {index.get('format')} != {SNAPSHOT_FORMAT}")
+            return None
+
+        fingerprints = {}
+        for name, filename, value_field, _ in sources:
+            meta = index['sources'].get(name)
+            if meta is None or meta['value_field'] != value_field:
+                print(f"Snapshot ignorado: fonte {name} ausente ou diferente")
+                return None
+            if not _source_is_current(os.path.join(data_dir, filename), meta['fingerprint']):
+                print(f"Snapshot desatualizado para {filename}, usando JSON")
+                return None
+            fingerprints[name] = meta['fingerprint']
+
+        binary_path = os.path.join(data_dir, index['binary'])
+        if os.path.getsize(binary_path) != index['size']:
+            print("Snapshot ignorado: tamanho do binário não confere com o índice")
+            return None
+
+        def mapped(key):
+            layout = index['arrays'][key]
+            shape = tuple(layout['shape'])
+            if 0 in shape:
+                return np.zeros(shape, dtype=np.dtype(layout['dtype']))
+            return np.memmap(binary_path, dtype=np.dtype(layout['dtype']), mode='r',
+                             offset=layout['offset'], shape=shape)
+
+        municipalities = MunicipalityDimension(
+            mapped('codes'), index['names'], mapped('states'), levels=np.asarray(mapped('levels'))
+        )
+        datasets = {}
+        for name, _, value_field, label in sources:
+            meta = index['sources'][name]
+            datasets[name] = Dataset(name, value_field, municipalities, meta['categories'],
+                                     mapped(f'values:{name}'), meta['units'], meta['integral'])
+            print(f"Loaded {label} with {len(meta['categories'])} categories (snapshot {index['version']})")
+
+        return DatasetStore(municipalities, datasets, fingerprints, origin='snapshot')
+    except Exception as e:
+        print(f"Erro ao carregar snapshot, usando JSON: {e}")
+        return None
+
+
+class DatasetRegistry:
+    """Holds the current DatasetStore and swaps it atomically on reload
+
+    Handlers must call current() once per request and use that store for the
+    whole request, so a reload in the middle never mixes two versions.
+    """
+
+    def __init__(self, data_dir='data', sources=DATA_SOURCES):
+        self.data_dir = data_dir
+        self.sources = sources
+        self._reload_lock = threading.Lock()
+        self._listeners = []
+        self._watcher = None
+        self._store = load_store(data_dir, sources)
+        self._store.version = 1
+
+    def current(self):
+        return self._store
+
+    def add_listener(self, callback):
+        """Registra callback(store) chamado após cada troca (ex.: invalidar caches)"""
+        self._listeners.append(callback)
+
+    def changed_sources(self):
+        """Fontes cujo arquivo difere do que está carregado"""
+        store = self._store
+        changed = []
+        for name, filename, _, _ in self.sources:
+            path = os.path.join(self.data_dir, filename)
+            if not _source_is_current(path, store.fingerprints.get(name)):
+                changed.append(name)
+        return changed
+
+    def reload(self, force=False):
+        """Recarrega as fontes alteradas (ou todas, com force) e troca a referência"""
+        with self._reload_lock:
+            previous = self._store
+            changed = [name for name, _, _, _ in self.sources] if force else self.changed_sources()
+            if not changed:
+                return []
+
+            start = time.perf_counter()
+            raw_sources = {}
+            fingerprints = {}
+            for name, filename, _, label in self.sources:
+                if name in changed:
+                    raw_sources[name], fingerprints[name] = _read_source(os.path.join(self.data_dir, filename), label)
+            store = build_store(raw_sources, self.sources, fingerprints, previous=previous)
+            store.version = previous.version + 1
+
+            # Troca atômica: requisições em andamento continuam com a versão anterior
+            self._store = store
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"Datasets recarregados ({', '.join(changed)}) -> versão {store.version} em {elapsed:.0f} ms")
+
+            for callback in self._listeners:
+                try:
+                    callback(store)
+                except Exception as e:
+                    print(f"Erro em listener de recarga: {e}")
+            return changed
+
+    def start_watcher(self, interval=30):
+        """Verifica data/ periodicamente em uma thread de fundo (interval <= 0 desativa)"""
+        if interval <= 0 or self._watcher is not None:
+            return
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload()
+                except Exception as e:
+                    print(f"Erro ao recarregar datasets: {e}")
+
+        self._watcher = threading.Thread(target=watch, name='dataset-watcher', daemon=True)
+        self._watcher.start()
+
+    def status(self):
+        store = self._store
+        return {
+            'version': store.version,
+            'origin': store.origin,
+            'loaded_at': datetime.fromtimestamp(store.loaded_at).isoformat(timespec='seconds'),
+            'municipalities': len(store.municipalities),
+            'sources': {
+                name: {
+                    'categories': len(dataset),
+                    'sha1': (store.fingerprints.get(name) or {}).get('sha1')
+                }
+                for name, dataset in store.datasets.items()
+            }
+        }
@@ -0,0 +1,154 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+# Artefatos de exportação e intermediários já convertidos, endereçados pelo conteúdo
+EXPORT_CACHE_DIR = os.path.join('data', 'export_cache')
+# Espaço máximo dos artefatos de exportação (LRU)
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+ARTIFACT_PREFIX = 'artifact-'
+
+_digests = {}
+_frames = {}
+_lock = threading.Lock()
+
+
+def file_digest(path):
+    """sha1 of a file, recomputed only when its size or mtime changes"""
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    digest = _digests.get(key)
+    if digest is None:
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(chunk)
+        digest = sha1.hexdigest()
+        _digests[key] = digest
+    return digest
+
+
+def atomic_write(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            write(f)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class ArtifactCache:
+    """Export files on disk keyed by their inputs, with LRU eviction under a size cap
+
+    Recency is the file atime (set explicitly on every hit; mtime stays the build time), so it
+    survives restarts and is shared by all workers using the same directory.
+    """
+
+    def __init__(self, cache_dir=EXPORT_CACHE_DIR, max_bytes=EXPORT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, key, extension):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{ARTIFACT_PREFIX}{digest}.{extension}')
+
+    def lookup(self, path):
+        """True (and marks it recently used) if the artifact is cached"""
+        try:
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+            return True
+        except OSError:
+            return False
+
+    def get_or_build(self, key, extension, write):
+        """(path, hit): the cached artifact, built with write(fileobj) on a miss"""
+        path = self.path_for(key, extension)
+        if self.lookup(path):
+            return path, True
+        # Um único build por artefato neste processo; os demais esperam e reaproveitam
+        with self._lock:
+            lock = self._locks.setdefault(path, threading.Lock())
+        try:
+            with lock:
+                if self.lookup(path):
+                    return path, True
+                atomic_write(path, write)
+        finally:
+            with self._lock:
+                self._locks.pop(path, None)
+        self.evict(keep=path)
+        return path, False
+
+    def stream_into(self, key, extension, chunks):
+        """Yield `chunks` while writing them to the cache; the artifact is only published
+        when the stream ends (an interrupted download leaves nothing behind)"""
+        path = self.path_for(key, extension)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """Drop least recently used artifacts until the directory fits max_bytes (never `keep`,
+        the artifact about to be served, even if it alone exceeds the cap)"""
+        entries = []
+        with os.scandir(self.cache_dir) as scan:
+            for entry in scan:
+                if entry.name.startswith(ARTIFACT_PREFIX) and not entry.name.endswith('.tmp') and entry.path != keep:
+                    stat = entry.stat()
+                    entries.append((stat.st_atime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        if keep and os.path.exists(keep):
+            total += os.path.getsize(keep)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+def workbook_frame(path, cache_dir=EXPORT_CACHE_DIR):
+    """DataFrame of an Excel source, parsed once per content: kept in memory and as a Parquet
+    columnar copy on disk, so read_excel only runs when the workbook itself changes"""
+    digest = file_digest(path)
+    frame = _frames.get(digest)
+    if frame is not None:
+        return frame, digest
+
+    with _lock:
+        frame = _frames.get(digest)
+        if frame is None:
+            parquet_path = os.path.join(cache_dir, f'frame-{digest[:16]}.parquet')
+            if os.path.exists(parquet_path):
+                frame = pd.read_parquet(parquet_path)
+            else:
+                frame = pd.read_excel(path)
+                try:
+                    atomic_write(parquet_path, lambda f: frame.to_parquet(f, index=False))
+                except Exception as e:
+                    # Colunas de tipos mistos não cabem em Parquet: fica só a cópia em memória
+                    print(f"Cópia Parquet de {path} não gravada: {e}")
+            # Só a versão atual de cada planilha fica em memória
+            _frames.clear()
+            _frames[digest] = frame
+    return frame, digest
@@ -0,0 +1,409 @@
+import csv
+import io
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+
+from dataset_engine import SOURCES_BY_NAME
+from ranking_index import ranking_index
+from rollup_cube import rollup_cube
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # dependência declarada; sem ela (instalação parcial) o formato parquet fica indisponível
+    pyarrow = None
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+EXPORT_MIMETYPES = {
+    'xlsx': XLSX_MIMETYPE,
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet'
+}
+EXPORT_FORMATS = tuple(EXPORT_MIMETYPES)
+# Ano de referência gravado nas planilhas
+EXPORT_YEAR = 2023
+# Linhas materializadas por vez ao gerar as planilhas de dados
+EXPORT_BATCH_ROWS = 2048
+
+# Mesmo estilo de cabeçalho que o pandas aplica em to_excel
+_THIN = Side(style='thin')
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+
+
+_progress = threading.local()
+
+
+@contextmanager
+def export_progress(callback):
+    """Report export progress of this thread as callback(sheets_done, rows_written)"""
+    _progress.callback = callback
+    try:
+        yield
+    finally:
+        _progress.callback = None
+
+
+def report_progress(sheets, rows):
+    callback = getattr(_progress, 'callback', None)
+    if callback is not None:
+        callback(sheets, rows)
+
+
+class Sheet:
+    """One worksheet of an export: title, header (None = no header row) and an iterable of rows
+
+    Data sheets can also offer `batches`, an iterable of column lists (one list per column),
+    used by the columnar formats instead of transposing rows, and `types`, the value type of
+    each column ('int', 'float', 'bool', 'str'; None = inferred from the first batch).
+    """
+
+    def __init__(self, title, columns, rows, batches=None, types=None):
+        self.title = title
+        self.columns = columns
+        self.rows = rows
+        self.batches = batches
+        self.types = types
+
+
+def _header(worksheet, columns):
+    cells = []
+    for column in columns:
+        cell = WriteOnlyCell(worksheet, value=column)
+        cell.font = HEADER_FONT
+        cell.border = HEADER_BORDER
+        cell.alignment = HEADER_ALIGNMENT
+        cells.append(cell)
+    return cells
+
+
+def write_xlsx(sheets, fileobj):
+    """Write the sheets with openpyxl in write-only mode: each row goes straight to the sheet's
+    temporary XML, so memory does not grow with the number of rows or sheets"""
+    workbook = Workbook(write_only=True)
+    sheets_done = rows_written = 0
+    for sheet in sheets:
+        worksheet = workbook.create_sheet(sheet.title)
+        if sheet.columns:
+            worksheet.append(_header(worksheet, sheet.columns))
+        for row in sheet.rows:
+            worksheet.append(row)
+            rows_written += 1
+            if rows_written % EXPORT_BATCH_ROWS == 0:
+                report_progress(sheets_done, rows_written)
+        sheets_done += 1
+        report_progress(sheets_done, rows_written)
+    workbook.save(fileobj)
+
+
+def safe_name(name):
+    return name.replace('/', '_').replace('\\', '_').replace(':', '_')
+
+
+def _ranked_rows(store, source, category, state=None):
+    return ranking_index(store, source, category).rows(state)
+
+
+def _batches(rows):
+    for start in range(0, len(rows), EXPORT_BATCH_ROWS):
+        yield rows[start:start + EXPORT_BATCH_ROWS]
+
+
+def detail_batches(store, source, category, rows, columns, unit=None):
+    """Column lists of one category, in `rows` order, one batch of rows at a time.
+
+    `columns` picks the fields among: code, name, state, category, value, unit, year.
+    """
+    dataset = store[source]
+    municipalities = store.municipalities
+    unit = unit or dataset.unit(category) or SOURCES_BY_NAME[source]['unit']
+    constants = {'category': category, 'unit': unit, 'year': EXPORT_YEAR}
+    for batch in _batches(rows):
+        result = []
+        for column in columns:
+            if column == 'code':
+                result.append(municipalities.codes[batch].tolist())
+            elif column == 'name':
+                result.append([municipalities.names[row] for row in batch.tolist()])
+            elif column == 'state':
+                result.append(municipalities.states[batch].tolist())
+            elif column == 'value':
+                result.append(dataset.values_at(category, batch))
+            else:
+                result.append([constants[column]] * len(batch))
+        yield result
+
+
+# Tipo de cada campo das linhas de detalhe ('value' depende das categorias)
+DETAIL_FIELD_TYPES = {'code': 'str', 'name': 'str', 'state': 'str', 'category': 'str', 'unit': 'str', 'year': 'int'}
+
+
+def detail_types(store, source, categories, columns):
+    """Column types of detail rows: value is int only if every category is integral"""
+    dataset = store[source]
+    integral = all(dataset.integral[dataset.category_index[category]] for category in categories)
+    return [DETAIL_FIELD_TYPES.get(column, 'int' if integral else 'float') for column in columns]
+
+
+def detail_rows(store, source, category, rows, columns, unit=None):
+    """Data rows of one category (same fields as detail_batches)"""
+    for batch in detail_batches(store, source, category, rows, columns, unit):
+        yield from (list(row) for row in zip(*batch))
+
+
+def detail_sheet(title, headers, store, source, category, rows, columns, unit=None):
+    return Sheet(title, headers, detail_rows(store, source, category, rows, columns, unit),
+                 detail_batches(store, source, category, rows, columns, unit),
+                 detail_types(store, source, [category], columns))
+
+
+def rollup_totals(cube, state_filter=None):
+    """Totais do cubo no escopo da exportação (um estado ou o país)"""
+    groups = cube.rows('state', state_filter) if state_filter else cube.rows('national')
+    return groups[0] if groups else {'sum': 0, 'count': 0, 'mean': 0, 'max': 0, 'min': 0}
+
+
+def rollup_state_rows(cube, state_filter):
+    """Resumo por UF lido do cubo: UF, total, nº de municípios, média"""
+    return [[group['name'], round(group['sum'], 2), group['count'], round(group['mean'], 2)]
+            for group in cube.rows('state', state_filter)]
+
+
+def category_export_sheets(store, source, category, state_filter=None):
+    """Sheets of the per-category analysis export of a registry source"""
+    name = source['name']
+    unit = source.get('export_unit')
+    rows = _ranked_rows(store, name, category, state_filter)
+    yield detail_sheet('Dados Detalhados', ['Código IBGE', 'Município', 'UF', 'Categoria', 'Valor', 'Unidade', 'Ano'],
+                       store, name, category, rows, ('code', 'name', 'state', 'category', 'value', 'unit', 'year'), unit)
+    if not source.get('export_summary'):
+        return
+
+    cube = rollup_cube(store, name, category)
+    totals = rollup_totals(cube, state_filter)
+    yield Sheet('Resumo Estatístico', ['Estatística', 'Valor'], [
+        ['Categoria Analisada', category],
+        ['Filtro de Estado', state_filter if state_filter else 'Nacional (Todos os Estados)'],
+        ['Ano de Referência', EXPORT_YEAR],
+        ['Total de Municípios', totals['count']],
+        ['Valor Total', f"{totals['sum']:,.0f}"],
+        ['Valor Médio por Município', f"{totals['mean']:,.2f}"],
+        ['Maior Valor Municipal', f"{totals['max']:,.0f}"],
+        ['Menor Valor Municipal', f"{totals['min']:,.0f}"]
+    ])
+    yield Sheet('Resumo por Estado', ['UF', 'Valor Total', 'Nº Municípios', 'Valor Médio'],
+                rollup_state_rows(cube, state_filter))
+    yield Sheet('Top 20', ['Ranking', 'Município', 'UF', 'Valor', 'Unidade'], (
+        [rank, *row] for rank, row in
+        enumerate(detail_rows(store, name, category, rows[:20], ('name', 'state', 'value', 'unit'), unit), start=1)
+    ))
+
+
+def crop_analysis_sheets(store, crop_name, state_filter=None):
+    """Sheets of the crop analysis export (harvested area)"""
+    rows = _ranked_rows(store, 'crop', crop_name, state_filter)
+    yield detail_sheet('Dados Detalhados', ['Código IBGE', 'Município', 'UF', 'Cultura', 'Área Colhida (hectares)', 'Ano'],
+                       store, 'crop', crop_name, rows, ('code', 'name', 'state', 'category', 'value', 'year'))
+
+    cube = rollup_cube(store, 'crop', crop_name)
+    totals = rollup_totals(cube, state_filter)
+    yield Sheet('Resumo Estatístico', ['Estatística', 'Valor'], [
+        ['Cultura Analisada', crop_name],
+        ['Filtro de Estado', state_filter if state_filter else 'Nacional (Todos os Estados)'],
+        ['Ano de Referência', EXPORT_YEAR],
+        ['Total de Municípios', totals['count']],
+        ['Área Total Colhida (ha)', f"{totals['sum']:,.2f}"],
+        ['Área Média por Município (ha)', f"{totals['mean']:,.2f}"],
+        ['Maior Área Municipal (ha)', f"{totals['max']:,.2f}"],
+        ['Menor Área Municipal (ha)', f"{totals['min']:,.2f}"]
+    ])
+    yield Sheet('Resumo por Estado', ['UF', 'Área Total (ha)', 'Nº Municípios', 'Área Média (ha)'],
+                rollup_state_rows(cube, state_filter))
+    yield Sheet('Top 20 Produtores', ['Ranking', 'Município', 'UF', 'Área Colhida (hectares)'], (
+        [rank, *row] for rank, row in
+        enumerate(detail_rows(store, 'crop', crop_name, rows[:20], ('name', 'state', 'value')), start=1)
+    ))
+
+
+FERTILIZER_COMPLETE_COLUMNS = ['Código IBGE', 'Município', 'UF', 'Categoria', 'Valor', 'Unidade', 'Ano']
+FERTILIZER_COMPLETE_FIELDS = ('code', 'name', 'state', 'category', 'value', 'unit', 'year')
+# Unidade fixa nesta exportação
+FERTILIZER_COMPLETE_UNIT = SOURCES_BY_NAME['fertilizer']['export_unit']
+
+
+def _fertilizer_sheet(store, title, categories, ranked):
+    def generate(detail):
+        for category in categories:
+            yield from detail(store, 'fertilizer', category, ranked[category], FERTILIZER_COMPLETE_FIELDS,
+                              FERTILIZER_COMPLETE_UNIT)
+
+    return Sheet(title, FERTILIZER_COMPLETE_COLUMNS, generate(detail_rows), generate(detail_batches),
+                 detail_types(store, 'fertilizer', categories, FERTILIZER_COMPLETE_FIELDS))
+
+
+def complete_fertilizer_sheets(store):
+    """Sheets of the complete fertilizer export: all rows, general/category/state summaries and
+    one sheet per top-10 category; rows are generated per category, never all at once"""
+    fertilizers = store['fertilizer']
+    categories = sorted(fertilizers.categories)
+    ranked = {category: _ranked_rows(store, 'fertilizer', category) for category in categories}
+
+    yield _fertilizer_sheet(store, 'Dados Completos', categories, ranked)
+
+    # Resumos por categoria e por estado a partir dos cubos de agregação
+    cubes = {name: rollup_cube(store, 'fertilizer', name) for name in fertilizers.categories}
+    category_rows = []
+    for category_name, cube in cubes.items():
+        national = cube.rows('national')
+        if national:
+            totals = national[0]
+            category_rows.append([category_name, round(totals['sum'], 2), totals['count'],
+                                  round(totals['mean'], 2), totals['max'], totals['min']])
+    category_rows.sort(key=lambda row: -row[1])
+
+    present = np.zeros(len(store.municipalities), dtype=bool)
+    total_records = 0
+    total_value = 0
+    for category in categories:
+        present[ranked[category]] = True
+        total_records += len(ranked[category])
+        total_value += fertilizers.column(category)[ranked[category]].sum()
+    avg_value = total_value / total_records if total_records else float('nan')
+
+    yield Sheet('Resumo Geral', None, [
+        ['Estatística', 'Valor'],
+        ['Base de Dados', 'Fertilizantes - Censo Agropecuário 2017'],
+        ['Ano de Referência', EXPORT_YEAR],
+        ['Total de Categorias', sum(1 for category in categories if len(ranked[category]))],
+        ['Total de Municípios', int(present.sum())],
+        ['Total de Registros', total_records],
+        ['Valor Total Geral', f'{total_value:,.0f}'],
+        ['Valor Médio Geral', f'{avg_value:,.2f}']
+    ])
+    yield Sheet('Resumo por Categoria',
+                ['Categoria', 'Valor Total', 'Nº Municípios', 'Valor Médio', 'Valor Máximo', 'Valor Mínimo'],
+                category_rows)
+
+    if cubes:
+        state_levels = [cube.levels['state'] for cube in cubes.values()]
+        state_totals = sum(level['sum'] for level in state_levels)
+        state_counts = sum(level['count'] for level in state_levels)
+        groups = next(iter(cubes.values())).groups
+        state_rows = [
+            [groups.labels['state'][i], round(float(state_totals[i]), 2), int(state_counts[i]),
+             round(float(state_totals[i] / state_counts[i]), 2)]
+            for i in np.argsort(-state_totals, kind='stable').tolist() if state_counts[i] > 0
+        ]
+    else:
+        state_rows = []
+    yield Sheet('Resumo por Estado', ['UF', 'Valor Total', 'Nº Municípios', 'Valor Médio'], state_rows)
+
+    # Planilhas separadas para as 10 maiores categorias
+    for category_name, *_ in category_rows[:10]:
+        yield _fertilizer_sheet(store, safe_name(category_name)[:30], [category_name], ranked)
+
+
+def frame_sheet(title, df):
+    """Sheet from a DataFrame (NaN becomes an empty cell, as in to_excel)"""
+    def chunks():
+        for start in range(0, len(df), EXPORT_BATCH_ROWS):
+            chunk = df.iloc[start:start + EXPORT_BATCH_ROWS]
+            yield chunk.astype(object).where(chunk.notna(), None)
+
+    def rows():
+        for chunk in chunks():
+            yield from chunk.itertuples(index=False, name=None)
+
+    def batches():
+        for chunk in chunks():
+            yield [chunk[column].tolist() for column in chunk.columns]
+
+    kinds = {'i': 'int', 'u': 'int', 'f': 'float', 'b': 'bool'}
+    types = [kinds.get(dtype.kind, 'str') for dtype in df.dtypes]
+    return Sheet(title, [str(column) for column in df.columns], rows(), batches(), types)
+
+
+def csv_chunks(sheet):
+    """The sheet as UTF-8 CSV, yielded in chunks of EXPORT_BATCH_ROWS rows (nothing materialized)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if sheet.columns:
+        writer.writerow(sheet.columns)
+    rows_written = 0
+    for row in sheet.rows:
+        writer.writerow(row)
+        rows_written += 1
+        if rows_written % EXPORT_BATCH_ROWS == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            report_progress(0, rows_written)
+    yield buffer.getvalue().encode('utf-8')
+    report_progress(1, rows_written)
+
+
+def write_csv(sheet, fileobj):
+    for chunk in csv_chunks(sheet):
+        fileobj.write(chunk)
+
+
+def _parquet_schema(sheet, first_batch):
+    columns = [str(column) for column in sheet.columns]
+    if sheet.types is not None:
+        arrow_types = {'int': pyarrow.int64(), 'float': pyarrow.float64(), 'bool': pyarrow.bool_(),
+                       'str': pyarrow.string()}
+        return pyarrow.schema([(column, arrow_types[kind]) for column, kind in zip(columns, sheet.types)])
+    if first_batch is None:
+        return pyarrow.schema([(column, pyarrow.string()) for column in columns])
+    inferred = [pyarrow.array(column, from_pandas=True).type for column in first_batch]
+    # Colunas só com vazios no primeiro bloco ficam como texto
+    return pyarrow.schema([(column, pyarrow.string() if pyarrow.types.is_null(kind) else kind)
+                           for column, kind in zip(columns, inferred)])
+
+
+def write_parquet(sheet, fileobj):
+    """The sheet as Parquet, one row group per column batch (only one batch in memory)"""
+    if pyarrow is None:
+        raise RuntimeError('Formato parquet indisponível: instale pyarrow')
+    batches = iter(sheet.batches if sheet.batches is not None else (
+        [list(column) for column in zip(*rows)] for rows in _row_chunks(sheet.rows)
+    ))
+    batch = next(batches, None)
+    schema = _parquet_schema(sheet, batch)
+    rows_written = 0
+    with pyarrow.parquet.ParquetWriter(fileobj, schema) as writer:
+        while batch is not None:
+            table = pyarrow.table([pyarrow.array(column, type=field.type, from_pandas=True)
+                                   for column, field in zip(batch, schema)], schema=schema)
+            writer.write_table(table)
+            rows_written += table.num_rows
+            report_progress(0, rows_written)
+            batch = next(batches, None)
+    report_progress(1, rows_written)
+
+
+def _row_chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == EXPORT_BATCH_ROWS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_export(sheets, export_format, fileobj):
+    """Every sheet for xlsx; only the first (data) sheet for the tabular formats"""
+    if export_format == 'xlsx':
+        write_xlsx(sheets, fileobj)
+    elif export_format == 'csv':
+        write_csv(next(iter(sheets)), fileobj)
+    else:
+        write_parquet(next(iter(sheets)), fileobj)
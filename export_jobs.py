@@ -0,0 +1,223 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import secrets
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from export_cache import EXPORT_CACHE_DIR, atomic_write
+
+# Exportações simultâneas em cada processo web (threads do próprio worker do gunicorn)
+EXPORT_JOB_WORKERS = int(os.environ.get('EXPORT_JOB_WORKERS', '2'))
+# Jobs aguardando ou em execução aceitos de uma vez
+EXPORT_JOB_MAX_PENDING = 32
+# Tempo em que um job concluído (e seu arquivo) fica disponível
+EXPORT_JOB_TTL = 3600
+# Job sem atualizar o registro por esse tempo foi interrompido (processo encerrado)
+EXPORT_JOB_STALE = 600
+# Intervalo de gravação do progresso no registro
+EXPORT_JOB_PROGRESS_INTERVAL = 1.0
+EXPORT_JOB_DIR = os.path.join(EXPORT_CACHE_DIR, 'jobs')
+
+_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _digest(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()[:32]
+
+
+class ExportJob:
+    """One background export: state, progress and the finished artifact, stored as a JSON record"""
+
+    FIELDS = ('id', 'key', 'url', 'status', 'sheets', 'rows', 'created_at', 'started_at', 'finished_at',
+              'updated_at', 'error', 'filename', 'mimetype', 'size')
+
+    def __init__(self, key, url):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.url = url
+        self.status = 'queued'
+        self.sheets = 0
+        self.rows = 0
+        self.created_at = self.updated_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.filename = None
+        self.mimetype = None
+        self.size = None
+
+    @classmethod
+    def from_record(cls, record):
+        job = cls.__new__(cls)
+        for field in cls.FIELDS:
+            setattr(job, field, record.get(field))
+        return job
+
+    def record(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @property
+    def pending(self):
+        return self.status in ('queued', 'running')
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'url': self.url,
+            'status': self.status,
+            'progress': {'sheets': self.sheets, 'rows': self.rows},
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error,
+            'filename': self.filename,
+            'size': self.size
+        }
+
+
+class ExportJobQueue:
+    """Export jobs shared by every web worker through JSON records in `job_dir`
+
+    The web worker that creates a job runs it on its own bounded pool of `workers` threads; any
+    worker can read the record and serve the file. Identical requests share one job, but every
+    requester gets its own download token. `run(job, fileobj, progress)` writes the export into
+    fileobj, reports progress(sheets, rows) and returns (filename, mimetype).
+    """
+
+    def __init__(self, run=None, workers=EXPORT_JOB_WORKERS, max_pending=EXPORT_JOB_MAX_PENDING,
+                 ttl=EXPORT_JOB_TTL, job_dir=EXPORT_JOB_DIR):
+        self.run = run
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.job_dir = job_dir
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.job_dir, name)
+
+    def artifact_path(self, job):
+        return self._path(job.id)
+
+    def _token_path(self, job_id, token):
+        return self._path(f'{job_id}.{_digest(token)}.token')
+
+    def _save(self, job):
+        job.updated_at = time.time()
+        body = json.dumps(job.record(), ensure_ascii=False).encode('utf-8')
+        atomic_write(self._path(f'{job.id}.json'), lambda f: f.write(body))
+
+    def get(self, job_id):
+        """The job record (as read now from disk) or None"""
+        if not _JOB_ID.match(job_id or ''):
+            return None
+        try:
+            with open(self._path(f'{job_id}.json'), 'r', encoding='utf-8') as f:
+                return ExportJob.from_record(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def _jobs(self):
+        for path in glob.glob(self._path('*.json')):
+            job = self.get(os.path.basename(path)[:-5])
+            if job is not None:
+                yield job
+
+    def check_token(self, job, token):
+        return bool(token) and os.path.exists(self._token_path(job.id, token))
+
+    def _issue_token(self, job):
+        # Só o hash fica em disco; cada solicitante recebe um token próprio
+        token = secrets.token_urlsafe(24)
+        atomic_write(self._token_path(job.id, token), lambda f: None)
+        return token
+
+    def submit(self, key, url):
+        """(job, token, created): the live job for `key` if there is one, else a newly queued
+        job; OverflowError when the queue is full"""
+        os.makedirs(self.job_dir, exist_ok=True)
+        self._expire()
+        key = _digest(repr(key))
+        key_path = self._path(f'key-{key}')
+        try:
+            with open(key_path, 'r', encoding='utf-8') as f:
+                job = self.get(f.read().strip())
+        except OSError:
+            job = None
+
+        created = job is None or job.status == 'error'
+        if created:
+            if sum(1 for other in self._jobs() if other.pending) >= self.max_pending:
+                raise OverflowError('Fila de exportação cheia; tente novamente em instantes')
+            job = ExportJob(key, url)
+            self._save(job)
+            atomic_write(key_path, lambda f: f.write(job.id.encode('ascii')))
+            self._pool().submit(self._execute, job)
+        return job, self._issue_token(job), created
+
+    def _pool(self):
+        # Criado no primeiro job: cada worker do gunicorn tem o seu, após o fork
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='export-job')
+            return self._executor
+
+    def _execute(self, job):
+        job.status = 'running'
+        job.started_at = time.time()
+        self._save(job)
+
+        def progress(sheets, rows):
+            job.sheets, job.rows = sheets, rows
+            if time.time() - job.updated_at >= EXPORT_JOB_PROGRESS_INTERVAL:
+                self._save(job)
+
+        temp_path = self._path(f'{job.id}.part')
+        try:
+            with open(temp_path, 'wb') as f:
+                job.filename, job.mimetype = self.run(job, f, progress)
+            os.replace(temp_path, self.artifact_path(job))
+            job.size = os.path.getsize(self.artifact_path(job))
+            job.status = 'done'
+        except Exception as e:
+            print(f"Erro no job de exportação {job.id} ({job.url}): {e}")
+            job.error = str(e)
+            job.status = 'error'
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        finally:
+            job.finished_at = time.time()
+            self._save(job)
+
+    def _expire(self):
+        now = time.time()
+        for job in self._jobs():
+            if job.pending and now - job.updated_at > EXPORT_JOB_STALE:
+                job.error = 'Exportação interrompida'
+                job.status, job.finished_at = 'error', now
+                self._save(job)
+            elif job.finished_at is not None and now - job.finished_at > self.ttl:
+                self._remove(job)
+
+    def _remove(self, job):
+        paths = [self._path(f'{job.id}.json'), self.artifact_path(job)]
+        paths.extend(glob.glob(self._path(f'{job.id}.*.token')))
+        key_path = self._path(f'key-{job.key}')
+        try:
+            with open(key_path, 'r', encoding='utf-8') as f:
+                if f.read().strip() == job.id:
+                    paths.append(key_path)
+        except OSError:
+            pass
+        # Outro processo pode estar expirando o mesmo job
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
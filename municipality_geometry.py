@@ -0,0 +1,186 @@
+import json
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+
+# Centroides e vizinhança pré-computados a partir das malhas GeoJSON
+GEOMETRY_FILE = 'municipality_geometry.npz'
+GEOJSON_SOURCES = (
+    'static/data/brazil_municipalities_all.geojson',
+    'static/data/brazil_municipalities_combined.geojson',
+)
+STATE_GEOJSON_PATTERN = 'static/data/{}.geojson'
+# Vértices arredondados a ~11 m para casar fronteiras comuns entre municípios
+VERTEX_PRECISION = 1e4
+EARTH_RADIUS_KM = 6371.0
+
+# Mesmas chaves de código que o mapa (static/js/map.js) aceita
+CODE_PROPERTIES = ('GEOCODIGO', 'CD_MUN', 'cd_geocmu', 'geocodigo', 'CD_GEOCMU')
+
+
+def _feature_code(properties):
+    for key in CODE_PROPERTIES:
+        if properties.get(key):
+            return str(properties[key])
+    return None
+
+
+def _outer_rings(geometry):
+    if not geometry:
+        return []
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates'][0]]
+    if geometry['type'] == 'MultiPolygon':
+        return [polygon[0] for polygon in geometry['coordinates']]
+    return []
+
+
+def _ring_centroid(ring):
+    """(area, lon, lat) of a ring by the shoelace formula"""
+    points = np.asarray(ring, dtype=np.float64)[:, :2]
+    x, y = points[:, 0], points[:, 1]
+    x1, y1 = np.roll(x, -1), np.roll(y, -1)
+    cross = x * y1 - x1 * y
+    area = cross.sum() / 2
+    if area == 0:
+        return 0.0, x.mean(), y.mean()
+    return abs(area), ((x + x1) * cross).sum() / (6 * area), ((y + y1) * cross).sum() / (6 * area)
+
+
+def _read_features(paths):
+    features = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            features.extend(json.load(f).get('features', []))
+    return features
+
+
+def default_geojson_paths():
+    for path in GEOJSON_SOURCES:
+        if os.path.exists(path):
+            return [path]
+    from rollup_cube import IBGE_STATES
+    return [path for path in (STATE_GEOJSON_PATTERN.format(uf) for uf in IBGE_STATES.values()) if os.path.exists(path)]
+
+
+def build_geometry(paths):
+    """Codes, centroids (lon, lat) and adjacency pairs (municipalities sharing a border vertex)"""
+    codes, centroids = [], []
+    vertex_keys, vertex_owners = [], []
+    for feature in _read_features(paths):
+        code = _feature_code(feature.get('properties') or {})
+        rings = _outer_rings(feature.get('geometry'))
+        if code is None or not rings:
+            continue
+        owner = len(codes)
+        parts = [_ring_centroid(ring) for ring in rings]
+        area = sum(part[0] for part in parts)
+        if area > 0:
+            centroids.append((sum(a * lon for a, lon, _ in parts) / area, sum(a * lat for a, _, lat in parts) / area))
+        else:
+            centroids.append((np.mean([part[1] for part in parts]), np.mean([part[2] for part in parts])))
+        codes.append(code)
+        for ring in rings:
+            quantized = np.round(np.asarray(ring, dtype=np.float64)[:, :2] * VERTEX_PRECISION).astype(np.int64)
+            vertex_keys.append(quantized[:, 0] * 4_000_000 + quantized[:, 1])
+            vertex_owners.append(np.full(len(quantized), owner, dtype=np.int32))
+
+    pairs = np.empty((0, 2), dtype=np.int32)
+    if vertex_keys:
+        # Pares (vértice, município) únicos ordenados pelo vértice: os donos de um vértice ficam
+        # contíguos; comparar a todas as distâncias até o maior grupo gera todos os pares de cada grupo
+        keyed = np.unique(np.column_stack([np.concatenate(vertex_keys), np.concatenate(vertex_owners)]), axis=0)
+        _, group_sizes = np.unique(keyed[:, 0], return_counts=True)
+        found = [pairs]
+        for step in range(1, int(group_sizes.max())):
+            same = keyed[step:, 0] == keyed[:-step, 0]
+            found.append(np.column_stack([keyed[:-step, 1][same], keyed[step:, 1][same]]))
+        pairs = np.concatenate(found).astype(np.int32)
+        pairs = np.unique(np.sort(pairs, axis=1), axis=0)
+
+    return np.array(codes, dtype=str), np.array(centroids, dtype=np.float64).reshape(-1, 2), pairs
+
+
+def save_geometry(codes, centroids, pairs, data_dir='data'):
+    path = os.path.join(data_dir, GEOMETRY_FILE)
+    temp_path = f'{path}.{uuid.uuid4().hex}.tmp.npz'
+    np.savez(temp_path, codes=codes, centroids=centroids, pairs=pairs)
+    os.replace(temp_path, path)
+    return path
+
+
+def load_geometry(data_dir='data'):
+    """(codes, centroids, pairs) from the precomputed file, or None if it was not built"""
+    path = os.path.join(data_dir, GEOMETRY_FILE)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return data['codes'], data['centroids'], data['pairs']
+
+
+class MunicipalityGeometry:
+    """Centroids and adjacency (CSR) aligned to the rows of the municipality dimension"""
+
+    def __init__(self, municipalities, codes, centroids, pairs):
+        size = len(municipalities)
+        file_rows = np.array([municipalities.index.get(str(code), -1) for code in codes.tolist()], dtype=np.intp)
+        known = file_rows >= 0
+
+        self.lon = np.full(size, np.nan)
+        self.lat = np.full(size, np.nan)
+        self.lon[file_rows[known]] = centroids[known, 0]
+        self.lat[file_rows[known]] = centroids[known, 1]
+
+        edges = file_rows[pairs] if len(pairs) else np.empty((0, 2), dtype=np.intp)
+        edges = edges[(edges >= 0).all(axis=1)]
+        edges = np.concatenate([edges, edges[:, ::-1]])
+        edges = edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+        self.indptr = np.searchsorted(edges[:, 0], np.arange(size + 1))
+        self.indices = edges[:, 1]
+
+    def neighbors(self, row):
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def distances_km(self, row, rows):
+        """Great-circle distance from one municipality centroid to several"""
+        lat1, lon1 = np.radians(self.lat[row]), np.radians(self.lon[row])
+        lat2, lon2 = np.radians(self.lat[rows]), np.radians(self.lon[rows])
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def municipality_geometry(store, data_dir='data'):
+    """Geometry of the store dimension, loaded once per store version and geometry file;
+    None when not built (the miss is not cached, so building the file takes effect at once)"""
+    path = os.path.join(data_dir, GEOMETRY_FILE)
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+    def build(s):
+        loaded = load_geometry(data_dir)
+        return MunicipalityGeometry(s.municipalities, *loaded) if loaded is not None else None
+
+    return store.derived(('geometry', data_dir, mtime_ns), build)
+
+
+def build_geometry_file(data_dir='data', paths=None):
+    """Precompute data/municipality_geometry.npz from the municipality GeoJSON meshes"""
+    start = time.perf_counter()
+    paths = paths or default_geojson_paths()
+    if not paths:
+        print("Nenhum GeoJSON de municípios encontrado em static/data")
+        return None
+    codes, centroids, pairs = build_geometry(paths)
+    path = save_geometry(codes, centroids, pairs, data_dir)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"Geometria salva em {path}: {len(codes)} municípios, {len(pairs)} pares vizinhos ({elapsed:.0f} ms)")
+    return path
+
+
+if __name__ == "__main__":
+    build_geometry_file(sys.argv[1] if len(sys.argv) > 1 else 'data', sys.argv[2:] or None)
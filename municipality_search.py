@@ -0,0 +1,88 @@
+from bisect import bisect_left
+
+import numpy as np
+
+from dataset_engine import FILTER_BASIC
+from name_resolver import fold_name
+from rollup_cube import IBGE_STATES
+
+# Siglas de UF aceitas como filtro dentro da própria consulta ("sao paulo sp")
+UF_CODES = frozenset(code.lower() for code in IBGE_STATES.values())
+
+
+class PrefixIndex:
+    """Sorted (key, row) pairs answering 'which rows have a key starting with prefix'"""
+
+    def __init__(self, pairs):
+        pairs = sorted(pairs)
+        self.keys = [key for key, _ in pairs]
+        self.rows = np.array([row for _, row in pairs], dtype=np.int32)
+
+    def match(self, prefix):
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + '\uffff', lo)
+        return self.rows[lo:hi]
+
+
+class MunicipalitySearchIndex:
+    """Accent/case-folded prefix and token index over the valid municipalities of the dimension"""
+
+    def __init__(self, municipalities):
+        self.municipalities = municipalities
+        rows = np.flatnonzero(municipalities.valid_mask(FILTER_BASIC)).tolist()
+        folded = {row: fold_name(municipalities.names[row]) for row in rows}
+
+        self.full_names = PrefixIndex((name, row) for row, name in folded.items())
+        self.first_tokens = PrefixIndex((name.split(' ', 1)[0], row) for row, name in folded.items() if name)
+        self.tokens = PrefixIndex(
+            (token, row) for row, name in folded.items() for token in set(name.split())
+        )
+
+        size = len(municipalities)
+        self.folded = np.array([folded.get(row, '') for row in range(size)], dtype=object)
+        self.name_length = np.array([len(name) for name in self.folded], dtype=np.int32)
+        # Posição alfabética (nome dobrado) para desempate estável
+        self.alpha_rank = np.empty(size, dtype=np.int32)
+        self.alpha_rank[np.argsort(self.folded.astype(str), kind='stable')] = np.arange(size)
+        self.states = np.char.lower(municipalities.states)
+
+    def search(self, query, uf=None, limit=20):
+        """Rows best matching the query: exact name, full-name prefix, first-word prefix,
+        any-word prefix, then (for a bare UF code such as "mt") the municipalities of that UF;
+        ties go to shorter and then alphabetical names"""
+        tokens = fold_name(query).split()
+        uf = uf.lower() if uf else None
+        # Sigla de UF junto a outras palavras vira filtro de estado
+        if len(tokens) > 1 and tokens[-1] in UF_CODES:
+            uf = uf or tokens.pop()
+        if not tokens:
+            return np.empty(0, dtype=np.int32)
+
+        # Consulta que é só uma sigla de UF também lista os municípios do estado
+        state_rows = np.flatnonzero(self.states == tokens[0]) if len(tokens) == 1 and tokens[0] in UF_CODES else None
+
+        candidates = None
+        for token in tokens:
+            rows = np.unique(self.tokens.match(token))
+            candidates = rows if candidates is None else np.intersect1d(candidates, rows, assume_unique=True)
+        if state_rows is not None:
+            state_rows = state_rows[self.name_length[state_rows] > 0]
+            candidates = np.union1d(candidates, state_rows)
+        if uf:
+            candidates = candidates[self.states[candidates] == uf]
+
+        phrase = ' '.join(tokens)
+        score = np.full(len(candidates), 4, dtype=np.int8)
+        score[np.isin(candidates, self.tokens.match(tokens[0]))] = 3
+        score[np.isin(candidates, self.first_tokens.match(tokens[0]))] = 2
+        score[np.isin(candidates, self.full_names.match(phrase))] = 1
+        score[self.folded[candidates] == phrase] = 0
+
+        # Listagem de uma UF fica em ordem alfabética; os demais, nomes curtos primeiro
+        length = np.where(score == 4, 0, self.name_length[candidates])
+        order = np.lexsort((self.alpha_rank[candidates], length, score))
+        return candidates[order[:limit]]
+
+
+def municipality_search_index(store):
+    return store.derived('municipality_search', lambda s: MunicipalitySearchIndex(s.municipalities))
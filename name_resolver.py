@@ -0,0 +1,94 @@
+import re
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+
+# Pontuação mínima para aceitar um nome aproximado no lugar do pedido
+RESOLVE_MIN_SCORE = 0.5
+
+
+def fold_name(text):
+    """Lowercase, accent-free name with punctuation collapsed to single spaces"""
+    text = unicodedata.normalize('NFD', str(text).lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.findall(r'[a-z0-9]+', text))
+
+
+def trigrams(folded):
+    """Trigram set of a folded name (words padded so prefixes weigh more)"""
+    grams = set()
+    for word in folded.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class NameIndex:
+    """Trigram inverted index over (source, name) pairs"""
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self.folded = [fold_name(name) for _, name in self.entries]
+        self.sizes = np.zeros(len(self.entries), dtype=np.int32)
+        postings = defaultdict(list)
+        for i, folded in enumerate(self.folded):
+            grams = trigrams(folded)
+            self.sizes[i] = len(grams)
+            for gram in grams:
+                postings[gram].append(i)
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def search(self, query, source=None, limit=10, min_score=0.0):
+        """Ranked matches: [{source, name, score}], best first"""
+        folded = fold_name(query)
+        if not folded:
+            return []
+        grams = trigrams(folded)
+
+        # Contagem de trigramas em comum por entrada, só nas listas dos trigramas da consulta
+        common = np.zeros(len(self.entries), dtype=np.int32)
+        for gram in grams:
+            ids = self.postings.get(gram)
+            if ids is not None:
+                common[ids] += 1
+
+        matches = []
+        for i in np.flatnonzero(common):
+            entry_source, name = self.entries[i]
+            if source and entry_source != source:
+                continue
+            candidate = self.folded[i]
+            if candidate == folded:
+                score = 1.0
+            else:
+                # Coeficiente de Dice; contenção (ex.: "soja" em "soja em grao") pesa mais
+                score = 2.0 * common[i] / (len(grams) + self.sizes[i])
+                if folded in candidate or candidate in folded:
+                    shorter, longer = sorted((len(folded), len(candidate)))
+                    score = max(score, 0.5 + 0.5 * shorter / longer)
+            if score >= min_score:
+                matches.append((score, entry_source, name))
+
+        matches.sort(key=lambda match: (-match[0], len(match[2]), match[2]))
+        return [
+            {'source': entry_source, 'name': name, 'score': round(float(score), 4)}
+            for score, entry_source, name in matches[:limit]
+        ]
+
+
+def name_index(store):
+    """Index of every category name of the store, built once per store version"""
+    return store.derived('name_index', lambda s: NameIndex(
+        (source, category)
+        for source, dataset in s.datasets.items()
+        for category in dataset.categories
+    ))
+
+
+def resolve_name(store, source, name):
+    """Exact category name, else the best approximate match of the source (or None)"""
+    if name in store[source]:
+        return name
+    matches = name_index(store).search(name, source=source, limit=1, min_score=RESOLVE_MIN_SCORE)
+    return matches[0]['name'] if matches else None
@@ -0,0 +1,113 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from dataset_engine import SOURCES_BY_NAME, FILTER_BASIC
+
+# Máximo de indicadores combinados num score
+POTENTIAL_MAX_TERMS = 30
+# Conjuntos de pesos mantidos em cache por versão da base
+POTENTIAL_CACHE_SIZE = 64
+
+
+def parse_weights(store, specs):
+    """[(source, category, weight)] from 'source:category:weight' specs (weight optional, default 1;
+    bare names are crops); ValueError for malformed specs, KeyError for unknown categories"""
+    weights = []
+    for spec in specs:
+        head, _, tail = spec.rpartition(':')
+        try:
+            weight = float(tail)
+        except ValueError:
+            head, weight = spec, 1.0
+        source, _, category = head.partition(':')
+        if not category or source not in SOURCES_BY_NAME:
+            source, category = 'crop', head
+        if category not in store[source]:
+            raise KeyError(f"Categoria '{category}' não encontrada em {source}")
+        if not np.isfinite(weight) or weight == 0:
+            raise ValueError(f"Peso inválido para {source}:{category}")
+        weights.append((source, category, weight))
+
+    if not 1 <= len(weights) <= POTENTIAL_MAX_TERMS:
+        raise ValueError(f'Informe de 1 a {POTENTIAL_MAX_TERMS} indicadores')
+    return weights
+
+
+def normalized_indicator(store, source, category):
+    """Category values scaled to [0, 1] (min-max over the valid municipalities of the source);
+    0 where there is no data"""
+    def build(s):
+        dataset = s[source]
+        i = dataset.category_index[category]
+        rows = dataset.rows(category, SOURCES_BY_NAME[source]['filter'])
+        normalized = np.zeros(len(s.municipalities))
+        if len(rows):
+            values = dataset.values[i, rows]
+            low, high = values.min(), values.max()
+            normalized[rows] = (values - low) / (high - low) if high > low else 1.0
+        return normalized
+
+    return store.derived(('normalized', source, category), build)
+
+
+class PotentialScore:
+    """Weighted sum of normalized indicators per municipality (weights scaled to Σ|w| = 1)"""
+
+    def __init__(self, store, weights):
+        scale = sum(abs(weight) for _, _, weight in weights)
+        self.weights = [(source, category, weight / scale) for source, category, weight in weights]
+        self.scores = np.zeros(len(store.municipalities))
+        for source, category, weight in self.weights:
+            self.scores += weight * normalized_indicator(store, source, category)
+
+    def top(self, municipalities, k, state=None):
+        """The k valid municipalities of highest score (optionally of one UF)"""
+        # Agregações e códigos inválidos ficam fora (com pesos negativos teriam score 0 no topo)
+        mask = municipalities.valid_mask(FILTER_BASIC)
+        if state:
+            mask = mask & municipalities.state_mask(state)
+        rows = np.flatnonzero(mask)
+        if k < len(rows):
+            # Seleção parcial O(n) antes de ordenar só os k melhores
+            rows = rows[np.argpartition(-self.scores[rows], k)[:k]]
+        rows = rows[np.argsort(-self.scores[rows], kind='stable')]
+        return [
+            {
+                'municipality_code': str(municipalities.codes[row]),
+                'municipality_name': municipalities.names[row],
+                'state_code': str(municipalities.states[row]),
+                'score': round(float(self.scores[row]), 6)
+            }
+            for row in rows.tolist()
+        ]
+
+
+class PotentialCache:
+    """LRU of PotentialScore objects of one store, keyed by the canonical weight set"""
+
+    def __init__(self, max_entries=POTENTIAL_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, store, weights):
+        scale = sum(abs(weight) for _, _, weight in weights)
+        key = tuple(sorted((source, category, round(weight / scale, 12)) for source, category, weight in weights))
+        with self._lock:
+            score = self._entries.get(key)
+            if score is not None:
+                self._entries.move_to_end(key)
+                return score
+        score = PotentialScore(store, weights)
+        with self._lock:
+            self._entries[key] = score
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return score
+
+
+def potential_score(store, weights):
+    """Score for a weight set, computed once per store version (while it stays in the LRU)"""
+    return store.derived('potential_cache', lambda s: PotentialCache()).get(store, weights)
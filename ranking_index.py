@@ -0,0 +1,40 @@
+import numpy as np
+
+from dataset_engine import SOURCES_BY_NAME
+
+# Limite de itens por consulta em /api/top
+TOP_MAX_K = 1000
+
+
+class RankingIndex:
+    """Rows of one category ordered by value (largest first), nationally and per state"""
+
+    def __init__(self, dataset, category, rows, states):
+        values = dataset.column(category)[rows]
+        # Estável: empates mantêm a ordem das linhas, como o sort das exportações
+        self.order = rows[np.argsort(-values, kind='stable')]
+        order_states = states[self.order]
+        self.by_state = {
+            str(state): self.order[order_states == state]
+            for state in np.unique(order_states)
+        }
+
+    def rows(self, state=None):
+        """Ranked rows (optionally of one state)"""
+        if state:
+            return self.by_state.get(state, self.order[:0])
+        return self.order
+
+    def top(self, k, state=None):
+        return self.rows(state)[:k]
+
+
+def ranking_index(store, source, category):
+    """Ranking of a category under its source filter policy, built once per store version"""
+    policy = SOURCES_BY_NAME[source]['filter']
+
+    def build(s):
+        dataset = s[source]
+        return RankingIndex(dataset, category, dataset.rows(category, policy), s.municipalities.states)
+
+    return store.derived(('ranking', source, category), build)
@@ -0,0 +1,133 @@
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response, current_app, request
+
+try:
+    import brotli
+except ImportError:  # dependência declarada; sem ela (instalação parcial) servimos apenas gzip/identity
+    brotli = None
+
+
+class CachedBody:
+    """One encoded JSON payload plus its lazily built compressed variants"""
+
+    def __init__(self, body, mimetype='application/json'):
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()[:32]
+        self._variants = {'identity': body}
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return sum(len(variant) for variant in self._variants.values())
+
+    def variant(self, encoding):
+        body = self._variants.get(encoding)
+        if body is not None:
+            return body
+        with self._lock:
+            if encoding not in self._variants:
+                identity = self._variants['identity']
+                if encoding == 'gzip':
+                    self._variants[encoding] = gzip.compress(identity, compresslevel=6, mtime=0)
+                elif encoding == 'br':
+                    self._variants[encoding] = brotli.compress(identity, quality=9)
+            return self._variants[encoding]
+
+    def etag_for(self, encoding):
+        # ETag forte distinto por codificação (representações diferentes)
+        return self.etag if encoding == 'identity' else f'{self.etag}-{encoding}'
+
+
+class ResponseCache:
+    """LRU of pre-serialized JSON responses, bounded by total bytes"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self, *_):
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, key, build_body, mimetype='application/json'):
+        """Retorna o CachedBody da chave, gerando os bytes com build_body() na primeira vez"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = CachedBody(build_body(), mimetype)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict()
+        return entry
+
+    def _evict(self):
+        total = sum(entry.size for entry in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            total -= entry.size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(entry.size for entry in self._entries.values()),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+def _negotiate_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted.quality('br') > 0:
+        return 'br'
+    if accepted.quality('gzip') > 0:
+        return 'gzip'
+    return 'identity'
+
+
+def _encode_json(payload):
+    return current_app.json.dumps(payload).encode('utf-8') + b'\n'
+
+
+def cached_json_response(cache, key, build_payload):
+    """Serve the cached JSON for key with ETag/If-None-Match and gzip/br negotiation"""
+    return cached_response(cache, key, lambda: _encode_json(build_payload()))
+
+
+def cached_response(cache, key, build_body, mimetype='application/json', headers=None):
+    """Serve cached bytes for key; build_body() runs only on a cache miss"""
+    entry = cache.get(key, build_body, mimetype)
+    encoding = _negotiate_encoding()
+    etag = entry.etag_for(encoding)
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(entry.variant(encoding), mimetype=entry.mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    for name, value in (headers or {}).items():
+        response.headers[name] = value
+    # Sempre revalidar: após uma recarga de dados o ETag muda
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+RESPONSE_CACHE = ResponseCache(int(os.environ.get('RESPONSE_CACHE_MAX_MB', '64')) * 1024 * 1024)
@@ -0,0 +1,117 @@
+import numpy as np
+
+from dataset_engine import SOURCES_BY_NAME
+
+# Grandes regiões pelo 1º dígito do código IBGE
+IBGE_REGIONS = {
+    '1': 'Norte',
+    '2': 'Nordeste',
+    '3': 'Sudeste',
+    '4': 'Sul',
+    '5': 'Centro-Oeste'
+}
+
+# UFs pelos 2 primeiros dígitos do código IBGE
+IBGE_STATES = {
+    '11': 'RO', '12': 'AC', '13': 'AM', '14': 'RR', '15': 'PA', '16': 'AP', '17': 'TO',
+    '21': 'MA', '22': 'PI', '23': 'CE', '24': 'RN', '25': 'PB', '26': 'PE', '27': 'AL',
+    '28': 'SE', '29': 'BA',
+    '31': 'MG', '32': 'ES', '33': 'RJ', '35': 'SP',
+    '41': 'PR', '42': 'SC', '43': 'RS',
+    '50': 'MS', '51': 'MT', '52': 'GO', '53': 'DF'
+}
+
+ROLLUP_LEVELS = ('state', 'region', 'national')
+
+
+class GeoGroups:
+    """Group index (UF, region) of every municipality row, from its IBGE code prefix"""
+
+    def __init__(self, codes):
+        self.keys = {
+            'state': list(IBGE_STATES),
+            'region': list(IBGE_REGIONS),
+            'national': ['0']
+        }
+        self.labels = {
+            'state': list(IBGE_STATES.values()),
+            'region': list(IBGE_REGIONS.values()),
+            'national': ['Brasil']
+        }
+        state_position = {prefix: i for i, prefix in enumerate(self.keys['state'])}
+        region_position = {digit: i for i, digit in enumerate(self.keys['region'])}
+        codes = codes.tolist()
+        # -1 = código fora da tabela (agregações, códigos inválidos)
+        self.index = {
+            'state': np.array([state_position.get(code[:2], -1) for code in codes], dtype=np.int16),
+            'region': np.array([region_position.get(code[:1], -1) for code in codes], dtype=np.int16),
+            'national': np.zeros(len(codes), dtype=np.int16)
+        }
+
+    def size(self, level):
+        return len(self.keys[level])
+
+
+class RollupCube:
+    """Sum, count, mean, max and min of one category per UF, region and the whole country"""
+
+    def __init__(self, values, rows, groups, integral=False):
+        self.groups = groups
+        self.integral = integral
+        self.levels = {}
+        selected = values[rows]
+        for level in ROLLUP_LEVELS:
+            index = groups.index[level][rows]
+            known = index >= 0
+            index, level_values = index[known], selected[known]
+            size = groups.size(level)
+
+            count = np.bincount(index, minlength=size)
+            total = np.bincount(index, weights=level_values, minlength=size)
+            maximum = np.full(size, -np.inf)
+            minimum = np.full(size, np.inf)
+            np.maximum.at(maximum, index, level_values)
+            np.minimum.at(minimum, index, level_values)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = total / count
+            self.levels[level] = {
+                'sum': total, 'count': count, 'mean': mean, 'max': maximum, 'min': minimum
+            }
+
+    def row(self, level, position):
+        arrays = self.levels[level]
+        native = int if self.integral else float
+        return {
+            'key': self.groups.keys[level][position],
+            'name': self.groups.labels[level][position],
+            'sum': native(arrays['sum'][position]),
+            'count': int(arrays['count'][position]),
+            'mean': float(arrays['mean'][position]),
+            'max': native(arrays['max'][position]),
+            'min': native(arrays['min'][position])
+        }
+
+    def rows(self, level, name=None):
+        """Non-empty groups of a level, largest sum first (or only the group named `name`)"""
+        arrays = self.levels[level]
+        positions = np.flatnonzero(arrays['count'] > 0)
+        positions = positions[np.argsort(-arrays['sum'][positions], kind='stable')]
+        result = [self.row(level, position) for position in positions.tolist()]
+        if name:
+            result = [entry for entry in result if entry['name'] == name or entry['key'] == name]
+        return result
+
+
+def geo_groups(store):
+    return store.derived('geo_groups', lambda s: GeoGroups(s.municipalities.codes))
+
+
+def rollup_cube(store, source, category):
+    """Rollup of a category under its source filter policy, built once per store version"""
+    def build(s):
+        dataset = s[source]
+        i = dataset.category_index[category]
+        rows = dataset.rows(category, SOURCES_BY_NAME[source]['filter'])
+        return RollupCube(dataset.values[i], rows, geo_groups(s), bool(dataset.integral[i]))
+
+    return store.derived(('rollup', source, category), build)
@@ -1,11 +1,28 @@
 import os
-from flask import Flask, render_template, jsonify, request, send_file, redirect, url_for, flash, session
+import unicodedata
+from flask import Flask, Response, render_template, jsonify, request, send_file, redirect, url_for, flash, session, stream_with_context
 import json
+import numpy as np
 import pandas as pd
 from app import app, db
-import io
 from auth import auth_manager, login_required
 from flask_migrate import Migrate
+from dataset_engine import DatasetRegistry, SOURCE_REGISTRY, SOURCES_BY_NAME, FILTER_BASIC, FILTER_REGIONS, FILTER_STRICT
+from response_cache import RESPONSE_CACHE, cached_json_response, cached_response
+from name_resolver import name_index, resolve_name
+from ranking_index import ranking_index, TOP_MAX_K
+from summary_stats import category_summary
+from rollup_cube import rollup_cube, ROLLUP_LEVELS, IBGE_REGIONS
+from comparison_engine import Comparison, COMPARE_MAX_SERIES
+from municipality_search import municipality_search_index
+from potential_score import parse_weights, potential_score
+from territory import build_territory_data, territory_indicators, TerritoryMasks, potential_values, territory_coverage, recommend_expansion
+from municipality_geometry import municipality_geometry
+from export_cache import ArtifactCache, file_digest, workbook_frame
+from export_jobs import ExportJobQueue
+from export_engine import export_progress, pyarrow, EXPORT_FORMATS, EXPORT_MIMETYPES, write_export, csv_chunks, safe_name, frame_sheet, category_export_sheets, crop_analysis_sheets, complete_fertilizer_sheets
+from urllib.parse import quote, urlsplit
+from werkzeug.http import parse_options_header
 from datetime import datetime
 
 # Initialize Migration
@@ -13,94 +30,63 @@ migrate = Migrate(app, db)
 
 
 
-# Load crop data
-def load_crop_data():
-    try:
-        with open('data/crop_data_static.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        print("Arquivo crop_data_static.json não encontrado")
-        return {}
-    except Exception as e:
-        print(f"Erro ao carregar dados: {e}")
-        return {}
+# Load static datasets (shared municipality dimension + value matrix per source).
+# The registry watches data/ and swaps in a new store when a file changes.
+DATA_REGISTRY = DatasetRegistry()
+# Encoded per-category responses are dropped whenever the data is swapped
+DATA_REGISTRY.add_listener(RESPONSE_CACHE.clear)
+DATA_REGISTRY.start_watcher(int(os.environ.get('DATA_RELOAD_INTERVAL', '30')))
+
+# Formatos aceitos em ?format= pelos endpoints de camadas do mapa
+LAYER_FORMATS = ('json', 'columnar', 'float32')
+
+def layer_response(store, source, category, rows=None, value_key=None, default_unit=None, extra=None):
+    """Layer payload in the requested wire format, served from the response cache
+
+    json:     {code: {municipality_name, state_code, <value>, unit}} (default)
+    columnar: parallel `codes` / `values` arrays, unit sent once
+    float32:  little-endian Float32 vector aligned to /api/municipios/order (NaN = no data)
+    """
+    wire_format = request.args.get('format', 'json').lower()
+    if wire_format not in LAYER_FORMATS:
+        return jsonify({'success': False, 'error': f"Formato '{wire_format}' inválido; use {', '.join(LAYER_FORMATS)}"}), 400
+
+    dataset = store[source]
+    extra = extra or {}
+    key = (store.version, request.path, request.args.get('state'), wire_format)
+
+    if wire_format == 'float32':
+        unit = dataset.unit(category) or default_unit or ''
+        return cached_response(
+            RESPONSE_CACHE, key,
+            lambda: dataset.dense_float32(category, rows).tobytes(),
+            mimetype='application/octet-stream',
+            headers={
+                'X-Dataset-Version': str(store.version),
+                'X-Municipality-Count': str(len(store.municipalities)),
+                'X-Unit': quote(unit)
+            }
+        )
 
-# Load fertilizer data
-def load_fertilizer_data():
-    try:
-        with open('data/fertilizer_data_static_corrigido.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        print("Arquivo fertilizer_data_static_corrigido.json não encontrado")
-        return {}
-    except Exception as e:
-        print(f"Erro ao carregar dados de fertilizantes: {e}")
-        return {}
-
-# Load static data files
-try:
-    with open('data/crop_data_static.json', 'r', encoding='utf-8') as f:
-        CROP_DATA = json.load(f)
-    print(f"Loaded crop data with {len(CROP_DATA)} crops")
-except Exception as e:
-    print(f"Error loading crop data: {e}")
-    CROP_DATA = {}
-
-try:
-    with open('data/fertilizer_data_static_corrigido.json', 'r', encoding='utf-8') as f:
-        FERTILIZER_DATA = json.load(f)
-    print(f"Loaded fertilizer data with {len(FERTILIZER_DATA)} categories")
-except Exception as e:
-    print(f"Error loading fertilizer data: {e}")
-    FERTILIZER_DATA = {}
-
-try:
-    with open('data/agrotoxico_data_static.json', 'r', encoding='utf-8') as f:
-        AGROTOXICO_DATA = json.load(f)
-    print(f"Loaded agrotoxico data with {len(AGROTOXICO_DATA)} categories")
-except Exception as e:
-    print(f"Error loading agrotoxico data: {e}")
-    AGROTOXICO_DATA = {}
-
-try:
-    with open('data/consultoria_tecnica_data_static.json', 'r', encoding='utf-8') as f:
-        CONSULTORIA_DATA = json.load(f)
-    print(f"Loaded consultoria tecnica data with {len(CONSULTORIA_DATA)} categories")
-except Exception as e:
-    print(f"Error loading consultoria tecnica data: {e}")
-    CONSULTORIA_DATA = {}
-
-try:
-    with open('data/corretivos_data_static.json', 'r', encoding='utf-8') as f:
-        CORRETIVOS_DATA = json.load(f)
-    print(f"Loaded corretivos data with {len(CORRETIVOS_DATA)} categories")
-except Exception as e:
-    print(f"Error loading corretivos data: {e}")
-    CORRETIVOS_DATA = {}
-
-try:
-    with open('data/despesa_data_static.json', 'r', encoding='utf-8') as f:
-        DESPESA_DATA = json.load(f)
-    print(f"Loaded despesa data with {len(DESPESA_DATA)} categories")
-except Exception as e:
-    print(f"Error loading despesa data: {e}")
-    DESPESA_DATA = {}
-
-try:
-    with open('data/escolaridade_data_static.json', 'r', encoding='utf-8') as f:
-        ESCOLARIDADE_DATA = json.load(f)
-    print(f"Loaded escolaridade data with {len(ESCOLARIDADE_DATA)} categories")
-except Exception as e:
-    print(f"Error loading escolaridade data: {e}")
-    ESCOLARIDADE_DATA = {}
-
-try:
-    with open('data/receita_data_static.json', 'r', encoding='utf-8') as f:
-        RECEITA_DATA = json.load(f)
-    print(f"Loaded receita data with {len(RECEITA_DATA)} categories")
-except Exception as e:
-    print(f"Error loading receita data: {e}")
-    RECEITA_DATA = {}
+    if wire_format == 'columnar':
+        def build_payload():
+            return {
+                'success': True,
+                'format': 'columnar',
+                'version': store.version,
+                'unit': dataset.unit(category) or default_unit,
+                **dataset.columnar(category, rows),
+                **extra
+            }
+    else:
+        def build_payload():
+            return {
+                'success': True,
+                'data': dataset.records(category, rows, value_key=value_key, default_unit=default_unit),
+                **extra
+            }
+
+    return cached_json_response(RESPONSE_CACHE, key, build_payload)
 
 @app.route('/')
 @login_required
@@ -158,35 +144,27 @@ def get_states():
 @app.route('/api/statistics')
 def get_statistics():
     try:
-        # CROP_DATA structure: {crop_name: {municipality_code: {data}}}
-        total_crops = len(CROP_DATA)
-        total_fertilizer_categories = len(FERTILIZER_DATA)
-        total_agrotoxico_categories = len(AGROTOXICO_DATA)
-        total_consultoria_categories = len(CONSULTORIA_DATA)
-        total_corretivos_categories = len(CORRETIVOS_DATA)
-        total_despesa_categories = len(DESPESA_DATA)
-        total_escolaridade_categories = len(ESCOLARIDADE_DATA)
-        total_receita_categories = len(RECEITA_DATA)
-
-        # Count unique municipalities across all crops
-        all_municipalities = set()
-        for crop_data in CROP_DATA.values():
-            all_municipalities.update(crop_data.keys())
-
-        # Count unique municipalities across all fertilizer categories
-        all_fertilizer_municipalities = set()
-        for fertilizer_data in FERTILIZER_DATA.values():
-            all_fertilizer_municipalities.update(fertilizer_data.keys())
-
-        total_municipalities = len(all_municipalities)
-        total_fertilizer_municipalities = len(all_fertilizer_municipalities)
+        store = DATA_REGISTRY.current()
+        # store: one value matrix (categories x municipalities) per source
+        total_crops = len(store['crop'])
+        total_fertilizer_categories = len(store['fertilizer'])
+        total_agrotoxico_categories = len(store['agrotoxico'])
+        total_consultoria_categories = len(store['consultoria'])
+        total_corretivos_categories = len(store['corretivos'])
+        total_despesa_categories = len(store['despesa'])
+        total_escolaridade_categories = len(store['escolaridade'])
+        total_receita_categories = len(store['receita'])
+
+        # Count unique municipalities across all crops / fertilizer categories
+        total_municipalities = len(store['crop'].present_rows())
+        total_fertilizer_municipalities = len(store['fertilizer'].present_rows())
 
         # Calculate total establishments for fertilizer data
         total_establishments = 0
-        if 'Total Estabelecimentos' in FERTILIZER_DATA:
-            for municipality_data in FERTILIZER_DATA['Total Estabelecimentos'].values():
-                if isinstance(municipality_data, dict) and 'value' in municipality_data:
-                    total_establishments += municipality_data.get('value', 0)
+        if 'Total Estabelecimentos' in store['fertilizer']:
+            total_establishments = float(np.nansum(store['fertilizer'].column('Total Estabelecimentos')))
+            if total_establishments.is_integer():
+                total_establishments = int(total_establishments)
 
         return jsonify({
             'success': True,
@@ -219,8 +197,8 @@ def get_statistics():
 @app.route('/api/crops')
 def get_crops():
     try:
-        # CROP_DATA structure: {crop_name: {municipality_code: {data}}}
-        sorted_crops = sorted(list(CROP_DATA.keys()))
+        store = DATA_REGISTRY.current()
+        sorted_crops = sorted(list(store['crop'].categories))
         return jsonify({
             'success': True,
             'crops': sorted_crops
@@ -228,391 +206,321 @@ def get_crops():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/fertilizer-categories')
-def get_fertilizer_categories():
+# Rotas genéricas das fontes do SOURCE_REGISTRY (categorias, camada do mapa e exportação)
+def source_categories(source):
+    """Category list of a registry source"""
     try:
-        # FERTILIZER_DATA structure: {category_name: {municipality_code: {data}}}
-        categories = sorted(list(FERTILIZER_DATA.keys()))
+        store = DATA_REGISTRY.current()
+        categories = list(store[source['name']].categories)
+        if source.get('sort_categories'):
+            categories.sort()
         return jsonify({
             'success': True,
-            'categories': categories
+            'categories': categories,
+            'total': len(categories)
         })
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/agrotoxico/categories')
-def get_agrotoxico_categories():
+def source_layer(source, category):
+    """Map layer of one category, filtered by the source policy and optional ?state="""
     try:
-        categories = list(AGROTOXICO_DATA.keys())
-        return jsonify({
-            "success": True,
-            "categories": categories,
-            "total": len(categories)
-        })
-    except Exception as e:
-        return jsonify({
-            "success": False,
-            "error": str(e)
-        }), 500
+        store = DATA_REGISTRY.current()
+        dataset = store[source['name']]
+        if category not in dataset:
+            return jsonify({
+                'success': False,
+                'error': f"Categoria de {source['title']} \"{category}\" não encontrada"
+            }), 404
 
-@app.route('/api/consultoria/categories')
-def get_consultoria_categories():
-    try:
-        categories = list(CONSULTORIA_DATA.keys())
-        return jsonify({
-            "success": True,
-            "categories": categories,
-            "total": len(categories)
-        })
+        rows = dataset.rows(category, source['filter'], request.args.get('state'))
+        return layer_response(store, source['name'], category, rows,
+                              value_key=source.get('value_key'), default_unit=source['unit'],
+                              extra={'type': source['name'], 'category': category})
     except Exception as e:
-        return jsonify({
-            "success": False,
-            "error": str(e)
-        }), 500
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/corretivos/categories')
-def get_corretivos_categories():
+def request_export_format():
+    """Formato pedido em ?format= (xlsx, csv ou parquet); (formato, None) ou (None, resposta de erro)"""
+    export_format = (request.args.get('format') or 'xlsx').lower()
+    if export_format not in EXPORT_FORMATS:
+        return None, (jsonify({'success': False, 'error': f"Formato inválido; use {', '.join(EXPORT_FORMATS)}"}), 400)
+    if export_format == 'parquet' and pyarrow is None:
+        return None, (jsonify({'success': False, 'error': 'Formato parquet indisponível neste servidor'}), 501)
+    return export_format, None
+
+def set_attachment(response, filename):
+    """Content-Disposition de download (com filename* quando o nome não é ASCII)"""
     try:
-        categories = list(CORRETIVOS_DATA.keys())
-        return jsonify({
-            "success": True,
-            "categories": categories,
-            "total": len(categories)
-        })
-    except Exception as e:
-        return jsonify({
-            "success": False,
-            "error": str(e)
-        }), 500
-
-@app.route('/api/despesa/categories')
-def get_despesa_categories():
+        filename.encode('ascii')
+        options = {'filename': filename}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        options = {'filename': simple, 'filename*': f"UTF-8''{quote(filename, safe='!#$&+-.^_`|~')}"}
+    response.headers.set('Content-Disposition', 'attachment', **options)
+    return response
+
+# Artefatos de exportação reaproveitados entre downloads (LRU em disco)
+EXPORT_ARTIFACTS = ArtifactCache()
+# Incrementar quando o conteúdo das planilhas mudar, invalidando os artefatos antigos
+EXPORT_LAYOUT_VERSION = 3
+
+def export_artifact_key(store, sources, *parts):
+    """Chave de um artefato: layout, parâmetros e hash do conteúdo das fontes lidas pela rota
+    (None = todas); recarregar outra fonte não invalida o artefato"""
+    names = sorted(store.datasets) if sources is None else sorted(sources)
+    hashes = tuple((name, (store.fingerprints.get(name) or {}).get('sha1')) for name in names)
+    if not all(sha1 for _, sha1 in hashes):
+        # Sem hash de alguma fonte, vale só para esta carga dos dados
+        hashes = ('store', store.version, store.loaded_at)
+    return (EXPORT_LAYOUT_VERSION, *parts, hashes)
+
+def export_download(sheets, basename, key):
+    """Exportação no ?format= pedido, servida do cache de artefatos quando já gerada
+
+    Na primeira vez o CSV é gerado em blocos direto na resposta (e gravado no cache ao
+    terminar); xlsx (write-only) e parquet são gravados no cache e enviados em blocos. A data da
+    exportação vai no cabeçalho X-Export-Date, fora do arquivo, para o artefato ser reutilizável.
+    """
+    export_format, error = request_export_format()
+    if error:
+        return error
+    key = (*key, export_format)
+    filename = f'{basename}.{export_format}'
+    path = EXPORT_ARTIFACTS.path_for(key, export_format)
+
+    if export_format == 'csv' and not EXPORT_ARTIFACTS.lookup(path):
+        chunks = EXPORT_ARTIFACTS.stream_into(key, export_format, csv_chunks(next(iter(sheets))))
+        response = set_attachment(Response(stream_with_context(chunks), mimetype=EXPORT_MIMETYPES['csv']), filename)
+        hit = False
+    else:
+        path, hit = EXPORT_ARTIFACTS.get_or_build(key, export_format, lambda f: write_export(sheets, export_format, f))
+        response = send_file(os.path.abspath(path), mimetype=EXPORT_MIMETYPES[export_format], as_attachment=True,
+                             download_name=filename, etag=os.path.basename(path))
+
+    response.headers['X-Export-Date'] = pd.Timestamp.now().strftime('%d/%m/%Y %H:%M:%S')
+    response.headers['X-Export-Cache'] = 'hit' if hit else 'miss'
+    return response
+
+def source_export(source, category):
+    """Export one category of a registry source (?format=xlsx|csv|parquet)"""
     try:
-        categories = list(DESPESA_DATA.keys())
-        return jsonify({
-            "success": True,
-            "categories": categories,
-            "total": len(categories)
-        })
+        store = DATA_REGISTRY.current()
+        name = source['name']
+        state_filter = request.args.get('state')
+
+        if category not in store[name]:
+            return jsonify({'success': False, 'error': f"Categoria de {source['title']} não encontrada"}), 404
+
+        state_suffix = f'_{state_filter}' if state_filter else '_Nacional'
+        prefix = source.get('export_prefix', f'{name}_')
+        basename = f'analise_{prefix}{safe_name(category)}{state_suffix}_{pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")}'
+        return export_download(category_export_sheets(store, source, category, state_filter), basename,
+                               export_artifact_key(store, [name], 'source', name, category, state_filter))
+
     except Exception as e:
-        return jsonify({
-            "success": False,
-            "error": str(e)
-        }), 500
+        print(f"Erro ao exportar análise de {source['title']}: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/escolaridade/categories')
-def get_escolaridade_categories():
+def register_source_routes(source):
+    """Mount categories/layer/export routes of one SOURCE_REGISTRY entry"""
+    name = source['name']
+    urls = {
+        'categories': f'/api/{name}/categories',
+        'data': f'/api/{name}/<category>',
+        'export': f'/api/export/{name}-analysis/<category>',
+        **source.get('urls', {})
+    }
+    app.add_url_rule(urls['categories'], f'get_{name}_categories',
+                     lambda: source_categories(source))
+    app.add_url_rule(urls['data'], f'get_{name}_data',
+                     lambda category: source_layer(source, category))
+    app.add_url_rule(urls['export'], f'export_{name}_analysis',
+                     lambda category: source_export(source, category))
+
+for source in SOURCE_REGISTRY:
+    if source.get('routes', True):
+        register_source_routes(source)
+
+@app.route('/api/municipios/order')
+def get_municipality_order():
+    """Municipality order used by the float32 layer format (index i = value i)"""
     try:
-        categories = list(ESCOLARIDADE_DATA.keys())
-        return jsonify({
-            "success": True,
-            "categories": categories,
-            "total": len(categories)
+        store = DATA_REGISTRY.current()
+        municipalities = store.municipalities
+        return cached_json_response(RESPONSE_CACHE, (store.version, request.path), lambda: {
+            'success': True,
+            'version': store.version,
+            'codes': municipalities.codes.tolist(),
+            'states': municipalities.states.tolist()
         })
     except Exception as e:
-        return jsonify({
-            "success": False,
-            "error": str(e)
-        }), 500
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+BATCH_MAX_LAYERS = 50
 
-@app.route('/api/receita/categories')
-def get_receita_categories():
+def build_batch_layer(store, spec):
+    """Payload of one layer of a batch request (same shapes as the single-layer routes)"""
+    source = spec.get('source')
+    if source == 'revenda':
+        revenda_id = str(spec.get('id', ''))
+        revenda = db.session.get(Revenda, int(revenda_id)) if revenda_id.isdigit() else None
+        if revenda is None:
+            return {'success': False, 'error': 'Revenda não encontrada'}
+        municipios_codes = revenda.get_municipios_list()
+        if not municipios_codes:
+            return {'success': False, 'error': 'Nenhum município cadastrado para esta revenda'}
+        territory_data, _ = build_territory_data(store, municipios_codes)
+        return {'success': True, 'data': territory_data, 'type': 'revendas', 'cor': revenda.cor}
+
+    if source not in SOURCES_BY_NAME:
+        return {'success': False, 'error': f"Fonte '{source}' desconhecida"}
+
+    config = SOURCES_BY_NAME[source]
+    value_key, default_unit = config.get('value_key'), config['unit']
+    dataset = store[source]
+    category = spec.get('category')
+    if source == 'crop' and category is not None:
+        category = resolve_name(store, 'crop', category)
+    if category not in dataset:
+        return {'success': False, 'error': f"Categoria '{spec.get('category')}' não encontrada"}
+
+    rows = dataset.rows(category, config['filter'], spec.get('state') or None)
+    payload = {'success': True, 'category': category}
+    if spec.get('format', 'json') == 'columnar':
+        payload.update(format='columnar', unit=dataset.unit(category) or default_unit, **dataset.columnar(category, rows))
+    else:
+        payload['data'] = dataset.records(category, rows, value_key=value_key, default_unit=default_unit)
+    return payload
+
+@app.route('/api/layers/batch', methods=['POST'])
+def get_layers_batch():
+    """Several map layers in one round-trip
+
+    Body: {"layers": [{"source", "category", "state"?, "format"?: "json"|"columnar"}
+                      | {"source": "revenda", "id"}], "stream"?: bool}
+    Layers come back in request order; with stream=true as NDJSON, one line per layer.
+    """
     try:
-        categories = list(RECEITA_DATA.keys())
+        store = DATA_REGISTRY.current()
+        body = request.get_json(silent=True) or {}
+        layers = body.get('layers')
+        if not isinstance(layers, list) or not layers:
+            return jsonify({'success': False, 'error': 'Informe a lista "layers"'}), 400
+        if len(layers) > BATCH_MAX_LAYERS:
+            return jsonify({'success': False, 'error': f'Máximo de {BATCH_MAX_LAYERS} camadas por requisição'}), 400
+
+        # Uma única verificação de sessão para todas as camadas de revenda
+        revenda_allowed = auth_manager.is_authenticated()
+
+        def build(spec):
+            if not isinstance(spec, dict):
+                return {'success': False, 'error': 'Camada inválida'}
+            if spec.get('source') == 'revenda' and not revenda_allowed:
+                return {'success': False, 'error': 'Autenticação necessária'}
+            try:
+                return build_batch_layer(store, spec)
+            except Exception as e:
+                return {'success': False, 'error': str(e)}
+
+        if body.get('stream'):
+            def generate():
+                for index, spec in enumerate(layers):
+                    yield app.json.dumps({'index': index, **build(spec)}) + '\n'
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                            headers={'X-Dataset-Version': str(store.version)})
+
         return jsonify({
-            "success": True,
-            "categories": categories,
-            "total": len(categories)
+            'success': True,
+            'version': store.version,
+            'layers': [build(spec) for spec in layers]
         })
     except Exception as e:
-        return jsonify({
-            "success": False,
-            "error": str(e)
-        }), 500
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/fertilizer-data/<category_name>')
-def get_fertilizer_data(category_name):
+@app.route('/api/resolve')
+def resolve_names():
+    """Ranked approximate matches of ?q= among crop/category names (?source= limits to one dataset)"""
     try:
-        # Busca exata primeiro
-        if category_name in FERTILIZER_DATA:
-            all_fertilizer_data = FERTILIZER_DATA[category_name]
-
-            # Filtrar apenas municípios válidos (códigos IBGE reais de municípios)
-            fertilizer_municipalities = {}
-            for municipality_code, municipality_data in all_fertilizer_data.items():
-                municipality_code_str = str(municipality_code)
-                municipality_name = municipality_data.get('municipality_name', '').lower()
-
-                # Verificar se é um código de município válido
-                if (len(municipality_code_str) == 7 and 
-                    municipality_code_str.isdigit() and
-                    municipality_code_str[0] in '12345' and  # Códigos reais começam com 1-5
-                    municipality_data.get('municipality_name') and
-                    # Excluir nomes que indicam regiões/agregações
-                    not any(keyword in municipality_name for keyword in [
-                        'região', 'mesorregião', 'microrregião', 'nordeste', 'norte', 'sul', 
-                        'centro', 'oeste', 'leste', 'sudeste', 'noroeste', 'sudoeste',
-                        'alto ', 'baixo ', 'médio ', '-grossense', 'parecis', 'araguaia',
-                        'pantanal', 'cerrado', 'amazônia', 'caatinga', 'mata atlântica'
-                    ])):
-                    # Padronizar o nome do campo para compatibilidade
-                    fertilizer_data = {
-                        'municipality_name': municipality_data.get('municipality_name'),
-                        'state_code': municipality_data.get('state_code'),
-                        'harvested_area': municipality_data.get('value', 0),  # Mapear 'value' para 'harvested_area'
-                        'unit': municipality_data.get('unit', 'un')
-                    }
-                    fertilizer_municipalities[municipality_code] = fertilizer_data
+        store = DATA_REGISTRY.current()
+        query = request.args.get('q', '').strip()
+        source = request.args.get('source') or None
+        limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
 
-            return jsonify({
-                'success': True,
-                'data': fertilizer_municipalities,
-                'data_type': 'fertilizer'
-            })
-
-        return jsonify({'success': False, 'error': 'Categoria de fertilizantes não encontrada'})
-
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+        if not query:
+            return jsonify({'success': False, 'error': 'Parâmetro q é obrigatório'}), 400
+        if source and source not in store:
+            return jsonify({'success': False, 'error': f"Fonte '{source}' desconhecida"}), 400
 
-@app.route('/api/agrotoxico/<category>')
-def get_agrotoxico_data(category):
-    try:
-        if category in AGROTOXICO_DATA:
-            return jsonify({
-                'success': True,
-                'data': AGROTOXICO_DATA[category],
-                'type': 'agrotoxico'
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': f'Categoria de agrotóxico "{category}" não encontrada'
-            }), 404
-    except Exception as e:
         return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
-
-@app.route('/api/consultoria/<category>')
-def get_consultoria_data(category):
-    try:
-        if category in CONSULTORIA_DATA:
-            return jsonify({
-                'success': True,
-                'data': CONSULTORIA_DATA[category],
-                'category': category
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': f"Categoria '{category}' não encontrada"
-            }), 404
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
-
-@app.route('/api/corretivos/<category>')
-def get_corretivos_data(category):
-    try:
-        if category in CORRETIVOS_DATA:
-            return jsonify({
-                'success': True,
-                'data': CORRETIVOS_DATA[category],
-                'category': category
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': f"Categoria '{category}' não encontrada"
-            }), 404
+            'success': True,
+            'query': query,
+            'matches': name_index(store).search(query, source=source, limit=limit)
+        })
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/despesa/<category>')
-def get_despesa_data(category):
+@app.route('/api/top')
+def get_top_municipalities():
+    """Top-k municipalities of a category (?source=&category=&k=&state=) from the ranking index"""
     try:
-        if category in DESPESA_DATA:
-            return jsonify({
-                'success': True,
-                'data': DESPESA_DATA[category],
-                'type': 'despesa'
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': f'Categoria de despesa "{category}" não encontrada'
-            }), 404
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        store = DATA_REGISTRY.current()
+        source = request.args.get('source', 'crop')
+        category = request.args.get('category', '')
+        state = request.args.get('state') or None
+        k = min(max(request.args.get('k', 10, type=int), 1), TOP_MAX_K)
+
+        if source not in SOURCES_BY_NAME:
+            return jsonify({'success': False, 'error': f"Fonte '{source}' desconhecida"}), 400
+        matched = resolve_name(store, source, category)
+        if matched is None:
+            return jsonify({'success': False, 'error': f"Categoria '{category}' não encontrada"}), 404
+
+        dataset = store[source]
+        ranking = ranking_index(store, source, matched)
+        rows = ranking.top(k, state)
+        municipalities = store.municipalities
+        values = dataset.values_at(matched, rows)
 
-@app.route('/api/escolaridade/<category>')
-def get_escolaridade_data(category):
-    try:
-        if category in ESCOLARIDADE_DATA:
-            return jsonify({
-                'success': True,
-                'data': ESCOLARIDADE_DATA[category],
-                'category': category
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': f"Categoria '{category}' não encontrada"
-            }), 404
-    except Exception as e:
         return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
-
-@app.route('/api/receita/<category>')
-def get_receita_data(category):
-    try:
-        if category in RECEITA_DATA:
-            return jsonify({
-                'success': True,
-                'data': RECEITA_DATA[category],
-                'type': 'receita'
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': f'Categoria de receita "{category}" não encontrada'
-            }), 404
+            'success': True,
+            'source': source,
+            'category': matched,
+            'state': state,
+            'unit': dataset.unit(matched) or SOURCES_BY_NAME[source]['unit'],
+            'total': len(ranking.rows(state)),
+            'items': [
+                {
+                    'rank': rank,
+                    'code': str(municipalities.codes[row]),
+                    'municipality_name': municipalities.names[row],
+                    'state_code': str(municipalities.states[row]),
+                    'value': value
+                }
+                for rank, (row, value) in enumerate(zip(rows.tolist(), values), start=1)
+            ]
+        })
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/crop-data/<crop_name>')
 def get_crop_data(crop_name):
     try:
-        # Busca exata primeiro
-        if crop_name in CROP_DATA:
-            all_crop_data = CROP_DATA[crop_name]
-
-            # Filtrar apenas municípios válidos (códigos IBGE reais de municípios)
-            crop_municipalities = {}
-            for municipality_code, municipality_data in all_crop_data.items():
-                municipality_code_str = str(municipality_code)
-                municipality_name = municipality_data.get('municipality_name', '').lower()
-
-                # Verificar se é um código de município válido
-                # Códigos de município IBGE começam com 1-5 e têm 7 dígitos
-                # Excluir códigos que começam com 0 (são agregações regionais)
-                if (len(municipality_code_str) == 7 and 
-                    municipality_code_str.isdigit() and
-                    municipality_code_str[0] in '12345' and  # Códigos reais começam com 1-5
-                    municipality_data.get('municipality_name') and
-                    # Excluir nomes que indicam regiões/agregações
-                    not any(keyword in municipality_name for keyword in [
-                        'região', 'mesorregião', 'microrregião', 'nordeste', 'norte', 'sul', 
-                        'centro', 'oeste', 'leste', 'sudeste', 'noroeste', 'sudoeste',
-                        'alto ', 'baixo ', 'médio ', '-grossense', 'parecis', 'araguaia',
-                        'pantanal', 'cerrado', 'amazônia', 'caatinga', 'mata atlântica'
-                    ]) and
-                    # Excluir nomes muito genéricos ou que são claramente regiões
-                    municipality_name not in [
-                        'alto teles pires', 'sudeste mato-grossense', 'parecis', 'barreiras',
-                        'dourados', 'norte mato-grossense', 'portal da amazônia'
-                    ]):
-                    crop_municipalities[municipality_code] = municipality_data
-
-            # Debug: Encontrar o maior produtor para verificação
-            if crop_municipalities:
-                # Ordenar por área colhida para debug
-                sorted_municipalities = sorted(crop_municipalities.items(), 
-                                             key=lambda x: float(x[1].get('harvested_area', 0)), 
-                                             reverse=True)
-                max_municipality = sorted_municipalities[0]
-                print(f"Debug - Maior produtor de {crop_name} (apenas municípios): {max_municipality[1].get('municipality_name')} ({max_municipality[1].get('state_code')}) - {max_municipality[1].get('harvested_area')} hectares")
-
-                # Mostrar top 5 municípios para verificação
-                print(f"Debug - Top 5 municípios produtores de {crop_name}:")
-                for i, (code, data) in enumerate(sorted_municipalities[:5]):
-                    print(f"  {i+1}. {data.get('municipality_name')} ({data.get('state_code')}): {data.get('harvested_area')} ha - Código: {code}")
-            else:
-                print(f"Debug - Nenhum município válido encontrado para {crop_name}")
+        store = DATA_REGISTRY.current()
+        crops = store['crop']
+        matched_crop = resolve_name(store, 'crop', crop_name)
 
-            return jsonify({
-                'success': True,
-                'data': crop_municipalities
-            })
+        if matched_crop is None:
+            return jsonify({'success': False, 'error': 'Cultura não encontrada'})
 
-        # Busca similar se não encontrar exata
-        crop_name_lower = crop_name.lower()
-        similar_crops = []
-
-        for available_crop in CROP_DATA.keys():
-            if crop_name_lower in available_crop.lower() or available_crop.lower() in crop_name_lower:
-                similar_crops.append(available_crop)
-
-        if similar_crops:
-            # Usar a primeira cultura similar encontrada
-            best_match = similar_crops[0]
-            all_crop_data = CROP_DATA[best_match]
-
-            # Filtrar apenas municípios válidos (códigos IBGE reais de municípios)
-            crop_municipalities = {}
-            for municipality_code, municipality_data in all_crop_data.items():
-                municipality_code_str = str(municipality_code)
-                municipality_name = municipality_data.get('municipality_name', '').lower()
-
-                # Verificar se é um código de município válido
-                # Códigos de município IBGE começam com 1-5 e têm 7 dígitos
-                # Excluir códigos que começam com 0 (são agregações regionais)
-                if (len(municipality_code_str) == 7 and 
-                    municipality_code_str.isdigit() and
-                    municipality_code_str[0] in '12345' and  # Códigos reais começam com 1-5
-                    municipality_data.get('municipality_name') and
-                    # Excluir nomes que indicam regiões/agregações
-                    not any(keyword in municipality_name for keyword in [
-                        'região', 'mesorregião', 'microrregião', 'nordeste', 'norte', 'sul', 
-                        'centro', 'oeste', 'leste', 'sudeste', 'noroeste', 'sudoeste',
-                        'alto ', 'baixo ', 'médio ', '-grossense', 'parecis', 'araguaia',
-                        'pantanal', 'cerrado', 'amazônia', 'caatinga', 'mata atlântica'
-                    ]) and
-                    # Excluir nomes muito genéricos ou que são claramente regiões
-                    municipality_name not in [
-                        'alto teles pires', 'sudeste mato-grossense', 'parecis', 'barreiras',
-                        'dourados', 'norte mato-grossense', 'portal da amazônia'
-                    ]):
-                    crop_municipalities[municipality_code] = municipality_data
-
-            # Debug: Encontrar o maior produtor para verificação
-            if crop_municipalities:
-                # Ordenar por área colhida para debug
-                sorted_municipalities = sorted(crop_municipalities.items(), 
-                                             key=lambda x: float(x[1].get('harvested_area', 0)), 
-                                             reverse=True)
-                max_municipality = sorted_municipalities[0]
-                print(f"Debug - Maior produtor de {best_match} (apenas municípios): {max_municipality[1].get('municipality_name')} ({max_municipality[1].get('state_code')}) - {max_municipality[1].get('harvested_area')} hectares")
-
-                # Mostrar top 5 municípios para verificação
-                print(f"Debug - Top 5 municípios produtores de {best_match}:")
-                for i, (code, data) in enumerate(sorted_municipalities[:5]):
-                    print(f"  {i+1}. {data.get('municipality_name')} ({data.get('state_code')}): {data.get('harvested_area')} ha - Código: {code}")
-            else:
-                print(f"Debug - Nenhum município válido encontrado para {best_match}")
+        # Filtrar apenas municípios válidos (máscara pré-calculada na carga)
+        rows = crops.rows(matched_crop, FILTER_STRICT)
 
-            return jsonify({
-                'success': True,
-                'data': crop_municipalities,
-                'matched_crop': best_match
-            })
+        extra = {}
+        if matched_crop != crop_name:
+            extra['matched_crop'] = matched_crop
 
-        return jsonify({'success': False, 'error': 'Cultura não encontrada'})
+        return layer_response(store, 'crop', matched_crop, rows, default_unit=SOURCES_BY_NAME['crop']['unit'], extra=extra)
 
     except Exception as e:
         print(f"Erro crítico em get_crop_data: {str(e)}")
@@ -623,47 +531,18 @@ def get_crop_data(crop_name):
 @app.route('/api/crop-chart-data/<crop_name>')
 def get_crop_chart_data(crop_name):
     try:
-        if crop_name not in CROP_DATA:
+        store = DATA_REGISTRY.current()
+        crops = store['crop']
+        if crop_name not in crops:
             return jsonify({'success': False, 'error': 'Cultura não encontrada'})
 
-        crop_municipalities = []
-        for municipality_code, municipality_data in CROP_DATA[crop_name].items():
-            # Filtrar apenas municípios válidos (códigos IBGE reais de municípios)
-            municipality_code_str = str(municipality_code)
-            municipality_name = municipality_data.get('municipality_name', '').lower()
-
-            # Verificar se é um código de município válido
-            # Códigos de município IBGE começam com 1-5 e têm 7 dígitos
-            # Excluir códigos que começam com 0 (são agregações regionais)
-            if (len(municipality_code_str) == 7 and 
-                municipality_code_str.isdigit() and
-                municipality_code_str[0] in '12345' and  # Códigos reais começam com 1-5
-                municipality_data.get('municipality_name') and
-                # Excluir nomes que indicam regiões/agregações
-                not any(keyword in municipality_name for keyword in [
-                    'região', 'mesorregião', 'microrregião', 'nordeste', 'norte', 'sul', 
-                    'centro', 'oeste', 'leste', 'sudeste', 'noroeste', 'sudoeste',
-                    'alto ', 'baixo ', 'médio ', '-grossense', 'parecis', 'araguaia',
-                    'pantanal', 'cerrado', 'amazônia', 'caatinga', 'mata atlântica'
-                ]) and
-                # Excluir nomes muito genéricos ou que são claramente regiões
-                municipality_name not in [
-                    'alto teles pires', 'sudeste mato-grossense', 'parecis', 'barreiras',
-                    'dourados', 'norte mato-grossense', 'portal da amazônia'
-                ]):
-                crop_municipalities.append({
-                    'municipality_name': municipality_data.get('municipality_name', 'Desconhecido'),
-                    'state_code': municipality_data.get('state_code', 'XX'),
-                    'harvested_area': municipality_data.get('harvested_area', 0)
-                })
-
-        # Sort by harvested area and take top 20
-        crop_municipalities.sort(key=lambda x: x['harvested_area'], reverse=True)
-        top_20 = crop_municipalities[:20]
+        # Top 20 por área colhida (índice de ranking, apenas municípios válidos)
+        top_20 = ranking_index(store, 'crop', crop_name).top(20)
+        municipalities = store.municipalities
 
         chart_data = {
-            'labels': [f"{muni['municipality_name']} ({muni['state_code']})" for muni in top_20],
-            'data': [muni['harvested_area'] for muni in top_20]
+            'labels': [f"{municipalities.names[row]} ({municipalities.states[row]})" for row in top_20.tolist()],
+            'data': crops.values_at(crop_name, top_20)
         }
 
         return jsonify({
@@ -675,56 +554,29 @@ def get_crop_chart_data(crop_name):
 
 @app.route('/api/analysis/statistical-summary/<crop_name>')
 def get_statistical_summary(crop_name):
+    """Descriptive statistics of a category; ?source= (default crop) and optional ?state="""
     try:
-        if crop_name not in CROP_DATA:
-            return jsonify({'success': False, 'error': 'Cultura não encontrada'})
-
-        # Filtrar apenas municípios válidos (códigos IBGE reais de municípios)
-        values = []
-        for municipality_code, data in CROP_DATA[crop_name].items():
-            municipality_code_str = str(municipality_code)
-            municipality_name = data.get('municipality_name', '').lower()
-
-            # Verificar se é um código de município válido
-            # Códigos de município IBGE começam com 1-5 e têm 7 dígitos
-            # Excluir códigos que começam com 0 (são agregações regionais)
-            if (len(municipality_code_str) == 7 and 
-                municipality_code_str.isdigit() and
-                municipality_code_str[0] in '12345' and  # Códigos reais começam com 1-5
-                data.get('municipality_name') and
-                # Excluir nomes que indicam regiões/agregações
-                not any(keyword in municipality_name for keyword in [
-                    'região', 'mesorregião', 'microrregião', 'nordeste', 'norte', 'sul', 
-                    'centro', 'oeste', 'leste', 'sudeste', 'noroeste', 'sudoeste',
-                    'alto ', 'baixo ', 'médio ', '-grossense', 'parecis', 'araguaia',
-                    'pantanal', 'cerrado', 'amazônia', 'caatinga', 'mata atlântica'
-                ]) and
-                # Excluir nomes muito genéricos ou que são claramente regiões
-                municipality_name not in [
-                    'alto teles pires', 'sudeste mato-grossense', 'parecis', 'barreiras',
-                    'dourados', 'norte mato-grossense', 'portal da amazônia'
-                ]):
-                values.append(data['harvested_area'])
-
-        if not values:
-            return jsonify({'success': False, 'error': 'Nenhum município válido encontrado para esta cultura'})
-
-        import statistics
-        summary = {
-            'mean': statistics.mean(values),
-            'median': statistics.median(values),
-            'mode': statistics.mode(values) if len(set(values)) < len(values) else None,
-            'std_dev': statistics.stdev(values) if len(values) > 1 else 0,
-            'min': min(values),
-            'max': max(values),
-            'q1': statistics.quantiles(values, n=4)[0] if len(values) >= 4 else None,
-            'q3': statistics.quantiles(values, n=4)[2] if len(values) >= 4 else None,
-            'total': sum(values),
-            'count': len(values)
-        }
-
-        return jsonify({
+        store = DATA_REGISTRY.current()
+        source = request.args.get('source', 'crop')
+        state = request.args.get('state') or None
+        if source not in SOURCES_BY_NAME:
+            return jsonify({'success': False, 'error': f"Fonte '{source}' desconhecida"}), 400
+        # Só UFs conhecidas: cada estado vira uma entrada do cache da versão dos dados
+        if state and state not in store.municipalities.state_codes:
+            return jsonify({'success': False, 'error': f"Estado '{state}' desconhecido"}), 400
+        if crop_name not in store[source]:
+            return jsonify({'success': False, 'error': 'Cultura não encontrada' if source == 'crop' else 'Categoria não encontrada'})
+
+        # Calculado uma vez por versão dos dados (apenas municípios válidos da fonte)
+        summary = category_summary(store, source, crop_name, state)
+        if summary is None:
+            subject = 'esta cultura' if source == 'crop' else f"esta categoria de {SOURCES_BY_NAME[source].get('title', source)}"
+            return jsonify({'success': False, 'error': f'Nenhum município válido encontrado para {subject}'})
+
+        return cached_json_response(RESPONSE_CACHE, (store.version, request.path, source, state), lambda: {
             'success': True,
+            'source': source,
+            'state': state,
             'summary': summary
         })
     except Exception as e:
@@ -732,58 +584,36 @@ def get_statistical_summary(crop_name):
 
 @app.route('/api/analysis/by-state/<crop_name>')
 def get_analysis_by_state(crop_name):
+    """Per-state totals of a category from the rollup cube; ?source= (default crop),
+    ?include_municipalities=1 adds the municipality list of each state"""
     try:
-        if crop_name not in CROP_DATA:
-            return jsonify({'success': False, 'error': 'Cultura não encontrada'})
+        store = DATA_REGISTRY.current()
+        source = request.args.get('source', 'crop')
+        if source not in SOURCES_BY_NAME:
+            return jsonify({'success': False, 'error': f"Fonte '{source}' desconhecida"}), 400
+        dataset = store[source]
+        if crop_name not in dataset:
+            return jsonify({'success': False, 'error': 'Cultura não encontrada' if source == 'crop' else 'Categoria não encontrada'})
 
         states_data = {}
-        for municipality_code, municipality_data in CROP_DATA[crop_name].items():
-            # Filtrar apenas municípios válidos (códigos IBGE reais de municípios)
-            municipality_code_str = str(municipality_code)
-            municipality_name = municipality_data.get('municipality_name', '').lower()
-
-            # Verificar se é um código de município válido
-            # Códigos de município IBGE começam com 1-5 e têm 7 dígitos
-            # Excluir códigos que começam com 0 (são agregações regionais)
-            if (len(municipality_code_str) == 7 and 
-                municipality_code_str.isdigit() and
-                municipality_code_str[0] in '12345' and  # Códigos reais começam com 1-5
-                municipality_data.get('municipality_name') and
-                # Excluir nomes que indicam regiões/agregações
-                not any(keyword in municipality_name for keyword in [
-                    'região', 'mesorregião', 'microrregião', 'nordeste', 'norte', 'sul', 
-                    'centro', 'oeste', 'leste', 'sudeste', 'noroeste', 'sudoeste',
-                    'alto ', 'baixo ', 'médio ', '-grossense', 'parecis', 'araguaia',
-                    'pantanal', 'cerrado', 'amazônia', 'caatinga', 'mata atlântica'
-                ]) and
-                # Excluir nomes muito genéricos ou que são claramente regiões
-                municipality_name not in [
-                    'alto teles pires', 'sudeste mato-grossense', 'parecis', 'barreiras',
-                    'dourados', 'norte mato-grossense', 'portal da amazônia'
-                ]):
-
-                state = municipality_data.get('state_code', 'XX')
-                area = municipality_data.get('harvested_area', 0)
-
-                if state not in states_data:
-                    states_data[state] = {
-                        'total_area': 0,
-                        'municipalities_count': 0,
-                        'max_area': 0,
-                        'municipalities': []
-                    }
-
-                states_data[state]['total_area'] += area
-                states_data[state]['municipalities_count'] += 1
-                states_data[state]['max_area'] = max(states_data[state]['max_area'], area)
-                states_data[state]['municipalities'].append({
-                    'name': municipality_data.get('municipality_name'),
-                    'area': area
-                })
+        for group in rollup_cube(store, source, crop_name).rows('state'):
+            states_data[group['name']] = {
+                'total_area': group['sum'],
+                'municipalities_count': group['count'],
+                'max_area': group['max'],
+                'average_area': group['mean']
+            }
 
-        # Calculate averages
-        for state_data in states_data.values():
-            state_data['average_area'] = state_data['total_area'] / state_data['municipalities_count']
+        if request.args.get('include_municipalities', '').lower() in ('1', 'true'):
+            municipalities = store.municipalities
+            rows = dataset.rows(crop_name, SOURCES_BY_NAME[source]['filter'])
+            for row, area in zip(rows.tolist(), dataset.values_at(crop_name, rows)):
+                state_data = states_data.get(str(municipalities.states[row]))
+                if state_data is not None:
+                    state_data.setdefault('municipalities', []).append({
+                        'name': municipalities.names[row],
+                        'area': area
+                    })
 
         return jsonify({
             'success': True,
@@ -792,39 +622,111 @@ def get_analysis_by_state(crop_name):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/analysis/aggregate')
+def get_aggregate():
+    """Rollup of a category: ?source=&category=&level=state|region|national[&name=]"""
+    try:
+        store = DATA_REGISTRY.current()
+        source = request.args.get('source', 'crop')
+        category = request.args.get('category', '')
+        level = request.args.get('level', 'state')
+
+        if source not in SOURCES_BY_NAME:
+            return jsonify({'success': False, 'error': f"Fonte '{source}' desconhecida"}), 400
+        if level not in ROLLUP_LEVELS:
+            return jsonify({'success': False, 'error': f"Nível inválido; use {', '.join(ROLLUP_LEVELS)}"}), 400
+        if category not in store[source]:
+            return jsonify({'success': False, 'error': f"Categoria '{category}' não encontrada"}), 404
+
+        return jsonify({
+            'success': True,
+            'source': source,
+            'category': category,
+            'level': level,
+            'unit': store[source].unit(category) or SOURCES_BY_NAME[source]['unit'],
+            'groups': rollup_cube(store, source, category).rows(level, request.args.get('name'))
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/analysis/comparison/<crop1>/<crop2>')
 def get_crop_comparison(crop1, crop2):
     try:
-        if crop1 not in CROP_DATA or crop2 not in CROP_DATA:
+        store = DATA_REGISTRY.current()
+        if crop1 not in store['crop'] or crop2 not in store['crop']:
             return jsonify({'success': False, 'error': 'Uma ou ambas culturas não encontradas'})
 
-        # Get common municipalities
-        common_municipalities = set(CROP_DATA[crop1].keys()) & set(CROP_DATA[crop2].keys())
-
-        comparison_data = []
-        for muni_code in common_municipalities:
-            data1 = CROP_DATA[crop1][muni_code]
-            data2 = CROP_DATA[crop2][muni_code]
-
-            comparison_data.append({
-                'municipality_code': muni_code,
-                'municipality_name': data1.get('municipality_name'),
-                'state_code': data1.get('state_code'),
-                'crop1_area': data1.get('harvested_area', 0),
-                'crop2_area': data2.get('harvested_area', 0),
-                'ratio': data1.get('harvested_area', 0) / max(data2.get('harvested_area', 1), 1)
-            })
+        # Municípios válidos com registro nas duas culturas
+        comparison = Comparison(store, [('crop', crop1), ('crop', crop2)])
+        comparison_data = [
+            {
+                'municipality_code': entry['municipality_code'],
+                'municipality_name': entry['municipality_name'],
+                'state_code': entry['state_code'],
+                'crop1_area': entry['values'][0],
+                'crop2_area': entry['values'][1],
+                'ratio': entry['values'][0] / max(entry['values'][1], 1)
+            }
+            for entry in comparison.page(store.municipalities, 0, len(comparison))
+        ]
 
         return jsonify({
             'success': True,
             'crop1': crop1,
             'crop2': crop2,
             'comparison_data': comparison_data,
-            'common_municipalities': len(common_municipalities)
+            'common_municipalities': len(comparison)
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/analysis/compare')
+def compare_categories():
+    """N-way comparison of categories from any sources
+
+    ?series=source:category (repeated; bare names are crops), ?state=, ?format=rows|columnar,
+    ?page=&page_size= (rows format). Values are aligned on the valid municipalities where
+    every series has data; ratios are relative to the first series.
+    """
+    try:
+        store = DATA_REGISTRY.current()
+        series = []
+        for spec in request.args.getlist('series'):
+            source, _, category = spec.partition(':')
+            if not category or source not in SOURCES_BY_NAME:
+                source, category = 'crop', spec
+            if category not in store[source]:
+                return jsonify({'success': False, 'error': f"Categoria '{category}' não encontrada em {source}"}), 404
+            series.append((source, category))
+
+        if not 2 <= len(series) <= COMPARE_MAX_SERIES:
+            return jsonify({'success': False, 'error': f'Informe de 2 a {COMPARE_MAX_SERIES} séries'}), 400
+        response_format = request.args.get('format', 'rows')
+        if response_format not in ('rows', 'columnar'):
+            return jsonify({'success': False, 'error': "Formato inválido; use rows ou columnar"}), 400
+
+        state = request.args.get('state') or None
+        page = max(request.args.get('page', 1, type=int), 1)
+        page_size = min(max(request.args.get('page_size', 500, type=int), 1), 5000)
+
+        def build_payload():
+            comparison = Comparison(store, series, state)
+            payload = {'success': True, 'state': state, 'format': response_format, **comparison.summary()}
+            if response_format == 'columnar':
+                payload.update(comparison.columnar(store.municipalities))
+            else:
+                payload.update(
+                    page=page,
+                    page_size=page_size,
+                    pages=-(-len(comparison) // page_size),
+                    rows=comparison.page(store.municipalities, (page - 1) * page_size, page_size)
+                )
+            return payload
+
+        return cached_json_response(RESPONSE_CACHE, (store.version, request.full_path), build_payload)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/brazilian-states')
 def get_brazilian_states():
     """Get list of Brazilian states"""
@@ -876,6 +778,9 @@ def export_fertilizers_data():
     """Export complete fertilizer database as Excel file"""
     return export_complete_fertilizer_data()
 
+# Base IBGE muda raramente; o ETag (sha1 da origem) garante revalidação quando mudar
+COMPLETE_DATA_MAX_AGE = 3600
+
 @app.route('/api/export/complete-data')
 def export_complete_data():
     """Export complete crop data as Excel file"""
@@ -890,23 +795,24 @@ def export_complete_data():
         if not os.path.exists(excel_path):
             return jsonify({'success': False, 'error': 'Arquivo de dados não encontrado'}), 404
 
-        # Read the Excel file
-        df = pd.read_excel(excel_path)
+        export_format, error = request_export_format()
+        if error:
+            return error
 
-        # Create a BytesIO object to store the Excel file
-        output = io.BytesIO()
-
-        # Write to Excel
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Culturas IBGE 2023', index=False)
-
-        output.seek(0)
+        # Arquivo final endereçado pelo sha1 da origem: só é convertido quando a origem muda
+        digest = file_digest(excel_path)
+        path, _ = EXPORT_ARTIFACTS.get_or_build(
+            ('complete-data', EXPORT_LAYOUT_VERSION, digest), export_format,
+            lambda f: write_export([frame_sheet('Culturas IBGE 2023', workbook_frame(excel_path)[0])], export_format, f)
+        )
 
         return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            os.path.abspath(path),
+            mimetype=EXPORT_MIMETYPES[export_format],
             as_attachment=True,
-            download_name='base_completa_culturas_ibge_2023.xlsx'
+            download_name=f'base_completa_culturas_ibge_2023.{export_format}',
+            etag=f'{digest}-{export_format}',
+            max_age=COMPLETE_DATA_MAX_AGE
         )
 
     except Exception as e:
@@ -917,679 +823,146 @@ def export_complete_data():
 def export_complete_fertilizer_data():
     """Export complete fertilizer database as Excel file"""
     try:
-        # Preparar todos os dados de fertilizantes para exportação
-        all_fertilizer_data = []
-
-        for category_name, category_data in FERTILIZER_DATA.items():
-            for municipality_code, municipality_data in category_data.items():
-                # Filtrar apenas municípios válidos
-                municipality_code_str = str(municipality_code)
-                municipality_name = municipality_data.get('municipality_name', '').lower()
-
-                if (len(municipality_code_str) == 7 and 
-                    municipality_code_str.isdigit() and
-                    municipality_code_str[0] in '12345' and
-                    municipality_data.get('municipality_name') and
-                    not any(keyword in municipality_name for keyword in [
-                        'região', 'mesorregião', 'microrregião', 'nordeste', 'norte', 'sul', 
-                        'centro', 'oeste', 'leste', 'sudeste', 'noroeste', 'sudoeste',
-                        'alto ', 'baixo ', 'médio ', '-grossense', 'parecis', 'araguaia',
-                        'pantanal', 'cerrado', 'amazônia', 'caatinga', 'mata atlântica'
-                    ])):
-
-                    all_fertilizer_data.append({
-                        'Código IBGE': municipality_code,
-                        'Município': municipality_data.get('municipality_name', 'Desconhecido'),
-                        'UF': municipality_data.get('state_code', 'XX'),
-                        'Categoria': category_name,
-                        'Valor': municipality_data.get('value', 0),
-                        'Unidade': 'estabelecimentos',
-                        'Ano': 2023
-                    })
-
-        # Ordenar por categoria e depois por valor
-        all_fertilizer_data.sort(key=lambda x: (x['Categoria'], -x['Valor']))
-
-        # Criar DataFrame principal
-        df_main = pd.DataFrame(all_fertilizer_data)
-
-        # Criar resumo por categoria
-        category_summary = df_main.groupby('Categoria').agg({
-            'Valor': ['sum', 'count', 'mean', 'max', 'min']
-        }).round(2)
-        category_summary.columns = ['Valor Total', 'Nº Municípios', 'Valor Médio', 'Valor Máximo', 'Valor Mínimo']
-        category_summary = category_summary.sort_values('Valor Total', ascending=False)
-        category_summary.reset_index(inplace=True)
-
-        # Criar resumo por estado
-        state_summary = df_main.groupby('UF').agg({
-            'Valor': ['sum', 'count', 'mean']
-        }).round(2)
-        state_summary.columns = ['Valor Total', 'Nº Municípios', 'Valor Médio']
-        state_summary = state_summary.sort_values('Valor Total', ascending=False)
-        state_summary.reset_index(inplace=True)
-
-        # Criar dados de resumo geral
-        total_categories = df_main['Categoria'].nunique()
-        total_municipalities = df_main['Código IBGE'].nunique()
-        total_records = len(df_main)
-        total_value = df_main['Valor'].sum()
-        avg_value = df_main['Valor'].mean()
-
-        general_summary = pd.DataFrame([
-            ['Estatística', 'Valor'],
-            ['Base de Dados', 'Fertilizantes - Censo Agropecuário 2017'],
-            ['Ano de Referência', 2023],
-            ['Total de Categorias', total_categories],
-            ['Total de Municípios', total_municipalities],
-            ['Total de Registros', total_records],
-            ['Valor Total Geral', f'{total_value:,.0f}'],
-            ['Valor Médio Geral', f'{avg_value:,.2f}'],
-            ['Data da Exportação', pd.Timestamp.now().strftime('%d/%m/%Y %H:%M:%S')]
-        ])
-
-        # Criar arquivo Excel
-        output = io.BytesIO()
-
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # Planilha principal com todos os dados
-            df_main.to_excel(writer, sheet_name='Dados Completos', index=False)
-
-            # Planilha de resumo geral
-            general_summary.to_excel(writer, sheet_name='Resumo Geral', index=False, header=False)
-
-            # Planilha de resumo por categoria
-            category_summary.to_excel(writer, sheet_name='Resumo por Categoria', index=False)
-
-            # Planilha de resumo por estado
-            state_summary.to_excel(writer, sheet_name='Resumo por Estado', index=False)
-
-            # Criar planilhas separadas para cada categoria (máximo 10 categorias principais)
-            top_categories = category_summary.head(10)
-            for _, category_row in top_categories.iterrows():
-                category_name = category_row['Categoria']
-                safe_name = category_name.replace('/', '_').replace('\\', '_').replace(':', '_')[:30]
-
-                category_df = df_main[df_main['Categoria'] == category_name].copy()
-                category_df = category_df.sort_values('Valor', ascending=False)
-
-                try:
-                    category_df.to_excel(writer, sheet_name=safe_name, index=False)
-                except Exception as e:
-                    print(f"Erro ao criar planilha para categoria {category_name}: {e}")
-
-        output.seek(0)
-
-        # Nome do arquivo
-        filename = f'base_completa_fertilizantes_{pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=filename
-        )
+        store = DATA_REGISTRY.current()
+        # Linhas geradas categoria a categoria direto no arquivo (sem DataFrame completo em memória)
+        basename = f'base_completa_fertilizantes_{pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")}'
+        return export_download(complete_fertilizer_sheets(store), basename,
+                               export_artifact_key(store, ['fertilizer'], 'complete-fertilizer'))
 
     except Exception as e:
         print(f"Erro ao exportar base completa de fertilizantes: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/export/fertilizer-analysis/<category_name>')
-def export_fertilizer_analysis(category_name):
-    """Export fertilizer analysis data as Excel file"""
-    try:
-        # Obter parâmetro de estado opcional
-        state_filter = request.args.get('state')
-
-        if category_name not in FERTILIZER_DATA:
-            return jsonify({'success': False, 'error': 'Categoria de fertilizantes não encontrada'}), 404
-
-        # Preparar dados para exportação
-        analysis_data = []
-        for municipality_code, municipality_data in FERTILIZER_DATA[category_name].items():
-            # Filtrar apenas municípios válidos
-            municipality_code_str = str(municipality_code)
-            municipality_name = municipality_data.get('municipality_name', '').lower()
-
-            if (len(municipality_code_str) == 7 and 
-                municipality_code_str.isdigit() and
-                municipality_code_str[0] in '12345' and
-                municipality_data.get('municipality_name') and
-                not any(keyword in municipality_name for keyword in [
-                    'região', 'mesorregião', 'microrregião', 'nordeste', 'norte', 'sul', 
-                    'centro', 'oeste', 'leste', 'sudeste', 'noroeste', 'sudoeste',
-                    'alto ', 'baixo ', 'médio ', '-grossense', 'parecis', 'araguaia',
-                    'pantanal', 'cerrado', 'amazônia', 'caatinga', 'mata atlântica'
-                ])):
-
-                # Aplicar filtro de estado se especificado
-                if state_filter and municipality_data.get('state_code') != state_filter:
-                    continue
-
-                analysis_data.append({
-                    'Código IBGE': municipality_code,
-                    'Município': municipality_data.get('municipality_name', 'Desconhecido'),
-                    'UF': municipality_data.get('state_code', 'XX'),
-                    'Categoria': category_name,
-                    'Valor': municipality_data.get('value', 0),
-                    'Unidade': 'estabelecimentos',
-                    'Ano': 2023
-                })
-
-        # Ordenar por valor (maior para menor)
-        analysis_data.sort(key=lambda x: x['Valor'], reverse=True)
-
-        # Criar DataFrame
-        df = pd.DataFrame(analysis_data)
-
-        # Calcular estatísticas resumidas
-        total_value = df['Valor'].sum()
-        total_municipalities = len(df)
-        average_value = df['Valor'].mean()
-        max_value = df['Valor'].max()
-        min_value = df['Valor'].min()
-
-        # Criar dados de resumo estatístico
-        summary_data = [
-            ['Estatística', 'Valor'],
-            ['Categoria Analisada', category_name],
-            ['Filtro de Estado', state_filter if state_filter else 'Nacional (Todos os Estados)'],
-            ['Ano de Referência', 2023],
-            ['Total de Municípios', total_municipalities],
-            ['Valor Total', f'{total_value:,.0f}'],
-            ['Valor Médio por Município', f'{average_value:,.2f}'],
-            ['Maior Valor Municipal', f'{max_value:,.0f}'],
-            ['Menor Valor Municipal', f'{min_value:,.0f}'],
-            ['Data da Exportação', pd.Timestamp.now().strftime('%d/%m/%Y %H:%M:%S')]
-        ]
-
-        # Criar resumo por estado
-        state_summary = df.groupby('UF').agg({
-            'Valor': ['sum', 'count', 'mean']
-        }).round(2)
-        state_summary.columns = ['Valor Total', 'Nº Municípios', 'Valor Médio']
-        state_summary = state_summary.sort_values('Valor Total', ascending=False)
-        state_summary.reset_index(inplace=True)
-
-        # Criar arquivo Excel
-        output = io.BytesIO()
-
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # Planilha principal com dados detalhados
-            df.to_excel(writer, sheet_name='Dados Detalhados', index=False)
-
-            # Planilha de resumo estatístico
-            summary_df = pd.DataFrame(summary_data[1:], columns=summary_data[0])
-            summary_df.to_excel(writer, sheet_name='Resumo Estatístico', index=False)
-
-            # Planilha de resumo por estado
-            state_summary.to_excel(writer, sheet_name='Resumo por Estado', index=False)
-
-            # Top 20 maiores estabelecimentos
-            top_20 = df.head(20).copy()
-            top_20['Ranking'] = range(1, len(top_20) + 1)
-            top_20 = top_20[['Ranking', 'Município', 'UF', 'Valor', 'Unidade']]
-            top_20.to_excel(writer, sheet_name='Top 20', index=False)
-
-        output.seek(0)
-
-        # Nome do arquivo
-        safe_category_name = category_name.replace('/', '_').replace('\\', '_').replace(':', '_')
-        state_suffix = f'_{state_filter}' if state_filter else '_Nacional'
-        filename = f'analise_{safe_category_name}{state_suffix}_{pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=filename
-        )
-
-    except Exception as e:
-        print(f"Erro ao exportar análise de fertilizantes: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
-
 @app.route('/api/export/crop-analysis/<crop_name>')
 def export_crop_analysis(crop_name):
     """Export crop analysis data as Excel file"""
     try:
+        store = DATA_REGISTRY.current()
         # Obter parâmetro de estado opcional
         state_filter = request.args.get('state')
 
-        if crop_name not in CROP_DATA:
+        if crop_name not in store['crop']:
             return jsonify({'success': False, 'error': 'Cultura não encontrada'}), 404
 
-        # Preparar dados para exportação
-        analysis_data = []
-        for municipality_code, municipality_data in CROP_DATA[crop_name].items():
-            # Filtrar apenas municípios válidos
-            municipality_code_str = str(municipality_code)
-            municipality_name = municipality_data.get('municipality_name', '').lower()
-
-            if (len(municipality_code_str) == 7 and 
-                municipality_code_str.isdigit() and
-                municipality_code_str[0] in '12345' and
-                municipality_data.get('municipality_name') and
-                not any(keyword in municipality_name for keyword in [
-                    'região', 'mesorregião', 'microrregião', 'nordeste', 'norte', 'sul', 
-                    'centro', 'oeste', 'leste', 'sudeste', 'noroeste', 'sudoeste',
-                    'alto ', 'baixo ', 'médio ', '-grossense', 'parecis', 'araguaia',
-                    'pantanal', 'cerrado', 'amazônia', 'caatinga', 'mata atlântica'
-                ]) and
-                municipality_name not in [
-                    'alto teles pires', 'sudeste mato-grossense', 'parecis', 'barreiras',
-                    'dourados', 'norte mato-grossense', 'portal da amazônia'
-                ]):
-
-                # Aplicar filtro de estado se especificado
-                if state_filter and municipality_data.get('state_code') != state_filter:
-                    continue
-
-                analysis_data.append({
-                    'Código IBGE': municipality_code,
-                    'Município': municipality_data.get('municipality_name', 'Desconhecido'),
-                    'UF': municipality_data.get('state_code', 'XX'),
-                    'Cultura': crop_name,
-                    'Área Colhida (hectares)': municipality_data.get('harvested_area', 0),
-                    'Ano': 2023
-                })
-
-        # Ordenar por área colhida (maior para menor)
-        analysis_data.sort(key=lambda x: x['Área Colhida (hectares)'], reverse=True)
-
-        # Criar DataFrame
-        df = pd.DataFrame(analysis_data)
-
-        # Calcular estatísticas resumidas
-        total_area = df['Área Colhida (hectares)'].sum()
-        total_municipalities = len(df)
-        average_area = df['Área Colhida (hectares)'].mean()
-        max_area = df['Área Colhida (hectares)'].max()
-        min_area = df['Área Colhida (hectares)'].min()
-
-        # Criar dados de resumo estatístico
-        summary_data = [
-            ['Estatística', 'Valor'],
-            ['Cultura Analisada', crop_name],
-            ['Filtro de Estado', state_filter if state_filter else 'Nacional (Todos os Estados)'],
-            ['Ano de Referência', 2023],
-            ['Total de Municípios', total_municipalities],
-            ['Área Total Colhida (ha)', f'{total_area:,.2f}'],
-            ['Área Média por Município (ha)', f'{average_area:,.2f}'],
-            ['Maior Área Municipal (ha)', f'{max_area:,.2f}'],
-            ['Menor Área Municipal (ha)', f'{min_area:,.2f}'],
-            ['Data da Exportação', pd.Timestamp.now().strftime('%d/%m/%Y %H:%M:%S')]
-        ]
-
-        # Criar resumo por estado
-        state_summary = df.groupby('UF').agg({
-            'Área Colhida (hectares)': ['sum', 'count', 'mean']
-        }).round(2)
-        state_summary.columns = ['Área Total (ha)', 'Nº Municípios', 'Área Média (ha)']
-        state_summary = state_summary.sort_values('Área Total (ha)', ascending=False)
-        state_summary.reset_index(inplace=True)
-
-        # Criar arquivo Excel
-        output = io.BytesIO()
-
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # Planilha principal com dados detalhados
-            df.to_excel(writer, sheet_name='Dados Detalhados', index=False)
-
-            # Planilha de resumo estatístico
-            summary_df = pd.DataFrame(summary_data[1:], columns=summary_data[0])
-            summary_df.to_excel(writer, sheet_name='Resumo Estatístico', index=False)
-
-            # Planilha de resumo por estado
-            state_summary.to_excel(writer, sheet_name='Resumo por Estado', index=False)
-
-            # Top 20 maiores produtores
-            top_20 = df.head(20).copy()
-            top_20['Ranking'] = range(1, len(top_20) + 1)
-            top_20 = top_20[['Ranking', 'Município', 'UF', 'Área Colhida (hectares)']]
-            top_20.to_excel(writer, sheet_name='Top 20 Produtores', index=False)
-
-        output.seek(0)
-
-        # Nome do arquivo
-        safe_crop_name = crop_name.replace('/', '_').replace('\\', '_').replace(':', '_')
         state_suffix = f'_{state_filter}' if state_filter else '_Nacional'
-        filename = f'analise_{safe_crop_name}{state_suffix}_{pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=filename
-        )
+        basename = f'analise_{safe_name(crop_name)}{state_suffix}_{pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")}'
+        return export_download(crop_analysis_sheets(store, crop_name, state_filter), basename,
+                               export_artifact_key(store, ['crop'], 'crop-analysis', crop_name, state_filter))
 
     except Exception as e:
         print(f"Erro ao exportar análise: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/export/agrotoxico-analysis/<category>')
-def export_agrotoxico_analysis(category):
-    """Export agrotóxico analysis data as Excel file"""
+def run_export_job(job, fileobj, progress):
+    """Executa a rota de exportação do job (numa thread do worker web) e copia o arquivo gerado"""
+    with app.test_request_context(job.url):
+        if request.routing_exception is not None:
+            raise ValueError(f'Rota de exportação inválida: {job.url}')
+        # Formatos em streaming (CSV) geram as linhas durante a cópia: o progresso cobre as duas etapas
+        with export_progress(progress):
+            response = app.make_response(app.view_functions[request.url_rule.endpoint](**request.view_args))
+            try:
+                if response.status_code != 200:
+                    payload = response.get_json(silent=True) or {}
+                    raise RuntimeError(payload.get('error') or f'Exportação falhou ({response.status_code})')
+                for chunk in response.iter_encoded():
+                    fileobj.write(chunk)
+            finally:
+                response.close()
+        _, options = parse_options_header(response.headers.get('Content-Disposition', ''))
+        return options.get('filename') or 'exportacao', response.mimetype
+
+EXPORT_JOBS = ExportJobQueue(run_export_job)
+
+def export_job_payload(job, token=None):
+    payload = {'success': True, **job.to_dict(), 'status_url': url_for('get_export_job', job_id=job.id)}
+    if EXPORT_JOBS.check_token(job, token):
+        payload['token'] = token
+        if job.status == 'done':
+            payload['download_url'] = url_for('download_export_job', job_id=job.id, token=token)
+    return payload
+
+@app.route('/api/export/jobs', methods=['POST'])
+def create_export_job():
+    """Agenda uma exportação em segundo plano: {"url": "/api/export/..."}
+
+    Pedidos iguais (mesma rota, parâmetros e conteúdo dos dados) compartilham o mesmo job, cada
+    solicitante com o seu token de download. O arquivo é gerado numa thread do worker
+    que criou o job (EXPORT_JOB_WORKERS por processo).
+    """
     try:
-        state_filter = request.args.get('state')
-
-        if category not in AGROTOXICO_DATA:
-            return jsonify({'success': False, 'error': 'Categoria de agrotóxico não encontrada'}), 404
-
-        analysis_data = []
-        for municipality_code, municipality_data in AGROTOXICO_DATA[category].items():
-            municipality_code_str = str(municipality_code)
-            municipality_name = municipality_data.get('municipality_name', '').lower()
-
-            if (len(municipality_code_str) == 7 and 
-                municipality_code_str.isdigit() and
-                municipality_code_str[0] in '12345' and
-                municipality_data.get('municipality_name')):
-
-                if state_filter and municipality_data.get('state_code') != state_filter:
-                    continue
-
-                analysis_data.append({
-                    'Código IBGE': municipality_code,
-                    'Município': municipality_data.get('municipality_name', 'Desconhecido'),
-                    'UF': municipality_data.get('state_code', 'XX'),
-                    'Categoria': category,
-                    'Valor': municipality_data.get('value', 0),
-                    'Unidade': municipality_data.get('unit', 'un'),
-                    'Ano': 2023
-                })
-
-        analysis_data.sort(key=lambda x: x['Valor'], reverse=True)
-        df = pd.DataFrame(analysis_data)
-
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Dados Detalhados', index=False)
-
-        output.seek(0)
-        safe_category_name = category.replace('/', '_').replace('\\', '_').replace(':', '_')
-        state_suffix = f'_{state_filter}' if state_filter else '_Nacional'
-        filename = f'analise_agrotoxico_{safe_category_name}{state_suffix}_{pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=filename
-        )
-
-    except Exception as e:
-        print(f"Erro ao exportar análise de agrotóxico: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
-
-@app.route('/api/export/consultoria-analysis/<category>')
-def export_consultoria_analysis(category):
-    """Export consultoria analysis data as Excel file"""
-    try:
-        state_filter = request.args.get('state')
-
-        if category not in CONSULTORIA_DATA:
-            return jsonify({'success': False, 'error': 'Categoria de consultoria não encontrada'}), 404
-
-        analysis_data = []
-        for municipality_code, municipality_data in CONSULTORIA_DATA[category].items():
-            municipality_code_str = str(municipality_code)
-
-            if (len(municipality_code_str) == 7 and 
-                municipality_code_str.isdigit() and
-                municipality_code_str[0] in '12345' and
-                municipality_data.get('municipality_name')):
-
-                if state_filter and municipality_data.get('state_code') != state_filter:
-                    continue
-
-                analysis_data.append({
-                    'Código IBGE': municipality_code,
-                    'Município': municipality_data.get('municipality_name', 'Desconhecido'),
-                    'UF': municipality_data.get('state_code', 'XX'),
-                    'Categoria': category,
-                    'Valor': municipality_data.get('value', 0),
-                    'Unidade': municipality_data.get('unit', 'un'),
-                    'Ano': 2023
-                })
-
-        analysis_data.sort(key=lambda x: x['Valor'], reverse=True)
-        df = pd.DataFrame(analysis_data)
-
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Dados Detalhados', index=False)
-
-        output.seek(0)
-        safe_category_name = category.replace('/', '_').replace('\\', '_').replace(':', '_')
-        state_suffix = f'_{state_filter}' if state_filter else '_Nacional'
-        filename = f'analise_consultoria_{safe_category_name}{state_suffix}_{pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=filename
-        )
-
-    except Exception as e:
-        print(f"Erro ao exportar análise de consultoria: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
-
-@app.route('/api/export/corretivos-analysis/<category>')
-def export_corretivos_analysis(category):
-    """Export corretivos analysis data as Excel file"""
-    try:
-        state_filter = request.args.get('state')
-
-        if category not in CORRETIVOS_DATA:
-            return jsonify({'success': False, 'error': 'Categoria de corretivo não encontrada'}), 404
-
-        analysis_data = []
-        for municipality_code, municipality_data in CORRETIVOS_DATA[category].items():
-            municipality_code_str = str(municipality_code)
-
-            if (len(municipality_code_str) == 7 and 
-                municipality_code_str.isdigit() and
-                municipality_code_str[0] in '12345' and
-                municipality_data.get('municipality_name')):
-
-                if state_filter and municipality_data.get('state_code') != state_filter:
-                    continue
-
-                analysis_data.append({
-                    'Código IBGE': municipality_code,
-                    'Município': municipality_data.get('municipality_name', 'Desconhecido'),
-                    'UF': municipality_data.get('state_code', 'XX'),
-                    'Categoria': category,
-                    'Valor': municipality_data.get('value', 0),
-                    'Unidade': municipality_data.get('unit', 'un'),
-                    'Ano': 2023
-                })
-
-        analysis_data.sort(key=lambda x: x['Valor'], reverse=True)
-        df = pd.DataFrame(analysis_data)
-
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Dados Detalhados', index=False)
-
-        output.seek(0)
-        safe_category_name = category.replace('/', '_').replace('\\', '_').replace(':', '_')
-        state_suffix = f'_{state_filter}' if state_filter else '_Nacional'
-        filename = f'analise_corretivo_{safe_category_name}{state_suffix}_{pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=filename
-        )
-
-    except Exception as e:
-        print(f"Erro ao exportar análise de corretivo: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
-
-@app.route('/api/export/despesa-analysis/<category>')
-def export_despesa_analysis(category):
-    """Export despesa analysis data as Excel file"""
-    try:
-        state_filter = request.args.get('state')
-
-        if category not in DESPESA_DATA:
-            return jsonify({'success': False, 'error': 'Categoria de despesa não encontrada'}), 404
-
-        analysis_data = []
-        for municipality_code, municipality_data in DESPESA_DATA[category].items():
-            municipality_code_str = str(municipality_code)
-
-            if (len(municipality_code_str) == 7 and 
-                municipality_code_str.isdigit() and
-                municipality_code_str[0] in '12345' and
-                municipality_data.get('municipality_name')):
-
-                if state_filter and municipality_data.get('state_code') != state_filter:
-                    continue
-
-                analysis_data.append({
-                    'Código IBGE': municipality_code,
-                    'Município': municipality_data.get('municipality_name', 'Desconhecido'),
-                    'UF': municipality_data.get('state_code', 'XX'),
-                    'Categoria': category,
-                    'Valor': municipality_data.get('value', 0),
-                    'Unidade': municipality_data.get('unit', 'R$'),
-                    'Ano': 2023
-                })
-
-        analysis_data.sort(key=lambda x: x['Valor'], reverse=True)
-        df = pd.DataFrame(analysis_data)
-
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Dados Detalhados', index=False)
-
-        output.seek(0)
-        safe_category_name = category.replace('/', '_').replace('\\', '_').replace(':', '_')
-        state_suffix = f'_{state_filter}' if state_filter else '_Nacional'
-        filename = f'analise_despesa_{safe_category_name}{state_suffix}_{pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=filename
-        )
-
+        store = DATA_REGISTRY.current()
+        data = request.get_json(silent=True) or {}
+        url = data.get('url') or request.args.get('url') or ''
+        parts = urlsplit(url)
+        path = parts.path
+        if not path.startswith('/api/export/') or path.startswith('/api/export/jobs'):
+            return jsonify({'success': False, 'error': 'Informe a URL de uma rota /api/export/*'}), 400
+
+        with app.test_request_context(path, query_string=parts.query):
+            if request.routing_exception is not None:
+                return jsonify({'success': False, 'error': f'Rota de exportação desconhecida: {path}'}), 404
+            endpoint = request.url_rule.endpoint
+            # Hash do conteúdo (e não a versão local) para valer entre processos
+            key = (endpoint, tuple(sorted(request.view_args.items())), tuple(sorted(request.args.items(multi=True))),
+                   export_artifact_key(store, None))
+
+        job, token, created = EXPORT_JOBS.submit(key, url)
+        return jsonify({**export_job_payload(job, token), 'deduplicated': not created}), 202
+    except OverflowError as e:
+        return jsonify({'success': False, 'error': str(e)}), 429
     except Exception as e:
-        print(f"Erro ao exportar análise de despesa: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/export/escolaridade-analysis/<category>')
-def export_escolaridade_analysis(category):
-    """Export escolaridade analysis data as Excel file"""
+@app.route('/api/export/jobs/<job_id>')
+def get_export_job(job_id):
+    """Estado e progresso (planilhas e linhas escritas) de um job de exportação"""
+    job = EXPORT_JOBS.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job de exportação não encontrado'}), 404
+    return jsonify(export_job_payload(job, request.args.get('token')))
+
+@app.route('/api/export/jobs/<job_id>/download')
+def download_export_job(job_id):
+    """Arquivo de um job concluído (exige o token devolvido na criação)"""
+    job = EXPORT_JOBS.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job de exportação não encontrado'}), 404
+    if not EXPORT_JOBS.check_token(job, request.args.get('token')):
+        return jsonify({'success': False, 'error': 'Token de download inválido'}), 403
+    if job.status != 'done':
+        return jsonify({'success': False, 'error': f'Exportação ainda não concluída ({job.status})'}), 409
+    return send_file(os.path.abspath(EXPORT_JOBS.artifact_path(job)), mimetype=job.mimetype, as_attachment=True,
+                     download_name=job.filename)
+
+# Administração dos datasets
+@app.route('/api/admin/datasets')
+@login_required
+def get_datasets_status():
+    """Current dataset version, origin and source fingerprints"""
     try:
-        state_filter = request.args.get('state')
-
-        if category not in ESCOLARIDADE_DATA:
-            return jsonify({'success': False, 'error': 'Categoria de escolaridade não encontrada'}), 404
-
-        analysis_data = []
-        for municipality_code, municipality_data in ESCOLARIDADE_DATA[category].items():
-            municipality_code_str = str(municipality_code)
-
-            if (len(municipality_code_str) == 7 and 
-                municipality_code_str.isdigit() and
-                municipality_code_str[0] in '12345' and
-                municipality_data.get('municipality_name')):
-
-                if state_filter and municipality_data.get('state_code') != state_filter:
-                    continue
-
-                analysis_data.append({
-                    'Código IBGE': municipality_code,
-                    'Município': municipality_data.get('municipality_name', 'Desconhecido'),
-                    'UF': municipality_data.get('state_code', 'XX'),
-                    'Categoria': category,
-                    'Valor': municipality_data.get('value', 0),
-                    'Unidade': municipality_data.get('unit', 'un'),
-                    'Ano': 2023
-                })
-
-        analysis_data.sort(key=lambda x: x['Valor'], reverse=True)
-        df = pd.DataFrame(analysis_data)
-
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Dados Detalhados', index=False)
-
-        output.seek(0)
-        safe_category_name = category.replace('/', '_').replace('\\', '_').replace(':', '_')
-        state_suffix = f'_{state_filter}' if state_filter else '_Nacional'
-        filename = f'analise_escolaridade_{safe_category_name}{state_suffix}_{pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=filename
-        )
-
+        return jsonify({
+            'success': True,
+            'datasets': DATA_REGISTRY.status(),
+            'response_cache': RESPONSE_CACHE.stats()
+        })
     except Exception as e:
-        print(f"Erro ao exportar análise de escolaridade: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/export/receita-analysis/<category>')
-def export_receita_analysis(category):
-    """Export receita analysis data as Excel file"""
+@app.route('/api/admin/datasets/reload', methods=['POST'])
+@login_required
+def reload_datasets():
+    """Rebuild changed sources (or all, with ?force=1) and swap them in without restarting"""
     try:
-        state_filter = request.args.get('state')
-
-        if category not in RECEITA_DATA:
-            return jsonify({'success': False, 'error': 'Categoria de receita não encontrada'}), 404
-
-        analysis_data = []
-        for municipality_code, municipality_data in RECEITA_DATA[category].items():
-            municipality_code_str = str(municipality_code)
-
-            if (len(municipality_code_str) == 7 and 
-                municipality_code_str.isdigit() and
-                municipality_code_str[0] in '12345' and
-                municipality_data.get('municipality_name')):
-
-                if state_filter and municipality_data.get('state_code') != state_filter:
-                    continue
-
-                analysis_data.append({
-                    'Código IBGE': municipality_code,
-                    'Município': municipality_data.get('municipality_name', 'Desconhecido'),
-                    'UF': municipality_data.get('state_code', 'XX'),
-                    'Categoria': category,
-                    'Valor': municipality_data.get('value', 0),
-                    'Unidade': municipality_data.get('unit', 'R$'),
-                    'Ano': 2023
-                })
-
-        analysis_data.sort(key=lambda x: x['Valor'], reverse=True)
-        df = pd.DataFrame(analysis_data)
-
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Dados Detalhados', index=False)
-
-        output.seek(0)
-        safe_category_name = category.replace('/', '_').replace('\\', '_').replace(':', '_')
-        state_suffix = f'_{state_filter}' if state_filter else '_Nacional'
-        filename = f'analise_receita_{safe_category_name}{state_suffix}_{pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=filename
-        )
-
+        force = request.args.get('force', '').lower() in ('1', 'true', 'yes')
+        changed = DATA_REGISTRY.reload(force=force)
+        return jsonify({
+            'success': True,
+            'reloaded': changed,
+            'datasets': DATA_REGISTRY.status()
+        })
     except Exception as e:
-        print(f"Erro ao exportar análise de receita: {e}")
+        print(f"Erro ao recarregar datasets: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # Rotas de Autenticação
@@ -1697,16 +1070,45 @@ def revendas_page():
     user = auth_manager.get_current_user()
     return render_template('revendas.html', user=user)
 
+def active_territories():
+    """Territórios de todas as revendas ativas numa única consulta: {revenda_id: [códigos]}"""
+    territories = {}
+    links = db.session.query(RevendaMunicipio.revenda_id, RevendaMunicipio.municipio_code) \
+        .join(Revenda).filter(Revenda.ativo == True) \
+        .order_by(RevendaMunicipio.revenda_id, RevendaMunicipio.position)
+    for revenda_id, municipio_code in links:
+        territories.setdefault(revenda_id, []).append(municipio_code)
+    return territories
+
+# Bitsets dos territórios, refeitos só quando a base ou as revendas mudam
+# (chave, (máscaras, revendas)): uma única tupla, trocada de uma vez por atribuição
+TERRITORY_MASKS_CACHE = (None, None)
+
+def active_territory_masks(store):
+    """Bitsets dos territórios das revendas ativas (inclui revendas sem municípios) e seus dados"""
+    # Assinatura barata do estado das revendas: qualquer cadastro, edição ou remoção a altera
+    active_count, last_update = db.session.query(db.func.count(Revenda.id), db.func.max(Revenda.updated_at)) \
+        .filter(Revenda.ativo == True).one()
+    key = (store.version, id(store), active_count, last_update, db.session.query(RevendaMunicipio).count())
+    global TERRITORY_MASKS_CACHE
+    cached_key, cached_value = TERRITORY_MASKS_CACHE
+    if cached_key == key:
+        return cached_value
+
+    revendas = {revenda_id: (nome, cor) for revenda_id, nome, cor in
+                db.session.query(Revenda.id, Revenda.nome, Revenda.cor).filter(Revenda.ativo == True)}
+    territories = active_territories()
+    masks = TerritoryMasks(store.municipalities, {revenda_id: territories.get(revenda_id, []) for revenda_id in revendas})
+    TERRITORY_MASKS_CACHE = (key, (masks, revendas))
+    return masks, revendas
+
 # API endpoints para Revendas
 @app.route('/api/revendas', methods=['GET'])
 @login_required
 def get_revendas():
     try:
-        # Ensure tables exist
-        with app.app_context():
-            db.create_all()
-        
         revendas = Revenda.query.filter_by(ativo=True).all()
+        territories = active_territories()
         
         revendas_list = []
         for revenda in revendas:
@@ -1716,8 +1118,8 @@ def get_revendas():
                 'cnpj': revenda.cnpj,
                 'cnae': revenda.cnae,
                 'cor': revenda.cor,
-                'municipios': revenda.get_municipios_list(),
-                'municipios_count': len(revenda.get_municipios_list()),
+                'municipios': territories.get(revenda.id, []),
+                'municipios_count': revenda.municipios_count,
                 'created_at': revenda.created_at.strftime('%d/%m/%Y')
             })
         
@@ -1734,7 +1136,6 @@ def get_revendas():
 def create_revenda():
     try:
         data = request.get_json()
-        print(f"Creating revenda with data: {data}")
         
         # Validar dados obrigatórios
         if not data.get('nome') or not data.get('cnpj') or not data.get('cnae'):
@@ -1743,8 +1144,6 @@ def create_revenda():
         if not data.get('municipios') or len(data.get('municipios', [])) == 0:
             return jsonify({'success': False, 'error': 'Pelo menos um município deve ser selecionado'}), 400
         
-        print(f"Municipalities to save: {data['municipios']}")
-        
         # Verificar se CNPJ já existe
         existing_revenda = Revenda.query.filter_by(cnpj=data['cnpj']).first()
         if existing_revenda:
@@ -1759,13 +1158,9 @@ def create_revenda():
         )
         revenda.set_municipios_list(data['municipios'])
         
-        print(f"Revenda created with municipalities: {revenda.get_municipios_list()}")
-        
         db.session.add(revenda)
         db.session.commit()
         
-        print(f"Revenda saved with ID: {revenda.id}")
-        
         return jsonify({
             'success': True,
             'message': 'Revenda cadastrada com sucesso!',
@@ -1827,56 +1222,318 @@ def delete_revenda(revenda_id):
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/revendas/by-municipio/<code>')
+@login_required
+def get_revendas_by_municipio(code):
+    """Revendas ativas cujo território inclui o município (consulta pelo índice de municipio_code)"""
+    try:
+        revendas = Revenda.query.join(RevendaMunicipio) \
+            .filter(RevendaMunicipio.municipio_code == str(code), Revenda.ativo == True) \
+            .order_by(Revenda.nome).all()
+        return jsonify({
+            'success': True,
+            'municipio': str(code),
+            'revendas': [
+                {
+                    'id': revenda.id,
+                    'nome': revenda.nome,
+                    'cnpj': revenda.cnpj,
+                    'cor': revenda.cor,
+                    'municipios_count': revenda.municipios_count
+                }
+                for revenda in revendas
+            ]
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/revendas/overlaps')
+@login_required
+def get_revendas_overlaps():
+    """Pares de revendas ativas com municípios em comum (AND entre os bitsets dos territórios)"""
+    try:
+        store = DATA_REGISTRY.current()
+        masks, revendas = active_territory_masks(store)
+        revenda_id = request.args.get('revenda_id', type=int)
+        if revenda_id is not None and revenda_id not in revendas:
+            return jsonify({'success': False, 'error': 'Revenda não encontrada'}), 404
+        include_municipalities = request.args.get('include_municipalities', '').lower() in ('1', 'true', 'yes')
+        limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+
+        pairs = masks.overlaps(revenda_id)
+        overlaps = []
+        for i, j, shared in pairs[:limit]:
+            entry = {
+                'revendas': [
+                    {'id': masks.ids[k], 'nome': revendas[masks.ids[k]][0], 'cor': revendas[masks.ids[k]][1],
+                     'municipios_count': int(masks.sizes[k]), 'overlap_pct': round(100.0 * shared / masks.sizes[k], 2)}
+                    for k in (i, j)
+                ],
+                'shared_municipalities': shared
+            }
+            if include_municipalities:
+                entry['municipios'] = masks.shared_codes(i, j)
+            overlaps.append(entry)
+
+        return jsonify({
+            'success': True,
+            'revendas_count': len(masks),
+            'pairs_count': len(pairs),
+            'overlaps': overlaps
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/revendas/coverage')
+@login_required
+def get_revendas_coverage():
+    """Cobertura dos municípios pelas revendas ativas (OR dos bitsets), nacional e por UF,
+    com os municípios descobertos de maior potencial (?w= como em /api/potential, ou
+    ?source=&category=; padrão área colhida total)"""
+    try:
+        store = DATA_REGISTRY.current()
+        source = request.args.get('source')
+        category = request.args.get('category')
+        specs = request.args.getlist('w')
+        if specs:
+            try:
+                score = potential_score(store, parse_weights(store, specs))
+            except KeyError as e:
+                return jsonify({'success': False, 'error': e.args[0]}), 404
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+        elif source:
+            if source not in SOURCES_BY_NAME:
+                return jsonify({'success': False, 'error': f"Fonte '{source}' desconhecida"}), 400
+            if category not in store[source]:
+                return jsonify({'success': False, 'error': f"Categoria '{category}' não encontrada"}), 404
+        top_k = max(0, min(request.args.get('k', 10, type=int), 100))
+
+        masks, _ = active_territory_masks(store)
+        potential = score.scores if specs else potential_values(store, source, category)
+        coverage = territory_coverage(store, masks, potential, request.args.get('state'), top_k)
+        coverage['revendas_count'] = len(masks)
+        if specs:
+            coverage['potential'] = {'weights': weights_payload(score)}
+        else:
+            coverage['potential'] = {'source': source, 'category': category} if source else {'source': 'crop', 'category': None}
+        return jsonify({'success': True, 'coverage': coverage})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def weights_payload(score):
+    return [{'source': source, 'category': category, 'weight': round(weight, 6)}
+            for source, category, weight in score.weights]
+
+def request_potential_score(store):
+    """PotentialScore dos ?w=source:category:peso da requisição; (score, None) ou (None, resposta de erro)"""
+    try:
+        return potential_score(store, parse_weights(store, request.args.getlist('w'))), None
+    except KeyError as e:
+        return None, (jsonify({'success': False, 'error': e.args[0]}), 404)
+    except ValueError as e:
+        return None, (jsonify({'success': False, 'error': str(e)}), 400)
+
+@app.route('/api/potential')
+def get_potential_ranking():
+    """Potencial de mercado por município: soma ponderada dos indicadores normalizados (0–1)
+
+    ?w=source:category:peso (repetido; nomes sem fonte são culturas), ?state=, ?k= (padrão 50)
+    """
+    try:
+        store = DATA_REGISTRY.current()
+        score, error = request_potential_score(store)
+        if error:
+            return error
+        k = max(1, min(request.args.get('k', 50, type=int), TOP_MAX_K))
+        state = request.args.get('state') or None
+        return jsonify({
+            'success': True,
+            'weights': weights_payload(score),
+            'state': state,
+            'municipalities': score.top(store.municipalities, k, state)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/revendas/potential')
+@login_required
+def get_revendas_potential():
+    """Revendas ativas ordenadas pelo potencial somado dos seus territórios (?w= como em /api/potential)"""
+    try:
+        store = DATA_REGISTRY.current()
+        score, error = request_potential_score(store)
+        if error:
+            return error
+        masks, revendas = active_territory_masks(store)
+        totals = masks.totals(score.scores)
+        national = float(score.scores[store.municipalities.valid_mask(FILTER_BASIC)].sum())
+        order = np.argsort(-totals, kind='stable')
+        limit = max(1, min(request.args.get('limit', len(masks) or 1, type=int), 5000))
+
+        ranking = []
+        for rank, i in enumerate(order[:limit].tolist(), start=1):
+            revenda_id = masks.ids[i]
+            size = int(masks.sizes[i])
+            total = float(totals[i])
+            ranking.append({
+                'rank': rank,
+                'id': revenda_id,
+                'nome': revendas[revenda_id][0],
+                'cor': revendas[revenda_id][1],
+                'municipios_count': size,
+                'potential': round(total, 6),
+                'mean_potential': round(total / size, 6) if size else 0.0,
+                'national_share': round(total / national, 6) if national > 0 else None
+            })
+
+        return jsonify({
+            'success': True,
+            'weights': weights_payload(score),
+            'revendas_count': len(masks),
+            'national_potential': round(national, 6),
+            'revendas': ranking
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+EXPANSION_MAX_SUGGESTIONS = 100
+
+@app.route('/api/revendas/<int:revenda_id>/expansion')
+@login_required
+def get_revenda_expansion(revenda_id):
+    """Próximos municípios sugeridos para o território da revenda (guloso, fila de prioridade)
+
+    ?n= (padrão 10), ?w= como em /api/potential (padrão área colhida total), ?max_distance_km=
+    (além dos vizinhos, aceita municípios até essa distância), ?allow_shared=1 (não exclui
+    municípios já atendidos por outras revendas)
+    """
+    try:
+        store = DATA_REGISTRY.current()
+        geometry = municipality_geometry(store, DATA_REGISTRY.data_dir)
+        if geometry is None:
+            return jsonify({'success': False, 'error': 'Geometria dos municípios não gerada; execute municipality_geometry.py'}), 503
+
+        masks, revendas = active_territory_masks(store)
+        if revenda_id not in revendas:
+            return jsonify({'success': False, 'error': 'Revenda não encontrada'}), 404
+        i = masks.ids.index(revenda_id)
+        own = masks.matrix[i]
+        if not own.any():
+            return jsonify({'success': False, 'error': 'Nenhum município cadastrado para esta revenda'}), 400
+
+        if request.args.getlist('w'):
+            score, error = request_potential_score(store)
+            if error:
+                return error
+            scores, weights = score.scores, weights_payload(score)
+        else:
+            scores, weights = potential_values(store), None
+
+        n = max(1, min(request.args.get('n', 10, type=int), EXPANSION_MAX_SUGGESTIONS))
+        max_distance_km = request.args.get('max_distance_km', type=float)
+        allow_shared = request.args.get('allow_shared', '').lower() in ('1', 'true', 'yes')
+
+        candidates = store.municipalities.valid_mask(FILTER_BASIC) & ~own & (scores > 0)
+        if not allow_shared:
+            # Municípios atendidos por outra revenda ativa ficam fora
+            candidates &= (masks.multiplicity - own) == 0
+
+        municipalities = store.municipalities
+        suggestions = []
+        cumulative = float(scores[own].sum())
+        current = cumulative
+        for row, origin_row, reason in recommend_expansion(geometry, np.flatnonzero(own), candidates, scores,
+                                                            n, max_distance_km):
+            cumulative += float(scores[row])
+            distance = float(geometry.distances_km(origin_row, np.array([row]))[0])
+            suggestions.append({
+                'municipality_code': str(municipalities.codes[row]),
+                'municipality_name': municipalities.names[row],
+                'state_code': str(municipalities.states[row]),
+                'potential': round(float(scores[row]), 6),
+                'reason': reason,
+                'via': str(municipalities.codes[origin_row]),
+                'distance_km': round(distance, 1) if not np.isnan(distance) else None,
+                'cumulative_potential': round(cumulative, 6)
+            })
+
+        return jsonify({
+            'success': True,
+            'revenda': {'id': revenda_id, 'nome': revendas[revenda_id][0], 'municipios_count': int(masks.sizes[i])},
+            'weights': weights,
+            'current_potential': round(current, 6),
+            'suggestions': suggestions
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/municipio/<code>')
+def get_municipality_profile(code):
+    """Every value of one municipality across all sources (?sources=crop,receita limits them)"""
+    try:
+        store = DATA_REGISTRY.current()
+        sources = request.args.get('sources')
+        sources = set(sources.split(',')) if sources else None
+        row = store.municipalities.row_of(code)
+        if row is None:
+            return jsonify({'success': False, 'error': 'Município não encontrado'}), 404
+
+        def build_payload():
+            municipalities = store.municipalities
+            data = {}
+            for name, values in store.profile(code, sources).items():
+                dataset = store[name]
+                data[name] = {
+                    'values': values,
+                    'units': {
+                        category: dataset.unit(category) or SOURCES_BY_NAME[name]['unit']
+                        for category in values
+                    }
+                }
+            return {
+                'success': True,
+                'code': str(municipalities.codes[row]),
+                'municipality_name': municipalities.names[row],
+                'state_code': str(municipalities.states[row]),
+                'region': IBGE_REGIONS.get(str(code)[:1]),
+                'data': data
+            }
+
+        return cached_json_response(RESPONSE_CACHE, (store.version, request.path, request.args.get('sources')), build_payload)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/municipios/search')
 @login_required
 def search_municipios():
+    """Accent-insensitive prefix search of municipalities (?q=, optional ?uf= and ?limit=)"""
     try:
-        query = request.args.get('q', '').lower()
-        if len(query) < 2:
+        store = DATA_REGISTRY.current()
+        query = request.args.get('q', '')
+        if len(query.strip()) < 2:
             return jsonify({'success': False, 'error': 'Query muito curta'}), 400
-        
-        # Buscar municípios nos dados de culturas para obter nomes reais
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 50)
+
+        municipalities = store.municipalities
+        rows = municipality_search_index(store).search(query, request.args.get('uf'), limit)
+
         municipios_found = []
-        municipios_set = set()  # Para evitar duplicatas
-        
-        # Buscar nos dados de culturas
-        for crop_name, crop_data in CROP_DATA.items():
-            for municipality_code, municipality_data in crop_data.items():
-                municipality_code_str = str(municipality_code)
-                municipality_name = municipality_data.get('municipality_name', '').lower()
-                state_code = municipality_data.get('state_code', 'XX')
-                
-                # Verificar se é um código de município válido e se contém a query
-                if (len(municipality_code_str) == 7 and 
-                    municipality_code_str.isdigit() and
-                    municipality_code_str[0] in '12345' and
-                    municipality_data.get('municipality_name') and
-                    municipality_code not in municipios_set and
-                    (query in municipality_name or query in state_code.lower())):
-                    
-                    municipios_found.append({
-                        'code': municipality_code,
-                        'name': municipality_data.get('municipality_name'),
-                        'state': state_code,
-                        'full_name': f"{municipality_data.get('municipality_name')} ({state_code})"
-                    })
-                    municipios_set.add(municipality_code)
-                    
-                    # Limitar a 50 resultados para performance
-                    if len(municipios_found) >= 50:
-                        break
-            
-            if len(municipios_found) >= 50:
-                break
-        
-        # Ordenar por nome
-        municipios_found.sort(key=lambda x: x['name'])
-        
+        for row in rows.tolist():
+            name = municipalities.names[row]
+            state_code = str(municipalities.states[row])
+            municipios_found.append({
+                'code': str(municipalities.codes[row]),
+                'name': name,
+                'state': state_code,
+                'full_name': f"{name} ({state_code})"
+            })
+
         return jsonify({
             'success': True,
-            'municipios': municipios_found[:20]  # Limitar a 20 resultados
+            'municipios': municipios_found
         })
-        
+
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -1884,66 +1541,29 @@ def search_municipios():
 @login_required
 def get_revenda_territory_data(revenda_id):
     try:
-        # Ensure tables exist
-        with app.app_context():
-            db.create_all()
-            
+        store = DATA_REGISTRY.current()
         revenda = Revenda.query.get_or_404(revenda_id)
-        print(f"Loading territory data for revenda: {revenda.nome} (ID: {revenda_id})")
-        
+
         # Obter lista de municípios da revenda
         municipios_codes = revenda.get_municipios_list()
-        print(f"Municipality codes from revenda: {municipios_codes}")
-        
         if not municipios_codes:
-            print("No municipalities found for this revenda")
             return jsonify({'success': False, 'error': 'Nenhum município cadastrado para esta revenda'}), 400
-        
-        # Buscar dados reais dos municípios nos dados de culturas
-        territory_data = {}
-        municipalities_found = 0
-        
-        for code in municipios_codes:
-            code_str = str(code)
-            # Buscar informações do município nos dados disponíveis
-            municipality_name = f"Município {code}"
-            state_code = "XX"
-            found = False
-            
-            # Procurar nos dados de culturas para obter nomes reais
-            for crop_name, crop_data in CROP_DATA.items():
-                if code_str in crop_data:
-                    municipality_data = crop_data[code_str]
-                    municipality_name = municipality_data.get('municipality_name', municipality_name)
-                    state_code = municipality_data.get('state_code', state_code)
-                    found = True
-                    municipalities_found += 1
-                    print(f"Found municipality {code}: {municipality_name} ({state_code}) in crop {crop_name}")
-                    break
-            
-            if not found:
-                print(f"Municipality {code} not found in crop data, using default name")
-            
-            territory_data[code_str] = {
-                'municipality_name': municipality_name,
-                'state_code': state_code,
-                'harvested_area': 1,  # Valor fixo compatível com outros dados
-                'unit': 'território'
-            }
-        
-        print(f"Territory data created for {len(territory_data)} municipalities ({municipalities_found} found in crop data)")
-        print(f"Territory data keys: {list(territory_data.keys())}")
-        
+
+        # Nome/UF pela dimensão de municípios; indicadores somados sobre a máscara do território
+        territory_data, municipalities_found = build_territory_data(store, municipios_codes)
+        rows, missing = store.municipalities.rows_of(municipios_codes)
+
         return jsonify({
             'success': True,
             'data': territory_data,
-            'type': 'revendas'
+            'type': 'revendas',
+            'municipalities_found': municipalities_found,
+            'missing_codes': missing,
+            'indicators': territory_indicators(store, rows)
         })
-        
+
     except Exception as e:
         print(f"Erro ao carregar dados de território da revenda {revenda_id}: {str(e)}")
-        import traceback
-        traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # Definir todas as tabelas antes de importar routes
@@ -1953,32 +1573,86 @@ class Revenda(db.Model):
     nome = db.Column(db.String(200), nullable=False)
     cnpj = db.Column(db.String(18), nullable=False, unique=True)
     cnae = db.Column(db.String(10), nullable=False)
-    municipios = db.Column(db.Text, nullable=False)  # JSON string com lista de códigos de municípios
+    municipios = db.Column(db.Text, nullable=False)  # Cópia JSON legada do território (fonte: revenda_municipio)
+    municipios_count = db.Column(db.Integer, nullable=False, default=0)  # Tamanho do território, mantido na escrita
     cor = db.Column(db.String(7), nullable=False, default='#4CAF50')  # Cor hex para visualização
     ativo = db.Column(db.Boolean, nullable=False, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    territorio = db.relationship('RevendaMunicipio', cascade='all, delete-orphan',
+                                 order_by='RevendaMunicipio.position')
 
     def __repr__(self):
         return f'<Revenda {self.nome}>'
 
     def get_municipios_list(self):
-        """Retorna lista de códigos de municípios"""
-        import json
-        try:
-            return json.loads(self.municipios) if self.municipios else []
-        except:
-            return []
+        """Retorna lista de códigos de municípios, na ordem em que foram cadastrados"""
+        return [link.municipio_code for link in self.territorio]
 
     def set_municipios_list(self, municipios_list):
-        """Define lista de códigos de municípios"""
-        import json
-        self.municipios = json.dumps(municipios_list)
+        """Define lista de códigos de municípios (associações, contagem e cópia JSON)"""
+        codes = list(dict.fromkeys(str(code) for code in municipios_list))
+        # Mantém as associações que continuam no território (só a posição muda) e cria as novas
+        existing = {link.municipio_code: link for link in self.territorio}
+        territorio = []
+        for position, code in enumerate(codes):
+            link = existing.get(code) or RevendaMunicipio(municipio_code=code)
+            link.position = position
+            territorio.append(link)
+        self.territorio = territorio
+        self.municipios_count = len(codes)
+        self.municipios = json.dumps(codes)
+
+class RevendaMunicipio(db.Model):
+    """Associação revenda ↔ município (território normalizado)"""
+    __tablename__ = 'revenda_municipio'
+    # PK composta indexa revenda_id; municipio_code tem índice próprio ("quem atende o município X")
+    revenda_id = db.Column(db.Integer, db.ForeignKey('revenda.id'), primary_key=True)
+    municipio_code = db.Column(db.String(7), primary_key=True, index=True)
+    position = db.Column(db.Integer, nullable=False, default=0)  # Ordem de cadastro no território
+
+def revenda_schema_outdated():
+    """Colunas que o banco ainda não tem (banco criado antes da tabela revenda_municipio)"""
+    inspector = db.inspect(db.engine)
+    missing = []
+    for table, column in (('revenda', 'municipios_count'), ('revenda_municipio', 'position')):
+        if inspector.has_table(table) and column not in {c['name'] for c in inspector.get_columns(table)}:
+            missing.append(f'{table}.{column}')
+    return missing
+
+@app.cli.command('migrate-revendas')
+def migrate_revenda_territories():
+    """Migra territórios do JSON legado para revenda_municipio (rodar uma vez, com a aplicação parada):
+    flask --app main migrate-revendas"""
+    missing = revenda_schema_outdated()
+    with db.engine.begin() as connection:
+        if 'revenda.municipios_count' in missing:
+            connection.execute(db.text('ALTER TABLE revenda ADD COLUMN municipios_count INTEGER NOT NULL DEFAULT 0'))
+        if 'revenda_municipio.position' in missing:
+            connection.execute(db.text('ALTER TABLE revenda_municipio ADD COLUMN position INTEGER NOT NULL DEFAULT 0'))
+
+    # Sem a coluna de posição, todas as associações são refeitas a partir da cópia JSON (que guarda a ordem)
+    query = Revenda.query.filter(Revenda.municipios != '[]')
+    if 'revenda_municipio.position' not in missing:
+        query = query.filter(~Revenda.id.in_(db.session.query(RevendaMunicipio.revenda_id).distinct()))
+    pending = query.all()
+    for revenda in pending:
+        try:
+            codes = json.loads(revenda.municipios) if revenda.municipios else []
+        except ValueError:
+            codes = []
+        revenda.set_municipios_list(codes)
+    db.session.commit()
+    print(f"Territórios migrados para revenda_municipio: {len(pending)} revendas")
 
 # Create tables
 with app.app_context():
     db.create_all()
     print("Tabelas criadas com sucesso!")
+    # Migração fora da importação: vários workers poderiam alterar o banco ao mesmo tempo
+    outdated = revenda_schema_outdated()
+    if outdated:
+        print(f"Banco desatualizado ({', '.join(outdated)}): execute 'flask --app main migrate-revendas'")
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
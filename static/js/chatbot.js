@@ -486,36 +486,9 @@ async function fetchCropAnalysis(cropName, stateCode) {
         // Tentar encontrar o nome real da cultura
         const realCropName = cropNameMapping[cropName.toLowerCase()] || cropName;
 
-        // Buscar dados da cultura
-        let response = await fetch(`/api/crop-data/${encodeURIComponent(realCropName)}`);
-        let data = await response.json();
-
-        // Se não encontrou, tentar com o nome original
-        if (!data.success && realCropName !== cropName) {
-            response = await fetch(`/api/crop-data/${encodeURIComponent(cropName)}`);
-            data = await response.json();
-        }
-
-        // Se ainda não encontrou, tentar buscar por similaridade
-        if (!data.success) {
-            // Buscar lista de culturas disponíveis
-            const cropsResponse = await fetch('/api/crops');
-            const cropsData = await cropsResponse.json();
-
-            if (cropsData.success) {
-                const availableCrops = cropsData.crops;
-                const similarCrop = findSimilarCropName(cropName, availableCrops);
-
-                if (similarCrop) {
-                    response = await fetch(`/api/crop-data/${encodeURIComponent(similarCrop)}`);
-                    data = await response.json();
-
-                    if (data.success) {
-                        console.log(`Cultura encontrada por similaridade: ${cropName} -> ${similarCrop}`);
-                    }
-                }
-            }
-        }
+        // Buscar dados da cultura numa única requisição (o servidor resolve nomes aproximados)
+        const response = await fetch(`/api/crop-data/${encodeURIComponent(realCropName)}`);
+        const data = await response.json();
 
         if (!data.success) {
             return { success: false };
@@ -534,13 +507,21 @@ async function fetchCropAnalysis(cropName, stateCode) {
         const finalCropName = data.matched_crop || realCropName;
 
         try {
-            const statsResponse = await fetch(`/api/analysis/statistical-summary/${encodeURIComponent(finalCropName)}`);
-            const statsData = await statsResponse.json();
+            // Maiores produtores vêm do índice de ranking do servidor (sem ordenar tudo aqui)
+            const topParams = new URLSearchParams({ source: 'crop', category: finalCropName, k: 3 });
+            if (stateCode) {
+                topParams.set('state', stateCode);
+            }
+            const [statsData, topData] = await Promise.all([
+                fetch(`/api/analysis/statistical-summary/${encodeURIComponent(finalCropName)}`).then(r => r.json()),
+                fetch(`/api/top?${topParams}`).then(r => r.json())
+            ]);
 
             return {
                 success: true,
                 cropData: analysisData,
                 statistics: statsData.success ? statsData.summary : null,
+                topProducers: topData.success ? topData.items : [],
                 cropName: finalCropName,
                 stateCode: stateCode
             };
@@ -561,55 +542,6 @@ async function fetchCropAnalysis(cropName, stateCode) {
     }
 }
 
-// Função para encontrar cultura similar na lista disponível
-function findSimilarCropName(searchName, availableCrops) {
-    const normalizedSearch = searchName.toLowerCase()
-        .normalize('NFD')
-        .replace(/[\u0300-\u036f]/g, '');
-
-    let bestMatch = null;
-    let highestScore = 0;
-
-    for (const crop of availableCrops) {
-        const normalizedCrop = crop.toLowerCase()
-            .normalize('NFD')
-            .replace(/[\u0300-\u036f]/g, '');
-
-        // Verifica se o termo de busca está contido no nome da cultura
-        if (normalizedCrop.includes(normalizedSearch) || normalizedSearch.includes(normalizedCrop)) {
-            const score = Math.min(normalizedSearch.length, normalizedCrop.length) / 
-                         Math.max(normalizedSearch.length, normalizedCrop.length);
-
-            if (score > highestScore) {
-                highestScore = score;
-                bestMatch = crop;
-            }
-        }
-
-        // Verifica correspondência por palavras
-        const searchWords = normalizedSearch.split(' ');
-        const cropWords = normalizedCrop.split(' ');
-
-        for (const searchWord of searchWords) {
-            for (const cropWord of cropWords) {
-                if (searchWord.length >= 3 && cropWord.length >= 3) {
-                    if (cropWord.includes(searchWord) || searchWord.includes(cropWord)) {
-                        const score = Math.min(searchWord.length, cropWord.length) / 
-                                     Math.max(searchWord.length, cropWord.length);
-
-                        if (score > highestScore && score > 0.7) {
-                            highestScore = score;
-                            bestMatch = crop;
-                        }
-                    }
-                }
-            }
-        }
-    }
-
-    return highestScore > 0.5 ? bestMatch : null;
-}
-
 // Gerar texto de análise
 function generateAnalysisText(command, cropData) {
     const { cropName, stateCode } = cropData;
@@ -631,10 +563,16 @@ function generateAnalysisText(command, cropData) {
     const totalArea = validMunicipalities.reduce((sum, m) => sum + parseFloat(m.harvested_area), 0);
     const avgArea = totalArea / validMunicipalities.length;
 
-    // Ordenar todos os municípios por área colhida (maior para menor)
-    const sortedMunicipalities = validMunicipalities.sort((a, b) => 
-        parseFloat(b.harvested_area) - parseFloat(a.harvested_area)
-    );
+    // Maiores produtores pelo índice de ranking do servidor; ordena localmente só se ele faltar
+    const sortedMunicipalities = (cropData.topProducers && cropData.topProducers.length)
+        ? cropData.topProducers.map(item => ({
+            municipality_name: item.municipality_name,
+            state_code: item.state_code,
+            harvested_area: item.value
+        }))
+        : validMunicipalities.sort((a, b) =>
+            parseFloat(b.harvested_area) - parseFloat(a.harvested_area)
+        ).slice(0, 3);
 
     // Município com maior produção
     const topMunicipality = sortedMunicipalities[0];
@@ -781,29 +719,10 @@ function addMessage(message, isUser = false) {
                 button.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i>Preparando...';
                 button.disabled = true;
 
-                // Make request to export endpoint
-                const response = await fetch(`/api/export/crop-analysis/${encodeURIComponent(cropName)}`);
-
-                if (!response.ok) {
-                    throw new Error('Erro ao gerar planilha');
-                }
-
-                // Get the blob and create download link
-                const blob = await response.blob();
-                const url = window.URL.createObjectURL(blob);
-                const a = document.createElement('a');
-                a.style.display = 'none';
-                a.href = url;
-
-                // Generate filename
-                const safeCropName = cropName.replace(/[/\\:*?"<>|]/g, '_');
-                const timestamp = new Date().toISOString().slice(0, 19).replace(/[:-]/g, '');
-                a.download = `analise_${safeCropName}_${timestamp}.xlsx`;
-
-                document.body.appendChild(a);
-                a.click();
-                window.URL.revokeObjectURL(url);
-                document.body.removeChild(a);
+                // Generated as a background job; the button shows progress until the download starts
+                await downloadExport(`/api/export/crop-analysis/${encodeURIComponent(cropName)}`, job => {
+                    button.innerHTML = `<i class="fas fa-spinner fa-spin me-1"></i>${describeExportProgress(job)}`;
+                });
 
                 // Show success message
                 addMessage(`✅ Planilha da análise de <strong>${cropName}</strong> baixada com sucesso! O arquivo contém dados detalhados, resumo estatístico e ranking dos maiores produtores.`);
@@ -836,33 +755,10 @@ async function downloadCropExcel(cropName, stateCode = null) {
             exportUrl += `?state=${stateCode}`;
         }
 
-        // Fazer requisição para o endpoint de exportação
-        const response = await fetch(exportUrl);
-
-        if (!response.ok) {
-            throw new Error('Erro ao gerar planilha');
-        }
-
-        // Obter o blob e criar link de download
-        const blob = await response.blob();
-        const url = window.URL.createObjectURL(blob);
-        const a = document.createElement('a');
-        a.style.display = 'none';
-        a.href = url;
-
-        // Gerar nome do arquivo
-        const safeCropName = cropName.replace(/[/\\:*?"<>|]/g, '_');
-        const timestamp = new Date().toISOString().slice(0, 19).replace(/[:-]/g, '');
-        a.download = `analise_${safeCropName}_${timestamp}.xlsx`;
-
-        document.body.appendChild(a);
-        a.click();
-
-        // Aguardar um pouco para garantir que o download foi iniciado
-        await new Promise(resolve => setTimeout(resolve, 1000));
-
-        window.URL.revokeObjectURL(url);
-        document.body.removeChild(a);
+        // Gerada em segundo plano; o botão mostra o progresso até o download começar
+        await downloadExport(exportUrl, job => {
+            button.innerHTML = `<i class="fas fa-spinner fa-spin"></i> ${describeExportProgress(job)}`;
+        });
 
         // Mostrar mensagem de sucesso no chat
         const stateInfo = stateCode ? ` do estado <strong>${stateCode}</strong>` : ' nacional';
@@ -0,0 +1,56 @@
+// Exportações em segundo plano: cria o job, acompanha o progresso e baixa o arquivo pronto
+const EXPORT_JOB_POLL_INTERVAL = 1000;
+
+async function runExportJob(exportUrl, onProgress = null) {
+    const response = await fetch('/api/export/jobs', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ url: exportUrl })
+    });
+    let job = await response.json();
+    if (!response.ok || !job.success) {
+        throw new Error(job.error || 'Erro ao agendar exportação');
+    }
+
+    const statusUrl = `${job.status_url}?token=${encodeURIComponent(job.token)}`;
+    while (job.status === 'queued' || job.status === 'running') {
+        if (onProgress) {
+            onProgress(job);
+        }
+        await new Promise(resolve => setTimeout(resolve, EXPORT_JOB_POLL_INTERVAL));
+        const statusResponse = await fetch(statusUrl);
+        job = await statusResponse.json();
+        if (!statusResponse.ok || !job.success) {
+            throw new Error(job.error || 'Erro ao consultar exportação');
+        }
+    }
+
+    if (job.status !== 'done') {
+        throw new Error(job.error || 'Erro ao gerar exportação');
+    }
+    return job;
+}
+
+async function downloadExport(exportUrl, onProgress = null) {
+    const job = await runExportJob(exportUrl, onProgress);
+
+    // Link direto para o arquivo pronto (nome vem do Content-Disposition)
+    const link = document.createElement('a');
+    link.href = job.download_url;
+    link.style.display = 'none';
+    document.body.appendChild(link);
+    link.click();
+    document.body.removeChild(link);
+    return job;
+}
+
+function describeExportProgress(job) {
+    if (job.status === 'queued') {
+        return 'Na fila...';
+    }
+    return job.progress.rows ? `Gerando... ${job.progress.rows.toLocaleString('pt-BR')} linhas` : 'Gerando...';
+}
+
+window.runExportJob = runExportJob;
+window.downloadExport = downloadExport;
+window.describeExportProgress = describeExportProgress;
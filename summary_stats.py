@@ -0,0 +1,76 @@
+import numpy as np
+
+from dataset_engine import SOURCES_BY_NAME
+
+# Número de faixas do histograma do resumo estatístico
+HISTOGRAM_BINS = 20
+# Percentis devolvidos em `quantiles`
+SUMMARY_PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def _first_mode(values):
+    """Most frequent value (first one seen on ties, like statistics.mode); None if all unique"""
+    unique, first_index, counts = np.unique(values, return_index=True, return_counts=True)
+    if counts.max() < 2:
+        return None
+    candidates = np.flatnonzero(counts == counts.max())
+    return unique[candidates[np.argmin(first_index[candidates])]]
+
+
+def summarize(values, integral=False):
+    """Descriptive statistics of a 1-D array of values (in data order)"""
+    count = len(values)
+    ordered = np.sort(values)
+    native = int if integral else float
+    total = ordered.sum()
+    mean = total / count
+    deviations = ordered - mean
+    m2 = np.mean(deviations ** 2)
+
+    # Quantis pelo método exclusivo (n+1), o mesmo de statistics.quantiles
+    percentiles = np.percentile(ordered, SUMMARY_PERCENTILES, method='weibull') if count >= 4 else None
+    counts, edges = np.histogram(ordered, bins=HISTOGRAM_BINS)
+
+    mode = _first_mode(values)
+    if total > 0 and ordered[0] >= 0:
+        # Gini sobre os valores ordenados: 2·Σ(i·x_i)/(n·Σx) − (n+1)/n
+        ranks = np.arange(1, count + 1)
+        gini = float(2 * np.dot(ranks, ordered) / (count * total) - (count + 1) / count)
+    else:
+        gini = None
+
+    return {
+        'count': count,
+        'total': native(total),
+        'mean': float(mean),
+        'median': float(np.median(ordered)),
+        'mode': native(mode) if mode is not None else None,
+        'std_dev': float(np.std(ordered, ddof=1)) if count > 1 else 0,
+        'min': native(ordered[0]),
+        'max': native(ordered[-1]),
+        'q1': float(percentiles[1]) if percentiles is not None else None,
+        'q3': float(percentiles[3]) if percentiles is not None else None,
+        'quantiles': {
+            f'p{p}': float(value) for p, value in zip(SUMMARY_PERCENTILES, percentiles)
+        } if percentiles is not None else None,
+        'skewness': float(np.mean(deviations ** 3) / m2 ** 1.5) if m2 > 0 else 0,
+        'gini': gini,
+        'histogram': {
+            'edges': edges.tolist(),
+            'counts': counts.tolist()
+        }
+    }
+
+
+def category_summary(store, source, category, state=None):
+    """Summary of a category (valid municipalities of the source policy, optionally one state),
+    computed once per store version; None when there are no values"""
+    def build(s):
+        dataset = s[source]
+        rows = dataset.rows(category, SOURCES_BY_NAME[source]['filter'], state)
+        if not len(rows):
+            return {}
+        i = dataset.category_index[category]
+        return summarize(dataset.values[i, rows], bool(dataset.integral[i]))
+
+    return store.derived(('summary', source, category, state), build) or None
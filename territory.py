@@ -0,0 +1,249 @@
+import heapq
+
+import numpy as np
+
+from dataset_engine import SOURCES_BY_NAME, FILTER_BASIC
+
+
+def territory_indicators(store, rows):
+    """Totals of every category of every source over the territory rows:
+    {source: {category: {total, municipalities, unit}}}, only categories with data"""
+    # Códigos repetidos no território não podem somar duas vezes
+    rows = np.unique(rows)
+    indicators = {}
+    for name, dataset in store.datasets.items():
+        if not dataset.categories or not len(rows):
+            continue
+        selected = dataset.values[:, rows]
+        present = ~np.isnan(selected)
+        counts = present.sum(axis=1)
+        totals = np.where(present, selected, 0).sum(axis=1)
+        source_indicators = {}
+        for i in np.flatnonzero(counts).tolist():
+            category = dataset.categories[i]
+            source_indicators[category] = {
+                'total': int(totals[i]) if dataset.integral[i] else float(totals[i]),
+                'municipalities': int(counts[i]),
+                'unit': dataset.units[i] or SOURCES_BY_NAME[name]['unit']
+            }
+        if source_indicators:
+            indicators[name] = source_indicators
+    return indicators
+
+
+def build_territory_data(store, municipios_codes):
+    """Territory layer records for a list of municipality codes; returns (data, found_count)
+
+    Nome e UF vêm da dimensão de municípios (lookup O(1) por código); o valor de cada
+    município é a área colhida total de todas as culturas.
+    """
+    municipalities = store.municipalities
+    crops = store['crop']
+    rows, _ = municipalities.rows_of(municipios_codes)
+    crop_values = crops.values[:, rows]
+    crop_totals = np.where(np.isnan(crop_values), 0, crop_values).sum(axis=0) if crops.categories else np.zeros(len(rows))
+    found = {str(municipalities.codes[row]): (row, total) for row, total in zip(rows.tolist(), crop_totals.tolist())}
+
+    territory_data = {}
+    for code in municipios_codes:
+        code_str = str(code)
+        row, total = found.get(code_str, (None, 0))
+        territory_data[code_str] = {
+            'municipality_name': (municipalities.names[row] if row is not None else None) or f"Município {code}",
+            'state_code': str(municipalities.states[row]) if row is not None else "XX",
+            'harvested_area': round(total, 2),
+            'unit': 'hectares'
+        }
+
+    return territory_data, len(found)
+
+
+class TerritoryMasks:
+    """One boolean mask (bitset) per revenda over the municipality dimension"""
+
+    def __init__(self, municipalities, territories):
+        self.municipalities = municipalities
+        self.ids = list(territories)
+        self.matrix = np.zeros((len(self.ids), len(municipalities)), dtype=bool)
+        self.missing = {}
+        for i, revenda_id in enumerate(self.ids):
+            rows, missing = municipalities.rows_of(territories[revenda_id])
+            self.matrix[i, rows] = True
+            if missing:
+                self.missing[revenda_id] = missing
+        self.sizes = self.matrix.sum(axis=1)
+        # Quantas revendas atendem cada município
+        self.multiplicity = self.matrix.sum(axis=0)
+        self._overlaps = {}
+        self._float_matrix = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def covered(self):
+        return self.multiplicity > 0
+
+    def overlaps(self, revenda_id=None):
+        """Pairs of territories sharing municipalities: (i, j, shared rows count), most shared first"""
+        if revenda_id not in self._overlaps:
+            self._overlaps[revenda_id] = self._compute_overlaps(revenda_id)
+        return self._overlaps[revenda_id]
+
+    def _compute_overlaps(self, revenda_id):
+        # Só municípios com 2+ revendas podem gerar sobreposição
+        shared = self.multiplicity > 1
+        if not shared.any():
+            return []
+        if revenda_id is not None:
+            i = self.ids.index(revenda_id)
+            counts = self.matrix[:, self.matrix[i] & shared].sum(axis=1)
+            counts[i] = 0
+            second = np.flatnonzero(counts)
+            first = np.full(len(second), i)
+            shared_counts = counts[second]
+        else:
+            first, second, shared_counts = self._pair_counts(np.flatnonzero(shared))
+        order = np.argsort(-shared_counts, kind='stable')
+        return list(zip(first[order].tolist(), second[order].tolist(), shared_counts[order].astype(int).tolist()))
+
+    def _pair_counts(self, shared_columns):
+        """(i, j, count) of every pair i < j sharing municipalities, from the revendas of each
+        shared municipality (memória proporcional aos pares, sem matriz densa R x R)"""
+        columns, revendas = np.nonzero(self.matrix[:, shared_columns].T)
+        bounds = np.flatnonzero(np.diff(columns)) + 1
+        size = len(self.ids)
+        keys = []
+        for group in np.split(revendas, bounds):
+            a, b = np.triu_indices(len(group), k=1)
+            keys.append(group[a].astype(np.int64) * size + group[b])
+        keys, counts = np.unique(np.concatenate(keys), return_counts=True)
+        return keys // size, keys % size, counts
+
+    def totals(self, values):
+        """Sum of a per-municipality vector over each territory (one matrix-vector product)"""
+        if self._float_matrix is None:
+            self._float_matrix = self.matrix.astype(np.float32)
+        return self._float_matrix @ values.astype(np.float32)
+
+    def shared_codes(self, i, j):
+        return self.municipalities.codes[self.matrix[i] & self.matrix[j]].tolist()
+
+
+def potential_values(store, source=None, category=None):
+    """Per-municipality potential used to rank uncovered municipalities: one category of a
+    source, or by default the total harvested area over all crops (NaN/ausente = 0)"""
+    if source:
+        values = store[source].column(category)
+    else:
+        crops = store['crop']
+        if not crops.categories:
+            return np.zeros(len(store.municipalities))
+        values = np.where(np.isnan(crops.values), 0, crops.values).sum(axis=0)
+    return np.where(np.isnan(values), 0, values)
+
+
+def territory_coverage(store, masks, potential, state=None, top_k=10):
+    """Coverage of the valid municipalities by the territories, nationally and per UF, with the
+    `top_k` uncovered municipalities of highest potential in each UF"""
+    municipalities = store.municipalities
+    valid = municipalities.valid_mask(FILTER_BASIC)
+    if state:
+        valid = valid & municipalities.state_mask(state)
+    covered = masks.covered() & valid
+    uncovered = valid & ~covered
+
+    states = municipalities.states
+    result = []
+    for uf in np.unique(states[valid]).tolist():
+        in_state = states == uf
+        total = int((valid & in_state).sum())
+        covered_count = int((covered & in_state).sum())
+        candidates = np.flatnonzero(uncovered & in_state & (potential > 0))
+        best = candidates[np.argsort(-potential[candidates], kind='stable')[:top_k]]
+        result.append({
+            'state_code': str(uf),
+            'municipalities': total,
+            'covered': covered_count,
+            'coverage_pct': round(100.0 * covered_count / total, 2) if total else 0.0,
+            'uncovered_potential': float(potential[uncovered & in_state].sum()),
+            'top_uncovered': [
+                {
+                    'municipality_code': str(municipalities.codes[row]),
+                    'municipality_name': municipalities.names[row],
+                    'potential': float(potential[row])
+                }
+                for row in best.tolist()
+            ]
+        })
+
+    total = int(valid.sum())
+    covered_count = int(covered.sum())
+    return {
+        'municipalities': total,
+        'covered': covered_count,
+        'coverage_pct': round(100.0 * covered_count / total, 2) if total else 0.0,
+        'multiple_coverage': int(((masks.multiplicity > 1) & valid).sum()),
+        'covered_potential': float(potential[covered].sum()),
+        'uncovered_potential': float(potential[uncovered].sum()),
+        'states': result
+    }
+
+
+class CentroidGrid:
+    """Uniform lat/lon grid over candidate centroids for radius queries"""
+
+    def __init__(self, geometry, rows, cell_degrees=0.5):
+        self.geometry = geometry
+        self.cell = cell_degrees
+        rows = rows[~np.isnan(geometry.lat[rows])]
+        keys = np.floor(np.column_stack([geometry.lon[rows], geometry.lat[rows]]) / cell_degrees).astype(np.int64)
+        self.cells = {}
+        for key, row in zip(map(tuple, keys.tolist()), rows.tolist()):
+            self.cells.setdefault(key, []).append(row)
+
+    def within(self, row, km):
+        """Candidate rows whose centroid is at most `km` from the centroid of `row`"""
+        lat, lon = self.geometry.lat[row], self.geometry.lon[row]
+        if np.isnan(lat):
+            return np.empty(0, dtype=np.intp)
+        dlat = km / 111.0
+        dlon = km / (111.0 * max(np.cos(np.radians(lat)), 0.01))
+        x0, x1 = int(np.floor((lon - dlon) / self.cell)), int(np.floor((lon + dlon) / self.cell))
+        y0, y1 = int(np.floor((lat - dlat) / self.cell)), int(np.floor((lat + dlat) / self.cell))
+        found = [r for x in range(x0, x1 + 1) for y in range(y0, y1 + 1) for r in self.cells.get((x, y), ())]
+        if not found:
+            return np.empty(0, dtype=np.intp)
+        found = np.array(found, dtype=np.intp)
+        return found[self.geometry.distances_km(row, found) <= km]
+
+
+def recommend_expansion(geometry, territory_rows, candidate_mask, scores, n, max_distance_km=None):
+    """Greedy expansion: repeatedly add the best-scoring candidate adjacent to (or within
+    `max_distance_km` of) the territory grown so far. Returns [(row, origin_row, reason)]."""
+    queued = np.zeros(len(scores), dtype=bool)
+    origin = {}
+    heap = []
+    grid = CentroidGrid(geometry, np.flatnonzero(candidate_mask)) if max_distance_km else None
+
+    def offer(source_row, rows, reason):
+        rows = rows[candidate_mask[rows] & ~queued[rows]]
+        queued[rows] = True
+        for row in rows.tolist():
+            origin[row] = (source_row, reason)
+            heapq.heappush(heap, (-scores[row], row))
+
+    def expand(row):
+        # Contíguos primeiro: um município vizinho e próximo fica marcado como 'adjacent'
+        offer(row, geometry.neighbors(row), 'adjacent')
+        if grid is not None:
+            offer(row, grid.within(row, max_distance_km), 'distance')
+
+    for row in np.asarray(territory_rows).tolist():
+        expand(row)
+
+    chosen = []
+    while heap and len(chosen) < n:
+        _, row = heapq.heappop(heap)
+        chosen.append((row, *origin[row]))
+        expand(row)
+    return chosen